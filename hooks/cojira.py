@@ -2,43 +2,429 @@ from __future__ import annotations
 
 import argparse
 import json
+import sqlite3
+import subprocess
+import sys
+import threading
+from collections import Counter
+from collections.abc import Collection
+from collections.abc import Iterator
+from collections.abc import Mapping
 from collections.abc import Sequence
 from collections.abc import Set
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from contextlib import contextmanager
+from contextlib import nullcontext
+from difflib import get_close_matches
+from email.message import Message
+from functools import partial
+from itertools import count
+from math import ceil
 from os import environ
+from re import findall
 from re import search
+from time import monotonic
+from time import perf_counter
+from time import sleep
+from time import time
+from typing import Any
+from typing import NamedTuple
 from typing import SupportsIndex
 from urllib import request
+from urllib.error import HTTPError
+from urllib.error import URLError
+from urllib.parse import urlencode
+
+from hooks import commiticketing
+from hooks import jira_cache
+from hooks import jira_client
+from hooks import jira_daemon
+
+DEFAULT_TRAILERS = ('Refs',)
+SCISSORS = '# ------------------------ >8 ------------------------'
+SEARCH_BATCH = 200
+# seconds to wait for another process looking up the same ticket, in case
+# there is no timeout for requests
+LOCK_WAIT = 60
+# the COJIRA rules only need these, everything else (e.g., comments) is
+# left out of responses, which keeps their size independent of the ticket
+FIELDS = 'status,fixVersions'
+
+_daemon_spawned = False
+_daemon_lock = threading.Lock()
+
+
+def get_ticket_from_subject(subject_line: str) -> str | None:
+    ticketing = search(r'^([A-Z]{2,}-[1-9][0-9]*): .*', subject_line)
+    return None if not ticketing else ticketing.group(1)
 
 
 def get_ticket(commit_msg_filename: str) -> str | None:
     with open(commit_msg_filename, encoding='utf-8') as msg:
         lines = msg.readlines()
-        ticketing = search(r'^([A-Z]{2,}-[1-9][0-9]*): .*', lines[0])
-        return None if not ticketing else ticketing.group(1)
+        return get_ticket_from_subject(lines[0])
+
+
+def get_message_tickets(
+    message: str,
+    trailers: Collection[str] = DEFAULT_TRAILERS,
+) -> list[str]:
+    """
+    Besides the ticket of the subject line, further tickets may be referenced
+    in the body via trailers, e.g., `Refs: ABC-1, ABC-2`. Comment lines are
+    ignored, and so is everything below the scissors line of `git commit -v`.
+
+    :return: The referenced tickets (without duplicates), the one of the
+        subject line first; empty if the subject line references none
+    """
+    lines = message.splitlines()
+    subject_ticket = get_ticket_from_subject(lines[0]) if lines else None
+    if not subject_ticket:
+        return []
+    tickets = [subject_ticket]
+    names = frozenset(trailer.lower() for trailer in trailers)
+    for line in lines[1:]:
+        if line.startswith(SCISSORS):
+            break
+        name, colon, value = line.partition(':')
+        if colon and not line.startswith('#') and name.lower() in names:
+            tickets.extend(findall(r'\b[A-Z]{2,}-[1-9][0-9]*\b', value))
+    return list(dict.fromkeys(tickets))
+
+
+def get_tickets(
+    commit_msg_filename: str,
+    trailers: Collection[str] = DEFAULT_TRAILERS,
+) -> list[str]:
+    with open(commit_msg_filename, encoding='utf-8') as msg:
+        return get_message_tickets(msg.read(), trailers)
+
+
+def get_push_revisions() -> list[str]:
+    """
+    In the pre-push stage, pre-commit hands over the pushed range via the
+    environment. For new branches (or outside of pre-commit) there is no
+    remote counterpart, then everything not yet on any remote is checked.
+
+    :return: The revisions (as understood by `git log`) to be pushed
+    """
+    from_ref = environ.get('PRE_COMMIT_FROM_REF', '')
+    to_ref = environ.get('PRE_COMMIT_TO_REF', '') or 'HEAD'
+    if not from_ref.strip('0'):
+        return [to_ref, '--not', '--remotes']
+    return [f'{from_ref}..{to_ref}']
+
+
+def get_range_tickets(
+    revisions: Sequence[str],
+    trailers: Collection[str] = DEFAULT_TRAILERS,
+) -> list[tuple[str, list[str]]]:
+    """
+    :return: Each (non-merge) commit of the range together with the tickets
+        referenced by its message (cf. get_message_tickets)
+    """
+    log = subprocess.run(
+        ('git', 'log', '--no-merges', '-z', '--format=%H%n%B', *revisions),
+        capture_output=True, check=True, encoding='utf-8',
+    ).stdout
+    commits = []
+    for entry in filter(None, log.split('\0')):
+        commit, _, message = entry.lstrip('\n').partition('\n')
+        commits.append((commit, get_message_tickets(message, trailers)))
+    return commits
+
+
+@contextmanager
+def circuit_breaker(
+    jira_uri: str,
+    network: jira_client.RequestPolicy | None,
+) -> Iterator[None]:
+    """
+    Outages of JIRA (cf. jira_client.is_outage) are counted on disk, so that
+    once the failure threshold of the policy is reached, later lookups (even
+    by other processes) fail immediately instead of waiting for the timeout.
+
+    :raises URLError: In case the breaker is open
+    """
+    if not network or network.failure_threshold <= 0:
+        yield
+        return
+    with closing(jira_cache.connect()) as db:
+        if jira_cache.is_breaker_open(db, jira_uri):
+            raise URLError('Circuit breaker for JIRA is open')
+        try:
+            yield
+        except Exception as e:
+            if jira_client.is_outage(e):
+                jira_cache.record_failure(
+                    db, jira_uri, network.failure_threshold, network.cooldown,
+                )
+            raise
+        jira_cache.record_success(db, jira_uri)
+
+
+def throttle(
+    jira_uri: str,
+    network: jira_client.RequestPolicy | None,
+) -> None:
+    """
+    Keep the requests of all hook runs (e.g., of parallel CI jobs) on the host
+    below the rate limit of the policy, by waiting for a token of the shared
+    bucket (cf. jira_cache.take_token).
+
+    :raises TimeoutError: In case the token would not be available before the
+        deadline of the policy
+    """
+    if not network or network.rate <= 0:
+        return
+    max_wait = network.deadline - monotonic() \
+        if network.deadline is not None else None
+    with closing(jira_cache.connect()) as db:
+        delay = jira_cache.take_token(
+            db, jira_uri, network.rate, network.burst, max_wait,
+        )
+    if delay is None:
+        raise TimeoutError('Deadline for JIRA lookups exceeded by rate limit')
+    if delay > 0:
+        sleep(delay)
+
+
+@contextmanager
+def open_jira(
+    req: request.Request,
+    jira_uri: str,
+    network: jira_client.RequestPolicy | None,
+) -> Iterator[jira_client.Response]:
+    """
+    Open the request with the timeout, rate limit and circuit breaker of the
+    policy; in case JIRA asks to back off (cf. jira_client.get_backoff), the
+    request is retried.
+    """
+    with circuit_breaker(jira_uri, network):
+        for attempt in count():
+            throttle(jira_uri, network)
+            req.timeout = jira_client.get_timeout(network)
+            try:
+                resp = jira_client.urlopen(req)
+            except HTTPError as e:
+                delay = jira_client.get_backoff(e, attempt, network)
+                if delay is None:
+                    raise
+                sleep(delay)
+                continue
+            with resp:
+                yield resp
+            return
+
+
+def report_timings(
+    resp: jira_client.Response,
+    size: int,
+    **phases: float,
+) -> None:
+    """
+    In case $COJIRA_TIMINGS names a file, the durations (in seconds) of the
+    phases of the request (cf. jira_client.Response) are appended to it, as a
+    line of JSON.
+    """
+    path = environ.get('COJIRA_TIMINGS')
+    if not path:
+        return
+    line = json.dumps({
+        'time': time(),
+        'url': resp.url,
+        'status': resp.status,
+        'bytes': size,
+        **resp.phases,
+        **phases,
+    })
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
+
+
+def read_json(resp: jira_client.Response) -> Any:
+    """
+    :raises json.JSONDecodeError: In case the body is not valid JSON
+    :return: The parsed body of the response
+    """
+    start = perf_counter()
+    data = resp.read()
+    downloaded = perf_counter()
+    text = data.decode(resp.info().get_content_charset('utf-8'))
+    decoded = perf_counter()
+    try:
+        return json.loads(text)
+    finally:
+        report_timings(
+            resp, len(data),
+            body=downloaded - start,
+            decode=decoded - downloaded,
+            parse=perf_counter() - decoded,
+        )
+
+
+class JiraResponse(NamedTuple):
+    status: int
+    body: SupportsIndex | slice | None
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+def request_jira(
+    ticket: str,
+    jira_uri: str,
+    jira_pat: str,
+    validators: jira_cache.Validators | None = None,
+    network: jira_client.RequestPolicy | None = None,
+) -> JiraResponse:
+    """
+    In case validators of a cached response are given, the request is
+    conditional, i.e., JIRA answers with "304 Not Modified" and without a body,
+    if the cached response is still valid.
+    """
+    req = request.Request(
+        f'{jira_uri}/rest/api/latest/issue/{ticket}?'
+        + urlencode({'fields': FIELDS}),
+    )
+    req.add_header('Authorization', f'Bearer {jira_pat}')
+    if validators and validators.etag:
+        req.add_header('If-None-Match', validators.etag)
+    if validators and validators.last_modified:
+        req.add_header('If-Modified-Since', validators.last_modified)
+    with open_jira(req, jira_uri, network) as resp:
+        etag = resp.getheader('ETag')
+        last_modified = resp.getheader('Last-Modified')
+        if resp.status == 304:
+            report_timings(resp, 0)
+            return JiraResponse(304, None, etag, last_modified)
+        try:
+            body = read_json(resp)
+        except json.decoder.JSONDecodeError:  # unexpected response
+            body = None
+        return JiraResponse(resp.status, body, etag, last_modified)
 
 
 def fetch_jira(
     ticket: str,
     jira_uri: str,
     jira_pat: str,
+    network: jira_client.RequestPolicy | None = None,
 ) -> SupportsIndex | slice | None:
-    try:
-        req = request.Request(f'{jira_uri}/rest/api/latest/issue/{ticket}')
+    return request_jira(ticket, jira_uri, jira_pat, network=network).body
+
+
+def search_jira(
+    tickets: Collection[str],
+    jira_uri: str,
+    jira_pat: str,
+    network: jira_client.RequestPolicy | None = None,
+) -> dict[str, Any]:
+    """
+    Resolve many tickets with a (paginated) JQL search instead of one request
+    per ticket. Unknown keys are left out of the result instead of failing
+    the whole query (cf. validateQuery=warn).
+
+    :return: The bodies of the found tickets by their keys
+    """
+    bodies = {}
+    keys = sorted(tickets)
+    for batch in (
+        keys[i:i + SEARCH_BATCH] for i in range(0, len(keys), SEARCH_BATCH)
+    ):
+        for issue in search_jql(
+            f'key in ({",".join(batch)})', jira_uri, jira_pat, len(batch),
+            network,
+        ):
+            bodies[issue['key']] = issue
+    return bodies
+
+
+def search_jql(
+    jql: str,
+    jira_uri: str,
+    jira_pat: str,
+    page_size: int = SEARCH_BATCH,
+    network: jira_client.RequestPolicy | None = None,
+) -> Iterator[Any]:
+    """
+    :return: The issues matching the JQL (only with the fields needed for the
+        COJIRA rules), page by page
+    """
+    start_at = 0
+    while True:
+        query = urlencode({
+            'jql': jql,
+            'fields': FIELDS,
+            'validateQuery': 'warn',
+            'startAt': start_at,
+            'maxResults': page_size,
+        })
+        req = request.Request(f'{jira_uri}/rest/api/2/search?{query}')
         req.add_header('Authorization', f'Bearer {jira_pat}')
-        resp = request.urlopen(req)
-        return json.loads(
-            resp.read().decode(resp.info().get_param('charset') or 'utf-8'),
-        )
-    except json.decoder.JSONDecodeError:  # unexpected response
-        return None
+        with open_jira(req, jira_uri, network) as resp:
+            page = read_json(resp)
+        issues = page.get('issues') or []
+        yield from issues
+        start_at += len(issues)
+        if not issues or start_at >= page.get('total', 0):
+            return
 
 
-def get_ticket_version(
+def fetch_project_keys(
+    jira_uri: str,
+    jira_pat: str,
+    network: jira_client.RequestPolicy | None = None,
+) -> frozenset[str]:
+    """
+    :return: The keys of all projects of JIRA (visible to the user)
+    """
+    req = request.Request(f'{jira_uri}/rest/api/2/project')
+    req.add_header('Authorization', f'Bearer {jira_pat}')
+    with open_jira(req, jira_uri, network) as resp:
+        projects = read_json(resp)
+    return frozenset(project['key'] for project in projects)
+
+
+def revalidate_jira(
+    db: sqlite3.Connection,
     ticket: str,
     jira_uri: str,
     jira_pat: str,
-) -> str | None:
-    body = fetch_jira(ticket, jira_uri, jira_pat)
+    policy: jira_cache.CachePolicy,
+    network: jira_client.RequestPolicy | None = None,
+) -> SupportsIndex | slice | None:
+    """
+    Fetch the ticket into the cache; in case it is already cached (even if
+    expired), only ask JIRA whether it changed since.
+
+    :return: The body of the ticket, or None in case of an unexpected response
+    """
+    validators = jira_cache.load_validators(db, jira_uri, ticket)
+    response = request_jira(ticket, jira_uri, jira_pat, validators, network)
+    if response.status == 304 and validators:
+        jira_cache.touch(db, jira_uri, ticket)
+        return validators.body
+    if response.body is not None:
+        jira_cache.store(
+            db, jira_uri, ticket, response.body, policy, response.etag,
+            response.last_modified,
+        )
+    return response.body
+
+
+# JIRA answers with these for tickets, which do not exist or are not visible
+UNAVAILABLE = frozenset((403, 404))
+
+
+class IssueSnapshot(NamedTuple):
+    fix_version: str | None
+    status_category: str | None
+    unavailable: int | None = None
+    not_synced: bool = False
+
+
+def parse_ticket_version(body: SupportsIndex | slice | None) -> str | None:
     if not body:
         return None
     try:
@@ -48,12 +434,9 @@ def get_ticket_version(
         return None
 
 
-def get_ticket_status_category(
-    ticket: str,
-    jira_uri: str,
-    jira_pat: str,
+def parse_ticket_status_category(
+    body: SupportsIndex | slice | None,
 ) -> str | None:
-    body = fetch_jira(ticket, jira_uri, jira_pat)
     try:
         if body:
             return body['fields']['status']['statusCategory']['key']  # type: ignore[index]  # noqa: E501
@@ -63,6 +446,393 @@ def get_ticket_status_category(
         return None
 
 
+def load_cached(
+    db: sqlite3.Connection,
+    ticket: str,
+    jira_uri: str,
+    jira_pat: str,
+    policy: jira_cache.CachePolicy,
+    network: jira_client.RequestPolicy | None = None,
+) -> jira_cache.CacheEntry | None:
+    """
+    :raises HTTPError: In case the ticket is cached as unavailable
+    :return: The cached ticket, or None if it is not in the cache
+    """
+    if policy.ttl > 0:
+        entry = jira_cache.load(db, jira_uri, ticket, policy)
+        if entry is not None:
+            if entry.stale:
+                refresh_in_background(
+                    ticket, jira_uri, jira_pat, policy, network,
+                )
+            return entry
+    if policy.negative_ttl > 0:
+        code = jira_cache.load_unavailable(db, jira_uri, ticket, policy)
+        if code is not None:  # replay the refusal without asking again
+            raise HTTPError(
+                f'{jira_uri}/rest/api/latest/issue/{ticket}', code,
+                'Ticket is cached as unavailable', Message(), None,
+            )
+    return None
+
+
+def fetch_jira_cached(
+    ticket: str,
+    jira_uri: str,
+    jira_pat: str,
+    policy: jira_cache.CachePolicy,
+    network: jira_client.RequestPolicy | None = None,
+) -> SupportsIndex | slice | None:
+    """
+    In case of a cache miss, only one process (e.g., of many parallel CI jobs)
+    asks JIRA for the ticket, the others wait for it and then take its answer
+    from the cache (cf. jira_cache.single_flight).
+    """
+    with closing(jira_cache.connect()) as db:
+        entry = load_cached(db, ticket, jira_uri, jira_pat, policy, network)
+        if entry is not None:
+            return entry.body
+        with jira_cache.single_flight(
+            jira_uri, ticket, jira_client.get_timeout(network) or LOCK_WAIT,
+        ) if policy.ttl > 0 else nullcontext():
+            entry = load_cached(
+                db, ticket, jira_uri, jira_pat, policy, network,
+            )
+            if entry is not None:
+                return entry.body
+            try:
+                if policy.ttl > 0:
+                    return revalidate_jira(
+                        db, ticket, jira_uri, jira_pat, policy, network,
+                    )
+                return fetch_jira(ticket, jira_uri, jira_pat, network)
+            except HTTPError as e:
+                if e.code in UNAVAILABLE and policy.negative_ttl > 0:
+                    jira_cache.store_unavailable(
+                        db, jira_uri, ticket, e.code, policy,
+                    )
+                raise
+
+
+def refresh_in_background(
+    ticket: str,
+    jira_uri: str,
+    jira_pat: str,
+    policy: jira_cache.CachePolicy,
+    network: jira_client.RequestPolicy | None = None,
+) -> None:
+    """
+    Start `cojira refresh` as a detached process, so that the commit does not
+    wait for it. The PAT is handed over via the environment, so that it does
+    not show up in the process list.
+    """
+    network = network or jira_client.RequestPolicy()
+    spawn_detached(
+        'refresh', ticket,
+        f'--jira-uri={jira_uri}', '--jira-pat=$COJIRA_REFRESH_PAT',
+        f'--cache-ttl={policy.ttl}', f'--cache-size={policy.max_entries}',
+        f'--timeout={network.timeout or 0}',
+        f'--rate-limit={network.rate}', f'--rate-burst={network.burst}',
+        env={**environ, 'COJIRA_REFRESH_PAT': jira_pat or ''},
+    )
+
+
+def spawn_daemon() -> None:
+    """
+    Start `cojira daemon` as a detached process, at most once per run of the
+    hook, even if many lookups (of the thread pool) find it not running.
+    """
+    global _daemon_spawned
+    with _daemon_lock:
+        if _daemon_spawned:
+            return
+        _daemon_spawned = True
+    spawn_detached('daemon')
+
+
+def spawn_detached(*argv: str, env: dict[str, str] | None = None) -> None:
+    """
+    Start `cojira <argv>` as a process, which outlives the hook. The standard
+    streams are detached as well, otherwise pre-commit would wait for the
+    process to close them.
+    """
+    if sys.platform == 'win32':  # pragma: no cover
+        creationflags = subprocess.DETACHED_PROCESS \
+            | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        creationflags = 0
+    subprocess.Popen(
+        (sys.executable, '-m', 'hooks.cojira', *argv),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=env,
+        creationflags=creationflags,
+        start_new_session=sys.platform != 'win32',
+    )
+
+
+def refresh(argv: Sequence[str]) -> int:
+    parser = argparse.ArgumentParser(prog='cojira refresh')
+    parser.add_argument('ticket', help='Ticket to refresh in the cache')
+    parser.add_argument('-u', '--jira-uri', required=True)
+    parser.add_argument('-p', '--jira-pat')
+    parser.add_argument('-c', '--cache-ttl', type=float, default=0)
+    parser.add_argument('--cache-size', type=int, default=512)
+    parser.add_argument('--timeout', type=float, default=0)
+    parser.add_argument('--rate-limit', type=float, default=0)
+    parser.add_argument('--rate-burst', type=int, default=1)
+    args = parser.parse_args(argv)
+    if args.jira_pat and args.jira_pat.startswith('$'):  # pragma: no mutate
+        args.jira_pat = environ.get(args.jira_pat[1:], '')
+
+    policy = jira_cache.CachePolicy(args.cache_ttl, args.cache_size)
+    network = jira_client.RequestPolicy(
+        args.timeout or None, rate=args.rate_limit, burst=args.rate_burst,
+    )
+    with closing(jira_cache.connect()) as db:
+        body = revalidate_jira(
+            db, args.ticket, args.jira_uri, args.jira_pat, policy, network,
+        )
+    return 0 if body is not None else 1
+
+
+def prefetch(
+    jira_uri: str,
+    jira_pat: str,
+    branch_rules: commiticketing.BranchRules,
+    policy: jira_cache.CachePolicy,
+    network: jira_client.RequestPolicy | None = None,
+) -> int:
+    """
+    Warm the cache with the ticket of the checked out branch (derived by the
+    same rules as by commiticketing), so that checking the commit message later
+    on is a local lookup. The ticket is fetched by a background process, so
+    that the checkout does not wait for JIRA.
+
+    :return: Always 0, a failed prefetch must not disturb the checkout
+    """
+    if environ.get('PRE_COMMIT_CHECKOUT_TYPE') == '0':  # checkout of files
+        return 0
+    if policy.ttl <= 0:
+        print('Nothing to prefetch, because the cache is disabled')
+        return 0
+    branch = commiticketing.get_active_branch_name()
+    found = branch_rules.match(branch) if branch else None
+    ticket = found.ticket if found else None
+    if not ticket:
+        print('Could not reify ticket from branch name')
+        return 0
+    with closing(jira_cache.connect()) as db:
+        entry = jira_cache.load(db, jira_uri, ticket, policy)
+    if entry and not entry.stale:
+        return 0
+    print(f'Prefetching ticket "{ticket}"')
+    refresh_in_background(ticket, jira_uri, jira_pat, policy, network)
+    return 0
+
+
+def snapshot_issue(body: SupportsIndex | slice | None) -> IssueSnapshot:
+    return IssueSnapshot(
+        fix_version=parse_ticket_version(body),
+        status_category=parse_ticket_status_category(body),
+    )
+
+
+def fetch_issue(
+    ticket: str,
+    jira_uri: str,
+    jira_pat: str,
+    policy: jira_cache.CachePolicy | None = None,
+    network: jira_client.RequestPolicy | None = None,
+) -> SupportsIndex | slice | None:
+    if policy and (policy.ttl > 0 or policy.negative_ttl > 0):
+        return fetch_jira_cached(ticket, jira_uri, jira_pat, policy, network)
+    return fetch_jira(ticket, jira_uri, jira_pat, network)
+
+
+def fetch_via_daemon(
+    ticket: str,
+    jira_uri: str,
+    jira_pat: str,
+    policy: jira_cache.CachePolicy | None = None,
+    network: jira_client.RequestPolicy | None = None,
+) -> SupportsIndex | slice | None:
+    """
+    Let the daemon look up the ticket, with its warm cache and connections.
+    In case it is not running, it is started for the next lookups, and this
+    one is done in-process.
+
+    The deadline of the policy is handed over as remaining seconds, because
+    values of `time.monotonic()` are meaningless to other processes. The
+    answer is awaited until the deadline (not only for the timeout of a
+    single request), as the daemon may retry or wait for another lookup of
+    the ticket. In case the daemon drops the connection (e.g., because it
+    exits on idle) or does not answer in time, the lookup is done in-process
+    as well.
+    """
+    remaining = jira_client.get_remaining(network)
+    remote = network._asdict() if network else None
+    if remote and remote['deadline'] is not None:
+        remote['deadline'] = remaining
+    lookup = {
+        'ticket': ticket,
+        'jira_uri': jira_uri,
+        'jira_pat': jira_pat,
+        'policy': policy._asdict() if policy else None,
+        'network': remote,
+    }
+    try:
+        answer = jira_daemon.call(lookup, remaining)
+    except (jira_daemon.NotRunning, OSError):
+        spawn_daemon()
+        return fetch_issue(ticket, jira_uri, jira_pat, policy, network)
+    if 'code' in answer:
+        raise HTTPError(
+            jira_uri, answer['code'], answer['reason'], Message(), None,
+        )
+    if 'error' in answer:
+        raise URLError(answer['error'])
+    body: SupportsIndex | slice | None = answer['body']
+    return body
+
+
+def answer_lookup(lookup: dict[str, Any]) -> dict[str, Any]:
+    """
+    Look up a ticket for a client of the daemon (cf. fetch_via_daemon).
+
+    :return: The body of the ticket, the status code in case JIRA refused it,
+        or the error in case the lookup failed otherwise
+    """
+    policy = lookup['policy']
+    network = lookup['network']
+    if network and network['deadline'] is not None:
+        network['deadline'] += monotonic()
+    try:
+        body = fetch_issue(
+            lookup['ticket'], lookup['jira_uri'], lookup['jira_pat'],
+            jira_cache.CachePolicy(**policy) if policy else None,
+            jira_client.RequestPolicy(**network) if network else None,
+        )
+    except HTTPError as e:
+        return {'code': e.code, 'reason': str(e.reason)}
+    except Exception as e:
+        return {'error': str(e)}
+    return {'body': body}
+
+
+def get_issue(
+    ticket: str,
+    jira_uri: str,
+    jira_pat: str,
+    policy: jira_cache.CachePolicy | None = None,
+    network: jira_client.RequestPolicy | None = None,
+    daemon: bool = False,
+) -> IssueSnapshot:
+    """
+    Fetch the ticket from JIRA exactly once and extract everything that the
+    COJIRA rules need from it.
+
+    In case a cache policy with a positive TTL is given, the response is
+    looked up in (and stored into) the on-disk cache first. Expired entries
+    within the staleness window of the policy are still answered from the
+    cache, while a background process refreshes them for the next commit.
+
+    Tickets, which JIRA refuses as not existing or not accessible, are
+    remembered for the negative TTL of the policy.
+
+    In case `daemon` is set, the ticket is looked up by the daemon (cf.
+    `cojira daemon`) if it is running, otherwise in-process.
+
+    :return: The snapshot of the ticket, its fields being None if unknown
+    """
+    try:
+        if daemon:
+            body = fetch_via_daemon(
+                ticket, jira_uri, jira_pat, policy, network,
+            )
+        else:
+            body = fetch_issue(ticket, jira_uri, jira_pat, policy, network)
+    except HTTPError as e:
+        if e.code not in UNAVAILABLE:
+            raise
+        return IssueSnapshot(None, None, e.code)
+    return snapshot_issue(body)
+
+
+def get_issues(
+    tickets: Collection[str],
+    jira_uri: str,
+    jira_pat: str,
+    policy: jira_cache.CachePolicy | None = None,
+    network: jira_client.RequestPolicy | None = None,
+) -> dict[str, IssueSnapshot]:
+    """
+    Bulk variant of get_issue: tickets, which are not in the cache, are
+    resolved with a single JQL search. Tickets not found by JIRA are reported
+    as unavailable (HTTP 404), and remembered as such for the negative TTL of
+    the policy. Same as for get_issue, stale tickets are answered from the
+    cache and refreshed in the background.
+
+    :return: The snapshots of the tickets by their keys
+    """
+    bodies: dict[str, Any] = {}
+    unavailable: dict[str, int] = {}
+    if policy and (policy.ttl > 0 or policy.negative_ttl > 0):
+        with closing(jira_cache.connect()) as db:
+            for ticket in tickets:
+                try:
+                    entry = load_cached(
+                        db, ticket, jira_uri, jira_pat, policy, network,
+                    )
+                except HTTPError as e:
+                    unavailable[ticket] = e.code
+                    continue
+                if entry is not None:
+                    bodies[ticket] = entry.body
+            missing = [
+                ticket for ticket in tickets
+                if ticket not in bodies and ticket not in unavailable
+            ]
+            found = search_jira(missing, jira_uri, jira_pat, network) \
+                if missing else {}
+            for ticket in missing:
+                if ticket not in found:
+                    if policy.negative_ttl > 0:
+                        jira_cache.store_unavailable(
+                            db, jira_uri, ticket, 404, policy,
+                        )
+                elif policy.ttl > 0:
+                    jira_cache.store(
+                        db, jira_uri, ticket, found[ticket], policy,
+                    )
+            bodies.update(found)
+    else:
+        bodies = search_jira(tickets, jira_uri, jira_pat, network)
+    return {
+        ticket:
+            snapshot_issue(bodies[ticket]) if ticket in bodies
+            else IssueSnapshot(None, None, unavailable.get(ticket, 404))
+        for ticket in tickets
+    }
+
+
+def get_ticket_version(
+    ticket: str,
+    jira_uri: str,
+    jira_pat: str,
+) -> str | None:
+    return get_issue(ticket, jira_uri, jira_pat).fix_version
+
+
+def get_ticket_status_category(
+    ticket: str,
+    jira_uri: str,
+    jira_pat: str,
+) -> str | None:
+    return get_issue(ticket, jira_uri, jira_pat).status_category
+
+
 def check_ticket_status_category(
     ticket_status_category: str | None,
     allowed: Set[str],
@@ -76,9 +846,337 @@ def check_ticket_status_category(
     return False
 
 
+def check_issue(
+    issue: IssueSnapshot,
+    version: Set[str],
+    allowed: Set[str],
+    disallowed: Set[str],
+) -> int:
+    if issue.not_synced:
+        print(
+            'Project of ticket is not in the offline index (cf. cojira sync)',
+        )
+        return 6
+    if issue.unavailable:
+        print(
+            'Ticket does not exist or is not accessible'
+            f' (HTTP {issue.unavailable})',
+        )
+        return 5
+
+    if len(version) > 0:
+        ticket_version = issue.fix_version
+        if not ticket_version:
+            print('Ticket has no fix version, but it is expected')
+            print(
+                '\t(allowed versions are:'
+                f' {str(version).replace("frozenset","")})',
+            )
+            return 3
+        if ticket_version not in version:
+            print(f'Fix version of ticket ("{ticket_version}") is not allowed')
+            print(
+                '\t(allowed versions are:'
+                f' {str(version).replace("frozenset","")})',
+            )
+            return 2
+        print(f'Ticket fix version ("{ticket_version}") is allowed')
+        print(
+            '\t(allowed versions are:'
+            f' {str(version).replace("frozenset","")})',
+        )
+    else:
+        print('Ticket fix version not checked')
+
+    category = issue.status_category
+    if check_ticket_status_category(category, allowed, disallowed):
+        print('Ticket is OK according to COJIRA rules')
+        return 0
+    print(f'Ticket status category ("{category}") is not allowed')
+    print(
+        f'\t(allowed categories are: {str(allowed).replace("frozenset","")},',
+    )
+    print(
+        '\t disallowed categories are:'
+        f' {str(disallowed).replace("frozenset","")})',
+    )
+    return 1
+
+
+def load_verified(
+    tickets: Collection[str],
+    jira_uri: str,
+    rules: Mapping[str, Set[str]],
+    grace: float,
+) -> set[str]:
+    """
+    :return: The tickets, which passed the same rules within the last `grace`
+        seconds (e.g., when amending a commit or during a rebase), thus need
+        not be checked again
+    """
+    if grace <= 0:
+        return set()
+    with closing(jira_cache.connect()) as db:
+        return {
+            ticket for ticket in tickets
+            if jira_cache.is_verified(db, jira_uri, ticket, rules, grace)
+        }
+
+
+def store_verified(
+    tickets: Collection[str],
+    jira_uri: str,
+    rules: Mapping[str, Set[str]],
+    grace: float,
+) -> None:
+    if grace > 0 and tickets:
+        with closing(jira_cache.connect()) as db:
+            jira_cache.store_verified(db, jira_uri, tickets, rules, grace)
+
+
+def get_project_keys(
+    jira_uri: str,
+    jira_pat: str,
+    ttl: float,
+    network: jira_client.RequestPolicy | None = None,
+) -> frozenset[str]:
+    """
+    :return: The keys of all projects of JIRA, from the on-disk cache unless
+        they are older than `ttl` seconds
+    """
+    with closing(jira_cache.connect()) as db:
+        keys = jira_cache.load_project_keys(db, jira_uri, ttl)
+    if keys is None:
+        keys = fetch_project_keys(jira_uri, jira_pat, network)
+        with closing(jira_cache.connect()) as db:
+            jira_cache.store_project_keys(db, jira_uri, keys)
+    return keys
+
+
+def reject_unknown_projects(
+    tickets: Collection[str],
+    project_keys: Set[str],
+) -> dict[str, str | None]:
+    """
+    Tickets of projects, which do not exist, are rejected without looking
+    them up (e.g., typos like ABD-1 instead of ABC-1).
+
+    :return: The rejected tickets, with a ticket of the most similar existing
+        project as suggestion (None if no project is similar enough)
+    """
+    rejected = {}
+    for ticket in tickets:
+        project, _, number = ticket.rpartition('-')
+        if project not in project_keys:
+            matches = get_close_matches(project, sorted(project_keys), n=1)
+            rejected[ticket] = f'{matches[0]}-{number}' if matches else None
+    return rejected
+
+
+def report_rejected(suggestion: str | None) -> int:
+    if suggestion:
+        print(
+            'Project of ticket does not exist'
+            f' (did you mean "{suggestion}"?)',
+        )
+    else:
+        print('Project of ticket does not exist')
+    return 5
+
+
+def report_outage(e: Exception, fail_open: bool) -> int:
+    """
+    :raises Exception: The given error, unless it is an outage of JIRA
+    :return: The return code of the hook in case JIRA is not reachable
+    """
+    if not jira_client.is_outage(e):
+        raise e
+    print(f'JIRA is not reachable ({e})')
+    if fail_open:
+        print('Tickets are not checked, because of --fail-open')
+        return 0
+    return 6
+
+
+def index_entry(issue: Any) -> jira_cache.IndexEntry:
+    try:
+        fix_versions = [
+            version['name'] for version in issue['fields']['fixVersions']
+        ]
+    except (KeyError, TypeError):  # no .fields.fixVersions[*].name
+        fix_versions = []
+    return jira_cache.IndexEntry(
+        parse_ticket_status_category(issue), fix_versions,
+    )
+
+
+def sync(argv: Sequence[str]) -> int:
+    parser = argparse.ArgumentParser(prog='cojira sync')
+    parser.add_argument(
+        '-u', '--jira-uri', required=True,
+        help='URI of JIRA instance, may be an environment variable'
+             ' (starting with "$")',
+    )
+    parser.add_argument(
+        '-p', '--jira-pat',
+        help='Personal access token (PAT) to use for JIRA authentication,'
+             ' may be an environment variable (starting with "$")',
+    )
+    parser.add_argument(
+        '-k', '--project', action='append', required=True,
+        help='Key of a project, whose tickets are synced into the index,'
+             ' may be specified multiple times',
+    )
+    parser.add_argument(
+        '-f', '--full', action='store_true',
+        help='If set, all tickets are synced again,'
+             ' not only those updated since the last sync',
+    )
+    parser.add_argument(
+        '--timeout', type=float, default=30,
+        help='Seconds to wait for JIRA to connect or respond to a single'
+             ' request; 0 waits indefinitely'
+             ' (default: 30)',
+    )
+    args = parser.parse_args(argv)
+    default_value = ''  # pragma: no mutate
+    if args.jira_uri.startswith('$'):  # pragma: no mutate
+        args.jira_uri = environ.get(args.jira_uri[1:], default_value)
+    if args.jira_pat and args.jira_pat.startswith('$'):  # pragma: no mutate
+        args.jira_pat = environ.get(args.jira_pat[1:], default_value)
+    network = jira_client.RequestPolicy(
+        args.timeout if args.timeout > 0 else None, retries=3,
+    )
+
+    for project in args.project:
+        synced_at = None
+        if not args.full:
+            with closing(jira_cache.connect()) as db:
+                synced_at = jira_cache.load_synced_at(
+                    db, args.jira_uri, project,
+                )
+        full = synced_at is None
+        started_at = time()
+        jql = f'project = "{project}"'
+        if synced_at is not None:
+            # relative to the clock of JIRA, with a minute to spare
+            minutes = ceil((started_at - synced_at) / 60) + 1
+            jql += f' AND updated >= -{minutes}m'
+        entries = {
+            issue['key']: index_entry(issue)
+            for issue in search_jql(
+                jql, args.jira_uri, args.jira_pat, network=network,
+            )
+        }
+        with closing(jira_cache.connect()) as db:
+            jira_cache.store_index(
+                db, args.jira_uri, project, entries, started_at, full,
+            )
+        print(
+            f'Synced {len(entries)} ticket(s) of project "{project}"'
+            f' ({"full" if full else "incremental"})',
+        )
+    return 0
+
+
+def get_indexed_issues(
+    tickets: Collection[str],
+    jira_uri: str,
+) -> dict[str, IssueSnapshot]:
+    """
+    Offline variant of get_issues: tickets are looked up in the index (cf.
+    `cojira sync`) only. Tickets of projects, which were never synced, are
+    reported as such; other tickets not in the index as unavailable (HTTP
+    404).
+
+    :return: The snapshots of the tickets, in the order of the tickets
+    """
+    with closing(jira_cache.connect()) as db:
+        entries = jira_cache.load_index(db, jira_uri, tickets)
+        synced = {
+            project for project in map(commiticketing.get_project, tickets)
+            if jira_cache.load_synced_at(db, jira_uri, project) is not None
+        }
+    issues = {}
+    for ticket in tickets:
+        entry = entries.get(ticket)
+        if commiticketing.get_project(ticket) not in synced:
+            issues[ticket] = IssueSnapshot(None, None, not_synced=True)
+        elif entry is None:
+            issues[ticket] = IssueSnapshot(None, None, 404)
+        else:
+            issues[ticket] = IssueSnapshot(
+                entry.fix_versions[0] if len(entry.fix_versions) == 1
+                else None,
+                entry.status_category,
+            )
+    return issues
+
+
+def daemon(argv: Sequence[str]) -> int:
+    parser = argparse.ArgumentParser(prog='cojira daemon')
+    parser.add_argument(
+        '--idle-timeout', type=float, default=900,
+        help='Seconds without any lookup after which the daemon exits'
+             ' (default: 900)',
+    )
+    args = parser.parse_args(argv)
+    return jira_daemon.serve(answer_lookup, args.idle_timeout)
+
+
 def main(argv: Sequence[str] | None = None) -> int:
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == 'refresh':
+        return refresh(argv[1:])
+    if argv and argv[0] == 'daemon':
+        return daemon(argv[1:])
+    if argv and argv[0] == 'sync':
+        return sync(argv[1:])
+
     parser = argparse.ArgumentParser()
-    parser.add_argument('commit_msg', help='Filename of commit message')
+    parser.add_argument(
+        'commit_msg', nargs='?',
+        help='Filename of commit message'
+             ' (not needed for --pre-push/--range/--post-checkout)',
+    )
+    parser.add_argument(
+        '--pre-push', action='store_true',
+        help='Check the tickets of all commits about to be pushed'
+             ' instead of a commit message',
+    )
+    parser.add_argument(
+        '--post-checkout', action='store_true',
+        help='Fetch the ticket of the checked out branch into the cache'
+             ' in the background instead of checking a commit message',
+    )
+    parser.add_argument(
+        '--two-level', action='append',
+        help='Get the ticket of the branch from the second level'
+             ' for --post-checkout, if the branch starts with this'
+             ' (same as for commiticketing),'
+             ' may be specified multiple times'
+             ' (default: user, backup)',
+    )
+    parser.add_argument(
+        '--branch', action='append',
+        help='Branch to derive the ticket from for --post-checkout'
+             ' (same as for commiticketing),'
+             ' may be specified multiple times'
+             ' (default: feature, bugfix, hotfix)',
+    )
+    parser.add_argument(
+        '--schema', action='append',
+        help='Further branch naming schema to derive the ticket from'
+             ' for --post-checkout (same as for commiticketing, e.g.,'
+             ' "team/{ticket}/*"), may be specified multiple times'
+             ' (default: none)',
+    )
+    parser.add_argument(
+        '-r', '--range',
+        help='Check the tickets of all commits in this revision range'
+             ' (e.g., origin/main..HEAD) instead of a commit message',
+    )
     parser.add_argument(
         '-l', '--lenient', action='store_true',
         help='If set, and no JIRA URI is present,'
@@ -115,6 +1213,123 @@ def main(argv: Sequence[str] | None = None) -> int:
              ' may any of them be an environment variable (starting with "$")'
              ' (default: none)',
     )
+    parser.add_argument(
+        '-c', '--cache-ttl', type=float, default=0,
+        help='Seconds for which a fetched ticket is reused from the'
+             ' on-disk cache; 0 disables the cache'
+             ' (default: 0)',
+    )
+    parser.add_argument(
+        '--cache-size', type=int, default=512,
+        help='Number of tickets kept in the on-disk cache,'
+             ' the least recently used ones are evicted first'
+             ' (default: 512)',
+    )
+    parser.add_argument(
+        '-s', '--stale-while-revalidate', type=float, default=0,
+        help='Seconds after the cache TTL during which an expired ticket is'
+             ' still used, while it is refreshed in the background'
+             ' (default: 0)',
+    )
+    parser.add_argument(
+        '-n', '--negative-cache-ttl', type=float, default=0,
+        help='Seconds for which a ticket, that does not exist or is not'
+             ' accessible, is remembered as such in the on-disk cache'
+             ' (default: 0)',
+    )
+    parser.add_argument(
+        '-t', '--trailer', action='append',
+        help='Trailer in the message body referencing further tickets'
+             ' to be checked (e.g., "Refs: ABC-1, ABC-2"),'
+             ' may be specified multiple times'
+             ' (default: Refs)',
+    )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=4,
+        help='Number of tickets looked up concurrently (default: 4)',
+    )
+    parser.add_argument(
+        '--timeout', type=float, default=10,
+        help='Seconds to wait for JIRA to connect or respond to a single'
+             ' request; 0 waits indefinitely'
+             ' (default: 10)',
+    )
+    parser.add_argument(
+        '--deadline', type=float, default=30,
+        help='Seconds all JIRA lookups of one run may take in total;'
+             ' 0 disables the deadline'
+             ' (default: 30)',
+    )
+    parser.add_argument(
+        '--breaker-threshold', type=int, default=0,
+        help='Number of failed JIRA requests in a row after which JIRA is'
+             ' not asked anymore until the cooldown has passed;'
+             ' 0 disables the circuit breaker'
+             ' (default: 0)',
+    )
+    parser.add_argument(
+        '--breaker-cooldown', type=float, default=60,
+        help='Seconds for which the circuit breaker stays open'
+             ' (default: 60)',
+    )
+    parser.add_argument(
+        '--rate-limit', type=float, default=0,
+        help='Requests per second sent to JIRA, shared by all hook runs of the'
+             ' user on this host (e.g., parallel CI jobs);'
+             ' 0 disables the rate limit'
+             ' (default: 0)',
+    )
+    parser.add_argument(
+        '--rate-burst', type=int, default=1,
+        help='Number of requests which may be sent at once,'
+             ' before the rate limit applies'
+             ' (default: 1)',
+    )
+    parser.add_argument(
+        '--retries', type=int, default=3,
+        help='Number of retries of a request, which JIRA throttled'
+             ' (HTTP 429) or could not serve temporarily (HTTP 503);'
+             ' the delay is taken from Retry-After if given'
+             ' (default: 3)',
+    )
+    parser.add_argument(
+        '--backoff', type=float, default=0.5,
+        help='Seconds to wait before the first retry, in case JIRA does not'
+             ' give a Retry-After; doubled for each further retry'
+             ' (default: 0.5)',
+    )
+    parser.add_argument(
+        '-d', '--daemon', action='store_true',
+        help='If set, tickets are looked up by a background daemon'
+             ' (cf. "cojira daemon"), which keeps the cache and connections'
+             ' to JIRA warm; it is started on demand'
+             ' (default: no)',
+    )
+    parser.add_argument(
+        '-o', '--offline', action='store_true',
+        help='If set, tickets are looked up in the index built by'
+             ' "cojira sync" only, without asking JIRA'
+             ' (default: no)',
+    )
+    parser.add_argument(
+        '--fail-open', action='store_true',
+        help='If set, and JIRA is not reachable,'
+             ' this hook passes instead of failing',
+    )
+    parser.add_argument(
+        '--project-keys-ttl', type=float, default=0,
+        help='Seconds for which the keys of all projects of JIRA are cached,'
+             ' so that tickets of projects, which do not exist, are rejected'
+             ' without asking JIRA; 0 disables this check'
+             ' (default: 0)',
+    )
+    parser.add_argument(
+        '-g', '--verified-grace', type=float, default=0,
+        help='Seconds for which a ticket, which passed the check, is not'
+             ' checked again with the same rules (e.g., when amending or'
+             ' rebasing); 0 checks every time'
+             ' (default: 0)',
+    )
     args = parser.parse_args(argv)
     default_value = ''  # pragma: no mutate
     if args.jira_uri and args.jira_uri.startswith('$'):  # pragma: no mutate
@@ -137,53 +1352,141 @@ def main(argv: Sequence[str] | None = None) -> int:
     allowed = frozenset(args.allow_status_category or ())
     disallowed = frozenset(args.disallow_status_category or ('done',))
     version = frozenset(args.allowed_fix_version or ())
+    rules = {'version': version, 'allowed': allowed, 'disallowed': disallowed}
 
-    ticket = get_ticket(args.commit_msg)
-    if not ticket:
-        print('Could not reify ticket from commit message')
-        return 4
-    print(f'Checking ticket "{ticket}"')
+    policy = jira_cache.CachePolicy(
+        args.cache_ttl, args.cache_size, args.stale_while_revalidate,
+        args.negative_cache_ttl,
+    )
+    network = jira_client.RequestPolicy(
+        args.timeout if args.timeout > 0 else None,
+        monotonic() + args.deadline if args.deadline > 0 else None,
+        args.breaker_threshold, args.breaker_cooldown,
+        args.rate_limit, args.rate_burst, args.retries, args.backoff,
+    )
 
-    if len(version) > 0:
-        ticket_version = \
-            get_ticket_version(ticket, args.jira_uri, args.jira_pat)
-        if not ticket_version:
-            print('Ticket has no fix version, but it is expected')
-            print(
-                '\t(allowed versions are:'
-                f' {str(version).replace("frozenset","")})',
-            )
-            return 3
-        if ticket_version not in version:
-            print(f'Fix version of ticket ("{ticket_version}") is not allowed')
-            print(
-                '\t(allowed versions are:'
-                f' {str(version).replace("frozenset","")})',
-            )
-            return 2
-        print(f'Ticket fix version ("{ticket_version}") is allowed')
-        print(
-            '\t(allowed versions are:'
-            f' {str(version).replace("frozenset","")})',
+    if args.post_checkout:
+        return prefetch(
+            args.jira_uri, args.jira_pat,
+            commiticketing.get_rules(parser, args), policy, network,
         )
-    else:
-        print('Ticket fix version not checked')
 
-    category = get_ticket_status_category(
-        ticket, args.jira_uri, args.jira_pat,
+    trailers = args.trailer or DEFAULT_TRAILERS
+    # the index of an offline lookup knows the tickets anyway
+    check_projects = args.project_keys_ttl > 0 and not args.offline
+    if not args.pre_push and not args.range:
+        if not args.commit_msg:
+            parser.error('the commit message is required')
+        tickets = get_tickets(args.commit_msg, trailers)
+        if not tickets:
+            print('Could not reify ticket from commit message')
+            return 4
+        verified = load_verified(
+            tickets, args.jira_uri, rules, args.verified_grace,
+        )
+        for ticket in tickets:
+            if ticket in verified:
+                print(f'Ticket "{ticket}" was verified recently')
+        tickets = [ticket for ticket in tickets if ticket not in verified]
+        lookup = partial(
+            get_issue,
+            jira_uri=args.jira_uri, jira_pat=args.jira_pat, policy=policy,
+            network=network, daemon=args.daemon,
+        )
+        rejected: dict[str, str | None] = {}
+        try:
+            if check_projects and tickets:
+                rejected = reject_unknown_projects(
+                    tickets, get_project_keys(
+                        args.jira_uri, args.jira_pat, args.project_keys_ttl,
+                        network,
+                    ),
+                )
+                tickets = [
+                    ticket for ticket in tickets if ticket not in rejected
+                ]
+            if args.offline:
+                issues = get_indexed_issues(tickets, args.jira_uri)
+            elif len(tickets) <= 1:
+                issues = {ticket: lookup(ticket) for ticket in tickets}
+            else:
+                with ThreadPoolExecutor(
+                    max_workers=max(1, min(args.workers, len(tickets))),
+                ) as executor:
+                    issues = dict(zip(tickets, executor.map(lookup, tickets)))
+        except Exception as e:
+            return report_outage(e, args.fail_open)
+        result = 0
+        for ticket, suggestion in rejected.items():
+            print(f'Checking ticket "{ticket}"')
+            result = result or report_rejected(suggestion)
+        passed = []
+        for ticket, issue in issues.items():
+            print(f'Checking ticket "{ticket}"')
+            code = check_issue(issue, version, allowed, disallowed)
+            if code == 0:
+                passed.append(ticket)
+            result = result or code
+        store_verified(passed, args.jira_uri, rules, args.verified_grace)
+        return result
+
+    result = 0
+    commits = get_range_tickets(
+        [args.range] if args.range else get_push_revisions(), trailers,
     )
-    if check_ticket_status_category(category, allowed, disallowed):
-        print('Ticket is OK according to COJIRA rules')
-        return 0
-    print(f'Ticket status category ("{category}") is not allowed')
-    print(
-        f'\t(allowed categories are: {str(allowed).replace("frozenset","")},',
+    for commit, tickets in commits:
+        if not tickets:
+            print(f'Could not reify ticket from commit {commit[:12]}')
+            result = result or 4
+    referenced = Counter(
+        ticket for _, tickets in commits for ticket in tickets
     )
-    print(
-        '\t disallowed categories are:'
-        f' {str(disallowed).replace("frozenset","")})',
+    verified = load_verified(
+        referenced, args.jira_uri, rules, args.verified_grace,
     )
-    return 1
+    for ticket in referenced:
+        if ticket in verified:
+            print(
+                f'Ticket "{ticket}" was verified recently'
+                f' (referenced by {referenced[ticket]} commit(s))',
+            )
+    pending = [ticket for ticket in referenced if ticket not in verified]
+    rejected = {}
+    try:
+        if check_projects and pending:
+            rejected = reject_unknown_projects(
+                pending, get_project_keys(
+                    args.jira_uri, args.jira_pat, args.project_keys_ttl,
+                    network,
+                ),
+            )
+            pending = [ticket for ticket in pending if ticket not in rejected]
+        if args.offline:
+            issues = get_indexed_issues(pending, args.jira_uri)
+        else:
+            issues = get_issues(
+                pending, args.jira_uri, args.jira_pat, policy, network,
+            )
+    except Exception as e:
+        return report_outage(e, args.fail_open)
+    for ticket, suggestion in rejected.items():
+        print(
+            f'Checking ticket "{ticket}"'
+            f' (referenced by {referenced[ticket]} commit(s))',
+        )
+        result = result or report_rejected(suggestion)
+    passed = []
+    for ticket, issue in issues.items():
+        print(
+            f'Checking ticket "{ticket}"'
+            f' (referenced by {referenced[ticket]} commit(s))',
+        )
+        code = check_issue(issue, version, allowed, disallowed)
+        if code == 0:
+            passed.append(ticket)
+        result = result or code
+    store_verified(passed, args.jira_uri, rules, args.verified_grace)
+    return result
 
 
 if __name__ == '__main__':
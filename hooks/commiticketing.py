@@ -1,11 +1,68 @@
 from __future__ import annotations
 
 import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from bisect import bisect_left
+from collections.abc import Callable
 from collections.abc import Iterable
 from collections.abc import Sequence
+from collections.abc import Set
+from difflib import get_close_matches
+from functools import lru_cache
 from pathlib import Path
+from re import compile
 from re import escape
-from re import match
+from re import Match
+from typing import Any
+from typing import IO
+from typing import NamedTuple
+
+TICKET = '[A-Z]{2,}-[1-9][0-9]*'
+DEFAULT_BRANCHES = frozenset(('feature', 'bugfix', 'hotfix'))
+DEFAULT_TWO_LEVEL = frozenset(('user', 'backup'))
+DEFAULT_SHORT_BRANCHES = frozenset(('feature', 'user', 'backup'))
+
+
+def read_first_line(path: Path) -> str | None:
+    """
+    :return: The first line of the file (stripped), None if it is missing
+    """
+    try:
+        with path.open(encoding='utf-8') as f:
+            return f.readline().strip()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def get_git_dir(work_tree: Path = Path('.')) -> Path | None:
+    """
+    Source: https://git-scm.com/docs/gitrepository-layout
+
+    Resolve the git directory of the working tree the same way as git does,
+    but by reading files instead of spawning `git rev-parse`:
+
+    * $GIT_DIR, if set.
+    * Otherwise `.git`, which is the git directory itself, or a file pointing
+      to it (`gitdir: <path>`) in linked worktrees and submodules.
+
+    HEAD and the state of a rebase are kept per worktree, i.e., in this
+    directory, not in the common directory shared by all worktrees.
+
+    :return: The git directory, None if it is not a repository
+    """
+    if os.environ.get('GIT_DIR'):
+        return work_tree / os.environ['GIT_DIR']
+    dot_git = work_tree / '.git'
+    if dot_git.is_dir():
+        return dot_git
+    line = read_first_line(dot_git)
+    if not line or not line.startswith('gitdir:'):
+        return None
+    return dot_git.parent / line.removeprefix('gitdir:').strip()
 
 
 def get_active_branch_name() -> str | None:
@@ -14,60 +71,376 @@ def get_active_branch_name() -> str | None:
         and https://stackoverflow.com/a/59115583/5471574
 
     This works for us, because the current working directory (i.e., current
-    working directory) _IS_ the git repository.
+    working directory) _IS_ the working tree of the git repository, cf.
+    get_git_dir for its git directory.
 
-    By default, and when in a conflicting rebase-apply, HEAD is found.
+    By default, and when applying patches (`git am`), HEAD is found.
 
-    During conflicting rebase-merge, we go via head-name.
+    During a rebase, HEAD is detached, we go via head-name of rebase-merge
+    (or rebase-apply for `git rebase --apply`).
 
-    :return: The name of the currently checked out branch
+    :return: The name of the currently checked out branch, None if HEAD is
+        detached (outside of a rebase)
     """
-    head = None
-    try:
-        with (Path('.') / '.git' / 'HEAD').open('r') as f:
-            content = f.read().splitlines()
+    git_dir = get_git_dir()
+    if git_dir is None:
+        return None
+    head = read_first_line(git_dir / 'HEAD')
+    if head and head.startswith('ref:'):
+        return head.removeprefix('ref:').strip().removeprefix('refs/heads/')
+    for state in ('rebase-merge', 'rebase-apply'):
+        name = read_first_line(git_dir / state / 'head-name')
+        if name and name.startswith('refs/heads/'):
+            return name.removeprefix('refs/heads/')
+    return None
+
 
-        for line in content:
-            if line[:4] == 'ref:':
-                head = line.removeprefix('ref: refs/heads/')
-        if head:
-            return head
+class BranchMatch(NamedTuple):
+    candidate: str | None
+    ticket: str | None
 
-        with (
-            Path('.') / '.git' / 'rebase-merge' / 'head-name'
-        ).open('r') as f:
-            content = f.read().splitlines()
 
-        for line in content:
-            head = line.removeprefix('refs/heads/')
-        if head:
-            return head
+def get_schema_pattern(schema: str, group: str) -> str:
+    """
+    A branch schema is the whole branch name, where `{ticket}` stands for the
+    ticket and `*` for anything within a level of the branch name (i.e.,
+    without slashes), e.g., `team/{ticket}/*` or `{ticket}_*`.
 
-    except FileNotFoundError:
-        pass
+    :raises ValueError: In case the schema does not contain `{ticket}`
+        exactly once
+    :return: The regular expression of the schema, the ticket being captured
+        as the given group
+    """
+    if schema.count('{ticket}') != 1:
+        raise ValueError(
+            f'Branch schema "{schema}" must contain {{ticket}} exactly once',
+        )
+    before, _, after = schema.partition('{ticket}')
+    return (
+        '[^/]*'.join(map(escape, before.split('*')))
+        + f'(?P<{group}>{TICKET})'
+        + '[^/]*'.join(map(escape, after.split('*')))
+    )
 
-    return head
 
+class BranchRules:
+    """
+    The branch configuration compiled once into a single regular expression
+    per kind of rule, instead of building one per candidate and branch.
 
-def get_prefix(branch: str, two_level_branches: Iterable[str]) -> str | None:
-    for tlb in two_level_branches:
-        if (
-            branch.startswith(tlb)
-            and match(
-                r'^' + escape(tlb) + '/[^/]+/[A-Z]{2,}-[1-9][0-9]*(-.+)?$',
-                branch,
-            )
-        ):
-            return '-'.join(branch.split('/')[2].split('-')[:2])
-    if match(r'^[^/]+/[A-Z]{2,}-[1-9][0-9]*(-.+)?$', branch):
-        return '-'.join(branch.split('/')[1].split('-')[:2])
-    else:
+    * Branches, which start with a processed or two-level branch (e.g.,
+      `feature/`), are in scope; the candidate is looked up per level of the
+      branch name, the longest one wins.
+    * The ticket is taken from the third level of two-level branches (e.g.,
+      `user/u123/ABC-1-desc`), otherwise from the second level (e.g.,
+      `feature/ABC-1-desc`).
+    * Branches matching a custom schema (cf. get_schema_pattern) are in scope
+      as well, their ticket is taken from the schema.
+    """
+
+    def __init__(
+        self,
+        branches: Iterable[str],
+        two_level_branches: Iterable[str],
+        schemas: Sequence[str] = (),
+    ) -> None:
+        self.candidates = frozenset((*branches, *two_level_branches))
+        two_level = '|'.join(
+            map(escape, sorted(two_level_branches, key=len, reverse=True)),
+        )
+        self.tickets = compile(
+            (f'(?:{two_level})/[^/]+/(?P<t0>{TICKET})(?:-.+)?|'
+             if two_level else '')
+            + f'[^/]+/(?P<t1>{TICKET})(?:-.+)?',
+        )
+        self.schemas = compile(
+            '|'.join(
+                f'(?:{get_schema_pattern(schema, f"t{i}")})'
+                for i, schema in enumerate(schemas)
+            ),
+        ) if schemas else None
+
+    def get_candidate(self, branch: str) -> str | None:
+        """
+        :return: The longest configured branch prefix of the branch (which
+            may consist of several levels itself), None if it is out of scope
+        """
+        ends = [i for i, c in enumerate(branch) if c == '/']
+        for end in reversed(ends):
+            if branch[:end] in self.candidates:
+                return branch[:end]
         return None
 
+    def get_ticket(self, branch: str) -> str | None:
+        found = self.tickets.fullmatch(branch)
+        return get_group(found) if found else None
 
-def main(argv: Sequence[str] | None = None) -> int:
-    parser = argparse.ArgumentParser()
-    parser.add_argument('filename', help='Commit message to check')
+    def match(self, branch: str) -> BranchMatch | None:
+        """
+        :return: The candidate (None for custom schemas) and ticket (None if
+            the branch does not follow the naming rules) of the branch, or
+            None if it is out of scope
+        """
+        found = self.schemas.fullmatch(branch) if self.schemas else None
+        if found:
+            return BranchMatch(None, get_group(found))
+        candidate = self.get_candidate(branch)
+        if candidate is None:
+            return None
+        return BranchMatch(candidate, self.get_ticket(branch))
+
+
+def get_group(found: Match[str]) -> str:
+    return next(value for value in found.groupdict().values() if value)
+
+
+@lru_cache(maxsize=16)
+def compile_rules(
+    branches: frozenset[str],
+    two_level_branches: frozenset[str],
+    schemas: tuple[str, ...] = (),
+) -> BranchRules:
+    """
+    :return: The compiled rules, reused for the same configuration
+    """
+    return BranchRules(branches, two_level_branches, schemas)
+
+
+def get_prefix(branch: str, two_level_branches: Iterable[str]) -> str | None:
+    return compile_rules(
+        frozenset(), frozenset(two_level_branches),
+    ).get_ticket(branch)
+
+
+class ProjectKeys:
+    """
+    Allowlist of project keys, kept as a frozen sorted index, which is looked
+    up by bisection (i.e., in a few comparisons even for thousands of keys).
+    """
+
+    def __init__(self, keys: Iterable[str]) -> None:
+        self.keys = tuple(sorted(frozenset(keys)))
+
+    def __contains__(self, key: str) -> bool:
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def suggest(self, key: str) -> str | None:
+        """
+        :return: The most similar key on the allowlist, None if no key is
+            similar enough
+        """
+        matches = get_close_matches(key, self.keys, n=1)
+        return matches[0] if matches else None
+
+
+@lru_cache(maxsize=4)
+def _load_project_keys(filename: str, mtime_ns: int) -> ProjectKeys:
+    with open(filename, encoding='utf-8') as f:
+        return ProjectKeys(
+            key for key in (line.strip() for line in f)
+            if key and not key.startswith('#')
+        )
+
+
+def load_project_keys(filename: str) -> ProjectKeys:
+    """
+    The file lists one project key per line, blank lines and lines starting
+    with `#` are ignored. It is parsed once as long as it does not change.
+
+    :raises OSError: In case the file cannot be read
+    """
+    return _load_project_keys(filename, os.stat(filename).st_mtime_ns)
+
+
+def get_project(ticket: str) -> str:
+    return ticket.rpartition('-')[0]
+
+
+def get_subject_prefix(
+    found: BranchMatch,
+    long_prefix: bool = False,
+    short_branches: Set[str] = DEFAULT_SHORT_BRANCHES,
+) -> str:
+    prefix = f'{found.ticket}: '
+    if long_prefix and found.candidate \
+            and found.candidate not in short_branches:
+        prefix += f'({found.candidate}) '
+    return prefix
+
+
+def prefix_subject(subject_line: str, prefix: str) -> str:
+    """
+    :return: The subject line with the prefix (not doubling it, if it is
+        there already), made sentence case after it
+    """
+    subject_line = subject_line.removeprefix(prefix)
+    return prefix + subject_line[:1].upper() + subject_line[1:]
+
+
+def _copy_file_range(src: int, dst: int, offset: int, count: int) -> int:
+    return os.copy_file_range(src, dst, count, offset)
+
+
+def _sendfile(src: int, dst: int, offset: int, count: int) -> int:
+    return os.sendfile(dst, src, offset, count)
+
+
+# copies within the kernel, in order of preference, as far as supported
+KERNEL_COPIES = tuple(
+    copy for name, copy in (
+        ('copy_file_range', _copy_file_range), ('sendfile', _sendfile),
+    ) if hasattr(os, name)
+)
+
+
+def copy_tail(source: IO[bytes], target: IO[bytes], offset: int) -> None:
+    """
+    Append the source from the offset on to the target. The data is copied
+    by the kernel (without passing through this process) where supported
+    (e.g., not across file systems), otherwise chunk by chunk.
+    """
+    target.flush()
+    src, dst = source.fileno(), target.fileno()
+    end = os.fstat(src).st_size
+    for copy in KERNEL_COPIES:
+        try:
+            while offset < end:
+                copied = copy(src, dst, offset, end - offset)
+                if not copied:
+                    break
+                offset += copied
+            return
+        except OSError:
+            continue
+    source.seek(offset)
+    shutil.copyfileobj(source, target)
+
+
+def rewrite_subject_line(filename: str, prefix: str) -> bool:
+    """
+    Only the subject line is read and rewritten, the rest of the message
+    (e.g., the diff of `git commit -v`) is copied as it is into a temporary
+    file, which then replaces the message atomically.
+
+    :return: Whether the subject line changed, otherwise the file is left
+        untouched
+    """
+    path = Path(filename)
+    with path.open('rb') as source:
+        subject_line = source.readline()
+        if not subject_line:
+            return False
+        rewritten = prefix_subject(
+            subject_line.decode('utf-8'), prefix,
+        ).encode('utf-8')
+        if rewritten == subject_line:
+            return False
+        fd, temp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+        try:
+            with open(fd, 'wb') as target:
+                target.write(rewritten)
+                copy_tail(source, target, len(subject_line))
+            shutil.copymode(path, temp)
+        except BaseException:
+            os.unlink(temp)
+            raise
+    os.replace(temp, path)
+    return True
+
+
+def filter_message(
+    message: bytes,
+    branch: str,
+    rules: BranchRules | None = None,
+    long_prefix: bool = False,
+    short_branches: Set[str] = DEFAULT_SHORT_BRANCHES,
+    project_keys: ProjectKeys | None = None,
+) -> bytes:
+    """
+    Prefix the subject line of a commit message the same way as the hook
+    does, e.g., as message callback of git filter-repo:
+
+        git filter-repo --message-callback '
+            from hooks import commiticketing
+            return commiticketing.filter_message(message, "feature/ABC-1")'
+
+    :return: The message with the prefixed subject line, unchanged in case
+        the branch is out of scope, does not follow the naming rules, or its
+        project is not on the allowlist (if given)
+    """
+    rules = rules or compile_rules(DEFAULT_BRANCHES, DEFAULT_TWO_LEVEL)
+    found = rules.match(branch)
+    if not found or not found.ticket:
+        return message
+    if project_keys is not None \
+            and get_project(found.ticket) not in project_keys:
+        return message
+    subject_line, newline, body = \
+        message.decode('utf-8', 'surrogateescape').partition('\n')
+    prefix = get_subject_prefix(found, long_prefix, short_branches)
+    return (prefix_subject(subject_line, prefix) + newline + body) \
+        .encode('utf-8', 'surrogateescape')
+
+
+def filter_commit(
+    commit: Any,
+    metadata: Any = None,
+    rules: BranchRules | None = None,
+    long_prefix: bool = False,
+    short_branches: Set[str] = DEFAULT_SHORT_BRANCHES,
+) -> None:
+    """
+    Commit callback of git filter-repo, which prefixes the message according
+    to the branch of the commit:
+
+        git filter-repo --commit-callback '
+            from hooks import commiticketing
+            commiticketing.filter_commit(commit)'
+    """
+    commit.message = filter_message(
+        commit.message, commit.branch.decode('utf-8').removeprefix(
+            'refs/heads/',
+        ), rules, long_prefix, short_branches,
+    )
+
+
+def rewrite_stream(
+    source: IO[bytes],
+    sink: IO[bytes],
+    callback: Callable[[bytes, str], bytes],
+) -> tuple[int, int]:
+    """
+    Source: https://git-scm.com/docs/git-fast-import#_commands
+
+    Copy a stream of git fast-export to git fast-import, replacing the
+    messages of commits on branches (refs/heads/*) by the result of the
+    callback (given the message and the branch).
+
+    :return: The number of messages handed to the callback, and how many of
+        them it changed
+    """
+    commits = changed = 0
+    branch = None
+    for line in source:
+        if line.startswith(b'data '):
+            data = source.read(int(line[5:]))
+            if branch is not None:
+                rewritten = callback(data, branch)
+                commits += 1
+                changed += rewritten != data
+                data = rewritten
+                branch = None
+            sink.write(b'data %d\n' % len(data))
+            sink.write(data)
+        else:
+            if line.startswith(b'commit refs/heads/'):
+                branch = line[18:].rstrip(b'\n').decode('utf-8')
+            sink.write(line)
+    return commits, changed
+
+
+def add_rule_arguments(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
         '-l', '--long-prefix', action='store_true',
         help='Add long prefix for branches (by default: no)',
@@ -90,61 +463,159 @@ def main(argv: Sequence[str] | None = None) -> int:
              ' (by default: feature, bugfix, hotfix),'
              ' may be specified multiple times',
     )
-    args = parser.parse_args(argv)
+    parser.add_argument(
+        '-s', '--schema', action='append',
+        help='Further branch naming schema to process with this hook,'
+             ' where "{ticket}" stands for the ticket and "*" for anything'
+             ' within a level of the branch name (e.g., "team/{ticket}/*"'
+             ' or "{ticket}_*"), may be specified multiple times'
+             ' (by default: none)',
+    )
+    parser.add_argument(
+        '-k', '--project-keys',
+        help='File listing the valid project keys (one per line),'
+             ' tickets of other projects are rejected'
+             ' (by default: any project key is valid)',
+    )
 
-    two_level_branches = frozenset(args.two_level or ('user', 'backup'))
-    processed_branches = frozenset(
-        args.branch or ('feature', 'bugfix', 'hotfix'),
+
+def get_project_keys(
+    parser: argparse.ArgumentParser,
+    args: argparse.Namespace,
+) -> ProjectKeys | None:
+    if not args.project_keys:
+        return None
+    try:
+        return load_project_keys(args.project_keys)
+    except OSError as e:
+        parser.error(f'Could not read the project keys: {e}')
+
+
+def get_rules(
+    parser: argparse.ArgumentParser,
+    args: argparse.Namespace,
+) -> BranchRules:
+    try:
+        return compile_rules(
+            frozenset(args.branch or DEFAULT_BRANCHES),
+            frozenset(args.two_level or DEFAULT_TWO_LEVEL),
+            tuple(args.schema or ()),
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def batch(argv: Sequence[str]) -> int:
+    parser = argparse.ArgumentParser(prog='commiticketing batch')
+    add_rule_arguments(parser)
+    parser.add_argument(
+        '--as-branch',
+        help='Derive the prefix from this branch name instead of the branch'
+             ' of each commit (e.g., for commits imported into main)',
+    )
+    parser.add_argument(
+        'revisions', nargs='+',
+        help='Branches or ranges of them (e.g., main..feature/ABC-1), whose'
+             ' commit messages are prefixed',
     )
+    args = parser.parse_args(argv)
+    rules = get_rules(parser, args)
+    project_keys = get_project_keys(parser, args)
     short_branches = frozenset(
-        args.exclude_long_prefix or ('feature', 'user', 'backup'),
+        args.exclude_long_prefix or DEFAULT_SHORT_BRANCHES,
     )
+
+    def callback(message: bytes, branch: str) -> bytes:
+        return filter_message(
+            message, args.as_branch or branch, rules, args.long_prefix,
+            short_branches, project_keys,
+        )
+
+    with (
+        subprocess.Popen(
+            (
+                'git', 'fast-export', '--no-data', '--reencode=yes',
+                '--signed-tags=strip', '--reference-excluded-parents',
+                *args.revisions,
+            ),
+            stdout=subprocess.PIPE,
+        ) as exporter,
+        subprocess.Popen(
+            ('git', 'fast-import', '--force', '--quiet'),
+            stdin=subprocess.PIPE,
+        ) as importer,
+    ):
+        assert exporter.stdout is not None and importer.stdin is not None
+        commits, changed = rewrite_stream(
+            exporter.stdout, importer.stdin, callback,
+        )
+        if exporter.wait() != 0:
+            # fast-import updates the branches only at the end of the stream
+            importer.kill()
+    if exporter.returncode != 0 or importer.returncode != 0:
+        print('Commiticketing could not rewrite the commit messages.')
+        return 1
+    print(f'Commiticketing prefixed {changed} of {commits} commit message(s).')
+    return 0
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == 'batch':
+        return batch(argv[1:])
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', help='Commit message to check')
+    add_rule_arguments(parser)
+    args = parser.parse_args(argv)
+
+    short_branches = frozenset(
+        args.exclude_long_prefix or DEFAULT_SHORT_BRANCHES,
+    )
+    rules = get_rules(parser, args)
+    project_keys = get_project_keys(parser, args)
     branch = get_active_branch_name()
 
     if not branch:
         print('Could not reify branch name.')
         return 3
 
-    with open(args.filename, encoding='utf-8') as msg:
-        lines = msg.readlines()
-
-    for candidate in frozenset.union(processed_branches, two_level_branches):
-        if match(r'^' + escape(candidate) + '/.*$', branch):
-            prefix = get_prefix(branch, two_level_branches)
-            if not prefix:
-                print(
-                    f'[{branch}] does not correspond to branch naming rules, '
-                    'consult guidelines.',
-                )
-                return 2
-
-            prefix += ': '
-            if args.long_prefix and candidate not in short_branches:
-                prefix += f'({candidate}) '
-
-            subject_line = lines[0]
-
-            lines[0] = lines[0].removeprefix(prefix)
-            lines[0] = lines[0][0].upper() + lines[0][1:]
-            lines[0] = prefix + lines[0]
-
-            if lines[0] != subject_line:
-                with open(args.filename, 'w', encoding='utf-8') as msg:
-                    print(
-                        'Commiticketing prefixed your subject line with '
-                        f'[{prefix}] and made it sentence case after.',
-                    )
-                    msg.writelines(lines)
-            else:
-                print('Commiticketing did not change your subject line.')
-
-            return 0
-
-    print(
-        f'You wanted to commit to a branch [{branch}], '
-        'which does not correspond to the commiticketing setup.',
-    )
-    return 1
+    found = rules.match(branch)
+    if found is None:
+        print(
+            f'You wanted to commit to a branch [{branch}], '
+            'which does not correspond to the commiticketing setup.',
+        )
+        return 1
+
+    if not found.ticket:
+        print(
+            f'[{branch}] does not correspond to branch naming rules, '
+            'consult guidelines.',
+        )
+        return 2
+
+    project = get_project(found.ticket)
+    if project_keys is not None and project not in project_keys:
+        suggestion = project_keys.suggest(project)
+        print(
+            f'[{branch}] refers to the project [{project}], which is not'
+            ' on the list of project keys'
+            + (f', did you mean [{suggestion}]?' if suggestion else '.'),
+        )
+        return 4
+
+    prefix = get_subject_prefix(found, args.long_prefix, short_branches)
+    if rewrite_subject_line(args.filename, prefix):
+        print(
+            'Commiticketing prefixed your subject line with '
+            f'[{prefix}] and made it sentence case after.',
+        )
+    else:
+        print('Commiticketing did not change your subject line.')
+
+    return 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,594 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import sys
+from collections.abc import Iterable
+from collections.abc import Iterator
+from collections.abc import Mapping
+from contextlib import contextmanager
+from os import environ
+from pathlib import Path
+from time import monotonic
+from time import sleep
+from time import time
+from typing import Any
+from typing import NamedTuple
+
+if sys.platform != 'win32':  # pragma: no branch
+    import fcntl
+
+SCHEMA_VERSION = 8
+LOCK_POLL = 0.01
+
+SCHEMA = '''
+DROP TABLE IF EXISTS issues;
+DROP TABLE IF EXISTS unavailable;
+DROP TABLE IF EXISTS breaker;
+DROP TABLE IF EXISTS rate_limit;
+DROP TABLE IF EXISTS verified;
+DROP TABLE IF EXISTS project_keys;
+CREATE TABLE issues (
+    jira_uri TEXT NOT NULL,
+    ticket TEXT NOT NULL,
+    body TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    PRIMARY KEY (jira_uri, ticket)
+);
+CREATE INDEX issues_lru ON issues (accessed_at);
+CREATE TABLE unavailable (
+    jira_uri TEXT NOT NULL,
+    ticket TEXT NOT NULL,
+    code INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (jira_uri, ticket)
+);
+CREATE TABLE breaker (
+    jira_uri TEXT PRIMARY KEY,
+    failures INTEGER NOT NULL,
+    open_until REAL NOT NULL
+);
+CREATE TABLE rate_limit (
+    jira_uri TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE verified (
+    fingerprint TEXT PRIMARY KEY,
+    verified_at REAL NOT NULL
+);
+CREATE INDEX verified_expiry ON verified (verified_at);
+CREATE TABLE project_keys (
+    jira_uri TEXT PRIMARY KEY,
+    keys TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+'''
+
+# the index of `cojira sync` is not disposable (e.g., on air-gapped agents it
+# cannot be rebuilt), hence it is kept when the schema of the cache changes
+INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS issue_index (
+    jira_uri TEXT NOT NULL,
+    ticket TEXT NOT NULL,
+    project TEXT NOT NULL,
+    status_category TEXT,
+    fix_versions TEXT NOT NULL,
+    PRIMARY KEY (jira_uri, ticket)
+);
+CREATE TABLE IF NOT EXISTS index_sync (
+    jira_uri TEXT NOT NULL,
+    project TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (jira_uri, project)
+);
+'''
+
+
+class CachePolicy(NamedTuple):
+    ttl: float
+    max_entries: int
+    stale: float = 0
+    negative_ttl: float = 0
+
+
+class CacheEntry(NamedTuple):
+    body: Any
+    stale: bool
+
+
+class Validators(NamedTuple):
+    body: Any
+    etag: str | None
+    last_modified: str | None
+
+
+class IndexEntry(NamedTuple):
+    status_category: str | None
+    fix_versions: list[str]
+
+
+def get_cache_dir() -> Path:
+    """
+    Source: https://specifications.freedesktop.org/basedir-spec/latest/
+
+    The cache is shared by every clone and worktree of the current user,
+    hence it lives in $XDG_CACHE_HOME (falling back to ~/.cache) and not in
+    the repository. Relative values of $XDG_CACHE_HOME are invalid according
+    to the specification and thus ignored.
+
+    :return: The directory for caches of ShellMagick commit hooks
+    """
+    xdg_cache_home = environ.get('XDG_CACHE_HOME', '')
+    if xdg_cache_home and Path(xdg_cache_home).is_absolute():
+        base = Path(xdg_cache_home)
+    else:
+        base = Path.home() / '.cache'
+    return base / 'shellmagick-commit-hooks'
+
+
+def connect(cache_dir: Path | None = None) -> sqlite3.Connection:
+    directory = cache_dir or get_cache_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(
+        directory / 'cojira.sqlite3', timeout=5, isolation_level=None,
+    )
+    if db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+        # the cache is disposable, so instead of migrating we start over;
+        # other processes may be at it at the same time, hence check again
+        # once holding the lock
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                for statement in (SCHEMA + INDEX_SCHEMA).split(';'):
+                    db.execute(statement)
+                db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    return db
+
+
+def normalize_uri(jira_uri: str) -> str:
+    return jira_uri.rstrip('/')
+
+
+def load(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    ticket: str,
+    policy: CachePolicy,
+) -> CacheEntry | None:
+    """
+    Entries older than the TTL are still returned (marked as stale), as long
+    as they are within the staleness window of the policy.
+
+    :return: The cached body of the ticket, or None if there is none usable
+    """
+    row = db.execute(
+        'SELECT body, fetched_at FROM issues'
+        ' WHERE jira_uri = ? AND ticket = ?',
+        (normalize_uri(jira_uri), ticket),
+    ).fetchone()
+    if not row:
+        return None
+    age = time() - row[1]
+    if age > policy.ttl + max(policy.stale, 0):
+        return None
+    db.execute(
+        'UPDATE issues SET accessed_at = ? WHERE jira_uri = ? AND ticket = ?',
+        (time(), normalize_uri(jira_uri), ticket),
+    )
+    return CacheEntry(json.loads(row[0]), age > policy.ttl)
+
+
+def load_validators(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    ticket: str,
+) -> Validators | None:
+    """
+    Regardless of its age, a cached ticket can be revalidated (instead of
+    being downloaded again), if JIRA gave an ETag or Last-Modified for it.
+
+    :return: The cached body of the ticket with its validators, or None if
+        there is nothing to revalidate
+    """
+    row = db.execute(
+        'SELECT body, etag, last_modified FROM issues'
+        ' WHERE jira_uri = ? AND ticket = ?'
+        ' AND (etag IS NOT NULL OR last_modified IS NOT NULL)',
+        (normalize_uri(jira_uri), ticket),
+    ).fetchone()
+    return Validators(json.loads(row[0]), row[1], row[2]) if row else None
+
+
+def touch(db: sqlite3.Connection, jira_uri: str, ticket: str) -> None:
+    now = time()
+    db.execute(
+        'UPDATE issues SET fetched_at = ?, accessed_at = ?'
+        ' WHERE jira_uri = ? AND ticket = ?',
+        (now, now, normalize_uri(jira_uri), ticket),
+    )
+
+
+def store(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    ticket: str,
+    body: Any,
+    policy: CachePolicy,
+    etag: str | None = None,
+    last_modified: str | None = None,
+) -> None:
+    now = time()
+    db.execute(
+        'INSERT OR REPLACE INTO issues'
+        ' (jira_uri, ticket, body, fetched_at, accessed_at, etag,'
+        ' last_modified) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (
+            normalize_uri(jira_uri), ticket, json.dumps(body), now, now, etag,
+            last_modified,
+        ),
+    )
+    db.execute(
+        'DELETE FROM unavailable WHERE jira_uri = ? AND ticket = ?',
+        (normalize_uri(jira_uri), ticket),
+    )
+    evict(db, policy.max_entries)
+
+
+def load_unavailable(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    ticket: str,
+    policy: CachePolicy,
+) -> int | None:
+    """
+    :return: The HTTP status code with which JIRA refused the ticket recently,
+        or None if it is not known to be unavailable
+    """
+    row = db.execute(
+        'SELECT code FROM unavailable'
+        ' WHERE jira_uri = ? AND ticket = ? AND fetched_at >= ?',
+        (normalize_uri(jira_uri), ticket, time() - policy.negative_ttl),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def store_unavailable(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    ticket: str,
+    code: int,
+    policy: CachePolicy,
+) -> None:
+    now = time()
+    db.execute(
+        'INSERT OR REPLACE INTO unavailable'
+        ' (jira_uri, ticket, code, fetched_at) VALUES (?, ?, ?, ?)',
+        (normalize_uri(jira_uri), ticket, code, now),
+    )
+    db.execute(
+        'DELETE FROM unavailable WHERE fetched_at < ?',
+        (now - policy.negative_ttl,),
+    )
+
+
+def evict(db: sqlite3.Connection, max_entries: int) -> None:
+    db.execute(
+        'DELETE FROM issues WHERE rowid NOT IN'
+        ' (SELECT rowid FROM issues ORDER BY accessed_at DESC LIMIT ?)',
+        (max(max_entries, 0),),
+    )
+
+
+def is_breaker_open(db: sqlite3.Connection, jira_uri: str) -> bool:
+    row = db.execute(
+        'SELECT open_until FROM breaker WHERE jira_uri = ?',
+        (normalize_uri(jira_uri),),
+    ).fetchone()
+    return bool(row) and time() < row[0]
+
+
+def record_failure(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    threshold: int,
+    cooldown: float,
+) -> None:
+    """
+    Once there are `threshold` failures in a row, the breaker opens for
+    `cooldown` seconds. After that, the next lookup is let through; in case it
+    fails again, the breaker re-opens immediately.
+    """
+    with db:
+        db.execute('BEGIN IMMEDIATE')
+        row = db.execute(
+            'SELECT failures FROM breaker WHERE jira_uri = ?',
+            (normalize_uri(jira_uri),),
+        ).fetchone()
+        failures = (row[0] if row else 0) + 1
+        db.execute(
+            'INSERT OR REPLACE INTO breaker (jira_uri, failures, open_until)'
+            ' VALUES (?, ?, ?)',
+            (
+                normalize_uri(jira_uri), failures,
+                time() + cooldown if failures >= threshold else 0,
+            ),
+        )
+
+
+def record_success(db: sqlite3.Connection, jira_uri: str) -> None:
+    db.execute(
+        'DELETE FROM breaker WHERE jira_uri = ?', (normalize_uri(jira_uri),),
+    )
+
+
+def take_token(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    rate: float,
+    burst: int,
+    max_wait: float | None = None,
+) -> float | None:
+    """
+    Token bucket shared by all processes of the user (the database lock
+    serializes them): it holds up to `burst` tokens and is refilled by `rate`
+    tokens per second. In case it is empty, the token is taken nevertheless
+    (i.e., the bucket goes into debt), which reserves the next free slot for
+    the caller instead of letting all waiting processes race for it.
+
+    A caller, which cannot wait `max_wait` seconds or longer (e.g., because
+    of its deadline), is refused instead, so that it does not reserve a slot
+    it would never use.
+
+    :return: Seconds to wait before the request may be sent, None if the
+        token was refused
+    """
+    with db:
+        db.execute('BEGIN IMMEDIATE')
+        row = db.execute(
+            'SELECT tokens, updated_at FROM rate_limit WHERE jira_uri = ?',
+            (normalize_uri(jira_uri),),
+        ).fetchone()
+        now = time()
+        tokens = float(max(burst, 1))
+        if row:
+            tokens = min(tokens, row[0] + (now - row[1]) * rate)
+        tokens -= 1
+        wait = -tokens / rate if tokens < 0 else 0
+        if max_wait is not None and wait >= max_wait:
+            return None
+        db.execute(
+            'INSERT OR REPLACE INTO rate_limit (jira_uri, tokens, updated_at)'
+            ' VALUES (?, ?, ?)',
+            (normalize_uri(jira_uri), tokens, now),
+        )
+    return wait
+
+
+def load_synced_at(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    project: str,
+) -> float | None:
+    """
+    :return: When the project was synced into the index last time, or None
+        if it never was
+    """
+    row = db.execute(
+        'SELECT synced_at FROM index_sync WHERE jira_uri = ? AND project = ?',
+        (normalize_uri(jira_uri), project),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def store_index(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    project: str,
+    entries: Mapping[str, IndexEntry],
+    synced_at: float,
+    full: bool,
+) -> None:
+    """
+    Store the synced tickets of the project into the index. In case of a full
+    sync, tickets of the project not synced anymore (e.g., deleted or moved)
+    are dropped from the index.
+    """
+    with db:
+        db.execute('BEGIN IMMEDIATE')
+        if full:
+            db.execute(
+                'DELETE FROM issue_index WHERE jira_uri = ? AND project = ?',
+                (normalize_uri(jira_uri), project),
+            )
+        db.executemany(
+            'INSERT OR REPLACE INTO issue_index'
+            ' (jira_uri, ticket, project, status_category, fix_versions)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            (
+                (
+                    normalize_uri(jira_uri), ticket, project,
+                    entry.status_category, json.dumps(entry.fix_versions),
+                )
+                for ticket, entry in entries.items()
+            ),
+        )
+        db.execute(
+            'INSERT OR REPLACE INTO index_sync (jira_uri, project, synced_at)'
+            ' VALUES (?, ?, ?)',
+            (normalize_uri(jira_uri), project, synced_at),
+        )
+
+
+def load_index(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    tickets: Iterable[str],
+) -> dict[str, IndexEntry]:
+    """
+    :return: The indexed tickets (tickets not in the index are left out)
+    """
+    entries = {}
+    for ticket in tickets:
+        row = db.execute(
+            'SELECT status_category, fix_versions FROM issue_index'
+            ' WHERE jira_uri = ? AND ticket = ?',
+            (normalize_uri(jira_uri), ticket),
+        ).fetchone()
+        if row:
+            entries[ticket] = IndexEntry(row[0], json.loads(row[1]))
+    return entries
+
+
+def load_project_keys(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    ttl: float,
+) -> frozenset[str] | None:
+    """
+    :return: The keys of the projects of the JIRA instance, or None if they
+        are not cached (or older than `ttl` seconds)
+    """
+    row = db.execute(
+        'SELECT keys, fetched_at FROM project_keys WHERE jira_uri = ?',
+        (normalize_uri(jira_uri),),
+    ).fetchone()
+    if row is None or time() - row[1] >= ttl:
+        return None
+    return frozenset(json.loads(row[0]))
+
+
+def store_project_keys(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    keys: Iterable[str],
+) -> None:
+    db.execute(
+        'INSERT OR REPLACE INTO project_keys (jira_uri, keys, fetched_at)'
+        ' VALUES (?, ?, ?)',
+        (normalize_uri(jira_uri), json.dumps(sorted(keys)), time()),
+    )
+
+
+def get_fingerprint(
+    jira_uri: str,
+    ticket: str,
+    rules: Mapping[str, Iterable[str]],
+    bucket: int,
+) -> str:
+    """
+    :return: The fingerprint of a ticket having passed the rules (e.g.,
+        allowed status categories) within the time bucket
+    """
+    payload = json.dumps(
+        [
+            normalize_uri(jira_uri), ticket,
+            {name: sorted(values) for name, values in rules.items()}, bucket,
+        ],
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def is_verified(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    ticket: str,
+    rules: Mapping[str, Iterable[str]],
+    grace: float,
+) -> bool:
+    """
+    Fingerprints are bucketed by the grace window, hence the current and the
+    previous bucket are looked up.
+
+    :return: Whether the ticket passed the same rules within the last `grace`
+        seconds
+    """
+    now = time()
+    bucket = int(now // grace)
+    for fingerprint in (
+        get_fingerprint(jira_uri, ticket, rules, bucket),
+        get_fingerprint(jira_uri, ticket, rules, bucket - 1),
+    ):
+        row = db.execute(
+            'SELECT verified_at FROM verified WHERE fingerprint = ?',
+            (fingerprint,),
+        ).fetchone()
+        if row and row[0] >= now - grace:
+            return True
+    return False
+
+
+def store_verified(
+    db: sqlite3.Connection,
+    jira_uri: str,
+    tickets: Iterable[str],
+    rules: Mapping[str, Iterable[str]],
+    grace: float,
+) -> None:
+    """
+    Remember that the tickets passed the rules just now, and forget those,
+    whose grace window has passed.
+    """
+    now = time()
+    bucket = int(now // grace)
+    with db:
+        db.execute('BEGIN IMMEDIATE')
+        db.execute(
+            'DELETE FROM verified WHERE verified_at < ?', (now - grace,),
+        )
+        db.executemany(
+            'INSERT OR REPLACE INTO verified (fingerprint, verified_at)'
+            ' VALUES (?, ?)',
+            (
+                (get_fingerprint(jira_uri, ticket, rules, bucket), now)
+                for ticket in tickets
+            ),
+        )
+
+
+@contextmanager
+def single_flight(
+    jira_uri: str,
+    ticket: str,
+    timeout: float,
+    cache_dir: Path | None = None,
+) -> Iterator[bool]:
+    """
+    Lock of a ticket, shared by all processes (and threads) of the user, so
+    that only one of them asks JIRA for it, while the others wait and then
+    find its answer in the cache. Waiting is given up after `timeout` seconds,
+    e.g., in case the holder of the lock hangs.
+
+    Not supported on Windows, there the lock is never held.
+
+    :return: Whether the lock is held
+    """
+    if sys.platform == 'win32':  # pragma: no cover
+        yield False
+        return
+    directory = (cache_dir or get_cache_dir()) / 'locks'
+    directory.mkdir(parents=True, exist_ok=True)
+    key = hashlib.sha256(
+        f'{normalize_uri(jira_uri)} {ticket}'.encode('utf-8'),
+    ).hexdigest()
+    with open(directory / f'{key[:32]}.lock', 'a') as f:
+        give_up_at = monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if monotonic() >= give_up_at:
+                    yield False
+                    return
+                sleep(LOCK_POLL)
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,400 @@
+from __future__ import annotations
+
+import base64
+import gzip
+import http.client
+import io
+import random
+import socket
+import threading
+from email.utils import parsedate_to_datetime
+from time import monotonic
+from time import perf_counter
+from time import time
+from typing import Any
+from typing import IO
+from typing import NamedTuple
+from urllib import request
+from urllib.error import HTTPError
+from urllib.error import URLError
+from urllib.parse import SplitResult
+from urllib.parse import unquote
+from urllib.parse import urljoin
+from urllib.parse import urlsplit
+
+MAX_IDLE_PER_HOST = 4
+MAX_REDIRECTS = 10
+REDIRECTS = frozenset((301, 302, 303, 307, 308))
+RETRIES = frozenset((429, 503))
+# errors of an idle connection, which the server closed meanwhile; anything
+# else (e.g., a timeout) is not retried, it would only multiply the wait
+STALE = (
+    http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError,
+)
+
+_idle: dict[tuple[str, str], list[HTTPConnection]] = {}
+_idle_lock = threading.Lock()
+
+
+class RequestPolicy(NamedTuple):
+    timeout: float | None = None
+    deadline: float | None = None
+    failure_threshold: int = 0
+    cooldown: float = 0
+    rate: float = 0
+    burst: int = 1
+    retries: int = 0
+    backoff: float = 0.5
+
+
+def get_remaining(policy: RequestPolicy | None) -> float | None:
+    """
+    :raises TimeoutError: In case the deadline has already passed
+    :return: The seconds left until the deadline (a value of
+        `time.monotonic()`) of the policy, None if there is no deadline
+    """
+    if policy is None or policy.deadline is None:
+        return None
+    remaining = policy.deadline - monotonic()
+    if remaining <= 0:
+        raise TimeoutError('Deadline for JIRA lookups exceeded')
+    return remaining
+
+
+def get_timeout(policy: RequestPolicy | None) -> float | None:
+    """
+    The timeout of a single request is capped by the time left until the
+    deadline of the policy.
+
+    :raises TimeoutError: In case the deadline has already passed
+    :return: The timeout for the next request, None if there is no limit
+    """
+    remaining = get_remaining(policy)
+    timeout = policy.timeout if policy else None
+    if remaining is None or timeout is None:
+        return timeout if remaining is None else remaining
+    return min(timeout, remaining)
+
+
+def get_retry_after(value: str | None) -> float | None:
+    """
+    Source: https://www.rfc-editor.org/rfc/rfc9110#field.retry-after
+
+    :return: The seconds to wait according to a Retry-After header (either
+        seconds or an HTTP date), or None if there is no valid one
+    """
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_backoff(
+    e: HTTPError,
+    attempt: int,
+    policy: RequestPolicy | None,
+) -> float | None:
+    """
+    Throttled (HTTP 429) or temporarily unavailable (HTTP 503) requests are
+    retried, after the time JIRA asks for (cf. Retry-After), or otherwise
+    after an exponentially growing, jittered delay.
+
+    :return: Seconds to wait before retrying the request, or None if it is
+        not to be retried (anymore, e.g., because of the deadline)
+    """
+    if policy is None or e.code not in RETRIES or attempt >= policy.retries:
+        return None
+    delay = get_retry_after(
+        e.headers.get('Retry-After') if e.headers else None,
+    )
+    if delay is None:
+        delay = policy.backoff * 2 ** attempt * random.uniform(0.5, 1)
+    if policy.deadline is not None and monotonic() + delay >= policy.deadline:
+        return None
+    return delay
+
+
+def is_outage(e: BaseException) -> bool:
+    """
+    :return: Whether the error means that JIRA is not reachable (as opposed
+        to JIRA refusing the request)
+    """
+    if isinstance(e, HTTPError):
+        return e.code >= 500 or e.code == 429
+    return isinstance(e, (URLError, OSError, http.client.HTTPException))
+
+
+class HTTPConnection(http.client.HTTPConnection):
+    """
+    A connection, which records how long resolving the host name (`dns`) and
+    connecting to it (`connect`, including the TLS handshake and tunneling
+    through a proxy, if any) took, in seconds.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.phases: dict[str, float] = {}
+        self._create_connection = self._resolve_and_connect
+
+    def _resolve_and_connect(
+        self,
+        address: tuple[str, int],
+        timeout: float | None = None,
+        source_address: tuple[str, int] | None = None,
+    ) -> socket.socket:
+        start = perf_counter()
+        addresses = socket.getaddrinfo(*address, 0, socket.SOCK_STREAM)
+        self.phases['dns'] = perf_counter() - start
+        error: OSError = OSError(f'getaddrinfo returned nothing for {address}')
+        for *_, sockaddr in addresses:
+            try:
+                return socket.create_connection(
+                    (str(sockaddr[0]), int(sockaddr[1])), timeout,
+                    source_address,
+                )
+            except OSError as e:
+                error = e
+        raise error
+
+    def connect(self) -> None:
+        start = perf_counter()
+        super().connect()
+        self.phases['connect'] = \
+            perf_counter() - start - self.phases.get('dns', 0)
+
+
+class HTTPSConnection(HTTPConnection, http.client.HTTPSConnection):
+    pass
+
+
+class Response:
+    """
+    A minimal stand-in for the response of `urllib.request.urlopen`, which
+    decompresses the body while it is read and hands the connection back to
+    the pool as soon as the body has been read completely.
+
+    The durations (in seconds) of the phases of the request are kept in
+    `phases`, cf. HTTPConnection; `ttfb` is the time from sending the request
+    until the headers of the response arrived.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        raw: http.client.HTTPResponse,
+        connection: HTTPConnection,
+        phases: dict[str, float] | None = None,
+    ) -> None:
+        self.url = url
+        self.status = raw.status
+        self.headers = raw.msg
+        self.phases = phases or {}
+        self._raw = raw
+        self._connection: HTTPConnection | None = connection
+        self._stream: IO[bytes] | gzip.GzipFile = raw
+        if (raw.getheader('Content-Encoding') or '').lower() == 'gzip':
+            self._stream = gzip.GzipFile(fileobj=raw, mode='rb')
+
+    def info(self) -> http.client.HTTPMessage:
+        return self.headers
+
+    def getheader(self, name: str, default: str | None = None) -> str | None:
+        return self.headers.get(name, default)
+
+    def read(self, amt: int | None = None) -> bytes:
+        data = self._stream.read() if amt is None else self._stream.read(amt)
+        if self._raw.isclosed():
+            self._release()
+        return data
+
+    def close(self) -> None:
+        if self._raw.length == 0:
+            # no body to read (e.g., 304), which also closes the response
+            self._raw.read()
+        if not self._raw.isclosed() and self._connection:
+            # unread body left on the wire, the connection is not reusable
+            self._connection.close()
+            self._connection = None
+        self._raw.close()
+        self._release()
+
+    def _release(self) -> None:
+        if self._connection:
+            checkin(self.url, self._connection, self._raw.will_close)
+            self._connection = None
+
+    def __enter__(self) -> Response:
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+
+def _key(url: str) -> tuple[str, str]:
+    parts = urlsplit(url)
+    return parts.scheme, parts.netloc
+
+
+def get_proxy(url: str) -> SplitResult | None:
+    """
+    Same as urllib, proxies are taken from the environment (e.g.,
+    $HTTPS_PROXY), unless the host is excluded (e.g., via $NO_PROXY).
+
+    :return: The proxy to use for the URL, or None if it is to be reached
+        directly
+    """
+    parts = urlsplit(url)
+    proxy = request.getproxies().get(parts.scheme)
+    if not proxy or request.proxy_bypass(parts.hostname or ''):
+        return None
+    return urlsplit(proxy if '://' in proxy else f'http://{proxy}')
+
+
+def get_proxy_headers(proxy: SplitResult) -> dict[str, str]:
+    if proxy.username is None:
+        return {}
+    credentials = f'{unquote(proxy.username)}:{unquote(proxy.password or "")}'
+    token = base64.b64encode(credentials.encode()).decode('ascii')
+    return {'Proxy-Authorization': f'Basic {token}'}
+
+
+def checkout(
+    url: str,
+    timeout: float | None,
+) -> tuple[HTTPConnection, bool]:
+    """
+    :return: An idle connection to the host of the URL if there is one,
+        otherwise a new one; and whether it has been reused
+    """
+    scheme, netloc = _key(url)
+    with _idle_lock:
+        idle = _idle.get((scheme, netloc))
+        if idle:
+            connection = idle.pop()
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            return connection, True
+    if scheme not in ('http', 'https'):
+        raise URLError(f'unknown url type: {scheme}')
+    proxy = get_proxy(url)
+    if scheme == 'https':
+        connection = HTTPSConnection(
+            proxy.netloc.rpartition('@')[2] if proxy else netloc,
+            timeout=timeout,
+        )
+        if proxy:
+            connection.set_tunnel(netloc, headers=get_proxy_headers(proxy))
+    else:
+        connection = HTTPConnection(
+            proxy.netloc.rpartition('@')[2] if proxy else netloc,
+            timeout=timeout,
+        )
+    return connection, False
+
+
+def checkin(
+    url: str,
+    connection: HTTPConnection,
+    will_close: bool,
+) -> None:
+    if will_close:
+        connection.close()
+        return
+    with _idle_lock:
+        idle = _idle.setdefault(_key(url), [])
+        if len(idle) < MAX_IDLE_PER_HOST:
+            idle.append(connection)
+            return
+    connection.close()
+
+
+def close_all() -> None:
+    with _idle_lock:
+        for idle in _idle.values():
+            for connection in idle:
+                connection.close()
+        _idle.clear()
+
+
+def _send(
+    req: request.Request,
+    timeout: float | None,
+) -> tuple[http.client.HTTPResponse, HTTPConnection, dict[str, float]]:
+    parts = urlsplit(req.full_url)
+    target = parts.path or '/'
+    if parts.query:
+        target += f'?{parts.query}'
+    headers = {
+        **dict(req.header_items()),
+        'Accept-Encoding': 'gzip',
+        'Connection': 'keep-alive',
+    }
+    proxy = get_proxy(req.full_url)
+    if proxy and parts.scheme == 'http':
+        # plain HTTP is not tunneled, the proxy gets the absolute URL instead
+        target = req.full_url
+        headers.update(get_proxy_headers(proxy))
+    while True:
+        connection, reused = checkout(req.full_url, timeout)
+        connection.phases = {}
+        try:
+            if connection.sock is None:
+                connection.connect()
+            start = perf_counter()
+            connection.request(
+                req.get_method(), target, body=req.data, headers=headers,
+            )
+            raw = connection.getresponse()
+            return raw, connection, {
+                **connection.phases, 'ttfb': perf_counter() - start,
+            }
+        except (http.client.HTTPException, OSError) as e:
+            connection.close()
+            if reused and isinstance(e, STALE):
+                continue
+            raise URLError(e)
+
+
+def urlopen(req: request.Request, timeout: float | None = None) -> Response:
+    """
+    Drop-in replacement for `urllib.request.urlopen` (for JIRA lookups),
+    which keeps idle keep-alive connections per host in a pool instead of
+    opening a new TCP connection (and TLS session) for each request, and asks
+    for gzip-compressed responses.
+
+    Same as urllib, redirects are followed and HTTP errors are raised as
+    `HTTPError`.
+
+    :return: The response, its body is decompressed while reading it
+    """
+    if timeout is None:
+        # same as urllib, the timeout may come along with the request
+        timeout = getattr(req, 'timeout', None)
+    for _ in range(MAX_REDIRECTS + 1):
+        raw, connection, phases = _send(req, timeout)
+        response = Response(req.full_url, raw, connection, phases)
+        location = raw.getheader('Location')
+        if raw.status in REDIRECTS and location:
+            response.read()
+            response.close()
+            req = request.Request(
+                urljoin(req.full_url, location),
+                headers=dict(req.header_items()),
+            )
+            continue
+        if raw.status >= 400:
+            body = response.read()
+            response.close()
+            raise HTTPError(
+                req.full_url, raw.status, raw.reason, raw.msg,
+                io.BytesIO(body),
+            )
+        return response
+    raise HTTPError(
+        req.full_url, raw.status, 'Too many redirects', raw.msg, None,
+    )
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import json
+import socket
+import socketserver
+import sys
+from collections.abc import Callable
+from os import environ
+from pathlib import Path
+from typing import Any
+
+from hooks import jira_cache
+
+if sys.platform != 'win32':  # pragma: no branch
+    import fcntl
+
+Handler = Callable[[dict[str, Any]], dict[str, Any]]
+
+
+class NotRunning(Exception):
+    pass
+
+
+def get_socket_path() -> Path:
+    """
+    Source: https://specifications.freedesktop.org/basedir-spec/latest/
+
+    The socket lives in $XDG_RUNTIME_DIR (which only the user can access),
+    falling back to the cache directory if it is not set (or relative).
+
+    :return: The path of the Unix domain socket of the daemon
+    """
+    xdg_runtime_dir = environ.get('XDG_RUNTIME_DIR', '')
+    if xdg_runtime_dir and Path(xdg_runtime_dir).is_absolute():
+        base = Path(xdg_runtime_dir) / 'shellmagick-commit-hooks'
+    else:
+        base = jira_cache.get_cache_dir()
+    return base / 'cojira.sock'
+
+
+def connect(timeout: float | None) -> socket.socket:
+    """
+    :raises NotRunning: In case no daemon listens on the socket (or Unix
+        domain sockets are not supported by the platform)
+    """
+    if not hasattr(socket, 'AF_UNIX'):  # pragma: no cover
+        raise NotRunning('Unix domain sockets are not supported')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(str(get_socket_path()))
+    except OSError as e:
+        sock.close()
+        raise NotRunning(str(e))
+    return sock
+
+
+def is_running() -> bool:
+    try:
+        connect(1).close()
+    except NotRunning:
+        return False
+    return True
+
+
+def call(request: dict[str, Any], timeout: float | None) -> dict[str, Any]:
+    """
+    Send one request (a line of JSON) to the daemon and wait for its answer.
+
+    :raises NotRunning: In case no daemon is running
+    :raises ConnectionError: In case the daemon did not answer
+    :return: The answer of the daemon
+    """
+    with connect(timeout) as sock, sock.makefile('rwb') as stream:
+        stream.write(json.dumps(request).encode('utf-8') + b'\n')
+        stream.flush()
+        line = stream.readline()
+    if not line:
+        raise ConnectionError('The daemon did not answer')
+    answer: dict[str, Any] = json.loads(line)
+    return answer
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    server: Server
+
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        if line:
+            answer = self.server.handler(json.loads(line))
+            self.wfile.write(json.dumps(answer).encode('utf-8') + b'\n')
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path, handler: Handler, idle_timeout: float):
+        super().__init__(str(path), RequestHandler)
+        self.handler = handler
+        self.timeout = idle_timeout
+        self.idle = False
+
+    def handle_timeout(self) -> None:
+        self.idle = True
+
+
+def serve(handler: Handler, idle_timeout: float) -> int:
+    """
+    Answer requests on the socket until none came for `idle_timeout` seconds.
+    Only the daemon holding the lock file next to the socket serves, so a
+    leftover socket of a daemon, which is not running anymore, is replaced,
+    but never the one of a daemon starting up concurrently.
+
+    :return: 0 once the daemon was idle, 1 if another one is running already
+    """
+    path = get_socket_path()
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    with open(path.with_suffix('.lock'), 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print('The daemon is running already')
+            return 1
+        path.unlink(missing_ok=True)
+        with Server(path, handler, idle_timeout) as server:
+            path.chmod(0o600)
+            try:
+                while not server.idle:
+                    server.handle_request()
+            finally:
+                path.unlink(missing_ok=True)
+    return 0
@@ -1,8 +1,110 @@
 from __future__ import annotations
 
 import argparse
+import json
+from collections.abc import Iterator
 from collections.abc import Sequence
 from re import match
+from typing import NamedTuple
+
+
+class Violation(NamedTuple):
+    rule: int
+    line: int
+    column: int
+    message: str
+
+    @property
+    def code(self) -> int:
+        """
+        :return: The return code of the hook for this violation
+        """
+        return 10 if self.rule == 0 else self.rule
+
+
+def check_lines(
+    lines: Sequence[str],
+    subject_line_length: int,
+    body_line_length: int,
+    ending: str,
+    numbered: bool = True,
+) -> Iterator[Violation]:
+    """
+    Check the rules in one pass over the lines of the message. Lines and
+    columns are counted from 1, a column points to the first offending
+    character.
+
+    In case `numbered` is set, messages about a line of the body name it by
+    its number within the body (as reported without --all, where the line of
+    the file is not part of the output).
+
+    :return: The violations, in the order of the rules (and lines)
+    """
+    # Rule 0: There must be a commit message
+    if not lines:
+        yield Violation(0, 1, 1, 'The commit message must not be empty.')
+        return
+
+    # Rule 1: Separate the subject line and the body with an empty line
+    if len(lines) != 1 and match(r'^.+$', lines[1].rstrip()):
+        yield Violation(
+            1, 2, 1,
+            'The subject line and body must be separated by an empty line.',
+        )
+
+    # Rule 2: Subject line is limited to 50 characters
+    # -> we by default relax this rule to 72
+    #    (modern world, auto-prefixing, etc.)
+    # -> can be relaxed via argument
+    if len(lines[0]) > subject_line_length:
+        yield Violation(
+            2, 1, subject_line_length + 1,
+            'The subject line must not be longer '
+            f'than {subject_line_length}, '
+            f'currently it is {len(lines[0])}.',
+        )
+
+    # Rule 3: Capitalize the subject line
+    # -> Should be done automatically via the prepare-commit-msg hook
+
+    # Rule 4: Do not end the subject line with a period
+    # -> We restrict this more,
+    #    it should not end with any non-word character
+    if match(r'^.*%s$' % ending, lines[0].rstrip()):
+        yield Violation(
+            4, 1, len(lines[0].rstrip()),
+            'The subject line must not end with punctuation.',
+        )
+
+    # Rule 5: Use imperative mood in the subject line
+    # -> NOT CHECKED, would need NLP
+
+    # Rule 6: Wrap the lines of the body at 72 characters
+    # -> we by default relax this rule to 120 (modern world)
+    # -> can be relaxed via argument
+    for index, line in enumerate(lines[2:]):
+        if len(line) > body_line_length:
+            current = f'line {index + 1}' if numbered else 'it'
+            quoted = line.rstrip('\r\n')
+            yield Violation(
+                6, index + 3, body_line_length + 1,
+                'Wrap lines of the message body '
+                f'after {body_line_length} characters, '
+                f'currently {current} is {len(line)} long. '
+                f'The line is: "{quoted}".',
+            )
+
+    # Rule 7: Use the body to explain what and why vs. how
+    # -> NOT CHECKED, would need advanced NLP
+
+
+def format_violation(filename: str, violation: Violation, fmt: str) -> str:
+    if fmt == 'json':
+        return json.dumps({'file': filename, **violation._asdict()})
+    return (
+        f'{filename}:{violation.line}:{violation.column}:'
+        f' rule {violation.rule}: {violation.message}'
+    )
 
 
 def main(argv: Sequence[str] | None = None) -> int:
@@ -27,66 +129,42 @@ def main(argv: Sequence[str] | None = None) -> int:
         help='Regex, defining forbidden characters for ending the subject line'
              ' (default: [.,;?!\\-])',
     )
+    parser.add_argument(
+        '-a',
+        '--all',
+        action='store_true',
+        help='Report all violations with rule, line and column,'
+             ' instead of stopping at the first one (default: no)',
+    )
+    parser.add_argument(
+        '-f',
+        '--format',
+        choices=('text', 'json'),
+        default='text',
+        help='Format of the violations reported with --all,'
+             ' "json" prints a line of JSON per violation (default: text)',
+    )
     args = parser.parse_args(argv)
 
     with open(args.filename, encoding='utf-8') as msg:
         lines = msg.readlines()
 
-        # Rule 0: There must be a commit message
-        if not lines:
-            print('The commit message must not be empty.')
-            return 10
+    violations = check_lines(
+        lines, int(args.subject_line_length), int(args.body_line_length),
+        args.ending, numbered=not args.all,
+    )
+    if not args.all:
+        first = next(violations, None)
+        if first is None:
+            return 0
+        print(first.message)
+        return first.code
 
-        # Rule 1: Separate the subject line and the body with an empty line
-        if len(lines) != 1 and match(r'^.+$', lines[1].rstrip()):
-            print(
-                'The subject line and body '
-                'must be separated by an empty line.',
-            )
-            return 1
-
-        # Rule 2: Subject line is limited to 50 characters
-        # -> we by default relax this rule to 72
-        #    (modern world, auto-prefixing, etc.)
-        # -> can be relaxed via argument
-        if len(lines[0]) > int(args.subject_line_length):
-            print(
-                'The subject line must not be longer '
-                f'than {args.subject_line_length}, '
-                f'currently it is {len(lines[0])}.',
-            )
-            return 2
-
-        # Rule 3: Capitalize the subject line
-        # -> Should be done automatically via the prepare-commit-msg hook
-
-        # Rule 4: Do not end the subject line with a period
-        # -> We restrict this more,
-        #    it should not end with any non-word character
-        if match(r'^.*%s$' % args.ending, lines[0].rstrip()):
-            print('The subject line must not end with punctuation.')
-            return 4
-
-        # Rule 5: Use imperative mood in the subject line
-        # -> NOT CHECKED, would need NLP
-
-        # Rule 6: Wrap the lines of the body at 72 characters
-        # -> we by default relax this rule to 120 (modern world)
-        # -> can be relaxed via argument
-        for index, line in enumerate(lines[2:]):
-            if len(line) > int(args.body_line_length):
-                print(
-                    'Wrap lines of the message body '
-                    f'after {args.body_line_length} characters, '
-                    f'currently line {index+1} is {len(line)} long. '
-                    f'The line is: "{line}".',
-                )
-                return 6
-
-        # Rule 7: Use the body to explain what and why vs. how
-        # -> NOT CHECKED, would need advanced NLP
-
-    return 0
+    result = 0
+    for violation in violations:
+        print(format_violation(args.filename, violation, args.format))
+        result = result or violation.code
+    return result
 
 
 if __name__ == '__main__':
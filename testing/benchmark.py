@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+from collections import Counter
+from collections.abc import Sequence
+from time import perf_counter
+
+from hooks import cojira
+from hooks import jira_client
+from testing import jira_server
+
+
+def measure(
+    argv: Sequence[str],
+    runs: int,
+) -> tuple[list[float], Counter[int]]:
+    """
+    The hook is run in-process, but simulates a fresh process per run: idle
+    connections left over from the previous run are closed beforehand.
+    Interpreter startup (and importing the hook) is not part of the measured
+    durations, hence not of p50/p99 either.
+
+    :return: The durations of the runs of the hook (in seconds), and how
+        often it returned which code
+    """
+    durations = []
+    codes: Counter[int] = Counter()
+    for _ in range(runs):
+        jira_client.close_all()
+        start = perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            codes[cojira.main(argv)] += 1
+        durations.append(perf_counter() - start)
+    return durations, codes
+
+
+def report(name: str, durations: list[float], codes: Counter[int]) -> str:
+    if len(durations) > 1:
+        percentiles = statistics.quantiles(
+            durations, n=100, method='inclusive',
+        )
+        p50, p99 = percentiles[49], percentiles[98]
+    else:
+        p50 = p99 = durations[0]
+    return (
+        f'{name:<12} p50={p50 * 1000:8.2f}ms p99={p99 * 1000:8.2f}ms'
+        f' max={max(durations) * 1000:8.2f}ms'
+        f' codes={dict(sorted(codes.items()))}'
+    )
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m testing.benchmark')
+    parser.add_argument(
+        '-n', '--runs', type=int, default=100,
+        help='Number of runs of the hook per scenario (default: 100)',
+    )
+    parser.add_argument(
+        '-r', '--references', type=int, default=0,
+        help='Number of further tickets referenced by the commit message'
+             ' (default: 0)',
+    )
+    parser.add_argument(
+        '-a', '--hook-args', action='append', default=[],
+        help='Further argument for the hook (e.g., "--retries=0"),'
+             ' may be specified multiple times',
+    )
+    jira_server.add_fault_arguments(parser)
+    args = parser.parse_args(argv)
+
+    references = ', '.join(f'ABC-{i}' for i in range(2, args.references + 2))
+    with (
+        tempfile.TemporaryDirectory() as directory,
+        jira_server.running(jira_server.get_faults(args)) as server,
+    ):
+        os.environ['XDG_CACHE_HOME'] = os.path.join(directory, 'cache')
+        os.environ['XDG_RUNTIME_DIR'] = os.path.join(directory, 'run')
+        message = os.path.join(directory, 'COMMIT_EDITMSG')
+        with open(message, 'w', encoding='utf-8') as f:
+            f.write('ABC-1: Benchmark\n')
+            if references:
+                f.write(f'\nRefs: {references}\n')
+        hook = (message, f'-u={server.url}', '-p=pat', *args.hook_args)
+        scenarios = {
+            'cold': (*hook, '-c=0'),
+            'cached': (*hook, '-c=3600'),
+        }
+        for name, scenario in scenarios.items():
+            print(report(name, *measure(scenario, args.runs)))
+        print(f'{len(server.requests)} requests served')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
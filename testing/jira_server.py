@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import threading
+from collections.abc import Iterator
+from collections.abc import Mapping
+from collections.abc import Sequence
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from time import sleep
+from typing import Any
+from typing import NamedTuple
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+TICKET = re.compile(r'^[A-Z][A-Z0-9_]+-[1-9][0-9]*$')
+
+
+class Faults(NamedTuple):
+    latency: float = 0
+    payload_size: int = 0
+    throttle: float = 0
+    retry_after: int = 1
+    error: float = 0
+    drop: float = 0
+    seed: int | None = None
+
+
+def make_issue(key: str, fields: Mapping[str, Any] | None = None) -> Any:
+    """
+    :return: The ticket as JIRA would return it, by default in progress and
+        with a single fix version
+    """
+    return {
+        'key': key,
+        'fields': {
+            'status': {
+                'name': 'In Progress',
+                'statusCategory': {'key': 'indeterminate'},
+            },
+            'fixVersions': [{'name': '1.0'}],
+            **(fields or {}),
+        },
+    }
+
+
+def project(issue: Any, fields: str | None, payload_size: int) -> Any:
+    """
+    Same as JIRA, only the requested fields are returned. Without a
+    projection, the ticket is padded to the payload size (as if it had
+    a long description and comments).
+    """
+    if fields is None:
+        return {
+            **issue,
+            'fields': {
+                **issue['fields'],
+                'description': 'x' * payload_size,
+            },
+        }
+    wanted = set(fields.split(','))
+    return {
+        **issue,
+        'fields': {
+            name: value
+            for name, value in issue['fields'].items() if name in wanted
+        },
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: JiraServer
+
+    def log_message(self, *_: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        faults = self.server.faults
+        self.server.requests.append(self.path)
+        sleep(faults.latency)
+        with self.server.lock:
+            roll = self.server.random.random()
+        if roll < faults.drop:
+            self.close_connection = True
+            return
+        if roll < faults.drop + faults.throttle:
+            self.reply(
+                429, {'errorMessages': ['Rate limit exceeded']},
+                {'Retry-After': str(faults.retry_after)},
+            )
+            return
+        if roll < faults.drop + faults.throttle + faults.error:
+            self.reply(503, {'errorMessages': ['Service Unavailable']})
+            return
+
+        parts = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        if parts.path.startswith('/rest/api/latest/issue/'):
+            key = parts.path.rpartition('/')[2]
+            issue = self.server.get_issue(key)
+            if issue is None:
+                self.reply(404, {'errorMessages': ['Issue does not exist']})
+            else:
+                self.reply(
+                    200,
+                    project(issue, query.get('fields'), faults.payload_size),
+                )
+        elif parts.path == '/rest/api/2/search':
+            self.search(query)
+        else:
+            self.reply(404, {'errorMessages': ['Not found']})
+
+    def search(self, query: Mapping[str, str]) -> None:
+        match = re.fullmatch(r'key in \((.*)\)', query.get('jql', ''))
+        keys = match.group(1).split(',') if match else []
+        issues = [
+            issue for issue in map(self.server.get_issue, keys)
+            if issue is not None
+        ]
+        start_at = int(query.get('startAt', 0))
+        max_results = int(query.get('maxResults', 50))
+        self.reply(200, {
+            'startAt': start_at,
+            'maxResults': max_results,
+            'total': len(issues),
+            'issues': [
+                project(
+                    issue, query.get('fields'),
+                    self.server.faults.payload_size,
+                )
+                for issue in issues[start_at:start_at + max_results]
+            ],
+        })
+
+    def reply(
+        self,
+        status: int,
+        payload: Any,
+        headers: Mapping[str, str] | None = None,
+    ) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class JiraServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        faults: Faults = Faults(),
+        issues: Mapping[str, Any] | None = None,
+    ):
+        super().__init__(('127.0.0.1', port), Handler)
+        self.faults = faults
+        self.issues = dict(issues or {})
+        self.requests: list[str] = []
+        self.lock = threading.Lock()
+        self.random = random.Random(faults.seed)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def get_issue(self, key: str) -> Any:
+        """
+        :return: The configured ticket, or a made up one for any valid key,
+            None if the ticket is configured as missing (None) or the key is
+            invalid
+        """
+        if key in self.issues:
+            return self.issues[key]
+        return make_issue(key) if TICKET.match(key) else None
+
+
+@contextmanager
+def running(
+    faults: Faults = Faults(),
+    issues: Mapping[str, Any] | None = None,
+) -> Iterator[JiraServer]:
+    """
+    Run the stand-in on an ephemeral port in a background thread.
+    """
+    server = JiraServer(0, faults, issues)
+    thread = threading.Thread(
+        target=server.serve_forever, args=(0.01,), daemon=True,
+    )
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        '--latency', type=float, default=0,
+        help='Seconds each request is delayed by (default: 0)',
+    )
+    parser.add_argument(
+        '--payload-size', type=int, default=0,
+        help='Bytes of padding of tickets requested without a projection'
+             ' of fields (default: 0)',
+    )
+    parser.add_argument(
+        '--throttle', type=float, default=0,
+        help='Share of requests answered with HTTP 429 (default: 0)',
+    )
+    parser.add_argument(
+        '--retry-after', type=int, default=1,
+        help='Seconds of Retry-After of throttled requests (default: 1)',
+    )
+    parser.add_argument(
+        '--error', type=float, default=0,
+        help='Share of requests answered with HTTP 503 (default: 0)',
+    )
+    parser.add_argument(
+        '--drop', type=float, default=0,
+        help='Share of requests, whose connection is dropped without'
+             ' an answer (default: 0)',
+    )
+    parser.add_argument(
+        '--seed', type=int,
+        help='Seed of the random faults, for reproducible runs',
+    )
+
+
+def get_faults(args: argparse.Namespace) -> Faults:
+    return Faults(
+        args.latency, args.payload_size, args.throttle, args.retry_after,
+        args.error, args.drop, args.seed,
+    )
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m testing.jira_server')
+    parser.add_argument('--port', type=int, default=8080)
+    add_fault_arguments(parser)
+    args = parser.parse_args(argv)
+    with JiraServer(args.port, get_faults(args)) as server:
+        print(f'Serving a stand-in for JIRA on {server.url}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
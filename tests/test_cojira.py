@@ -3,31 +3,50 @@ from __future__ import annotations
 import json
 import re
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from email.message import Message
 from os import environ
 from typing import Any
 from unittest.mock import patch
-from urllib import request
 from urllib.error import HTTPError
 from urllib.error import URLError
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
 from urllib.request import Request
 
 import pytest
 from typing_extensions import Buffer
 
 from hooks import cojira
+from hooks import jira_client
+from testing import jira_server
 
 
 @pytest.fixture(autouse=True)
 def restore_urlopen():
     # before
-    original_urlopener = cojira.request.urlopen
+    original_urlopener = cojira.jira_client.urlopen
 
     # test
     yield
 
     # after
-    cojira.request.urlopen = original_urlopener
-    assert cojira.request.urlopen == request.urlopen
+    cojira.jira_client.urlopen = original_urlopener
+    assert cojira.jira_client.urlopen == jira_client.urlopen
+
+
+@pytest.fixture(autouse=True)
+def reset_daemon_spawned(monkeypatch):
+    monkeypatch.setattr(cojira, '_daemon_spawned', False)
+
+
+@pytest.fixture(autouse=True)
+def xdg_cache_home(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path / 'run'))
 
 
 class CalledProcessError(RuntimeError):
@@ -73,17 +92,24 @@ class MockedInfo:
     def __init__(self, charset):
         self.charset = charset
 
-    def get_param(self, param_name):
-        return self.charset if 'charset' == param_name else None
+    def get_content_charset(self, failobj=None):
+        return self.charset or failobj
 
 
 class MockedResponse:
-    def __init__(self, payload, charset=None):
+    def __init__(self, payload, charset=None, status=200, headers=None):
         if type(payload) is bytes:
             self.payload = payload
         else:
             self.payload = payload.encode('utf-8')
         self._info = MockedInfo(charset)
+        self.status = status
+        self.headers = headers or {}
+        self.url = 'http://mocked'
+        self.phases = {'ttfb': 0.25}
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
 
     def read(self):
         return self.payload
@@ -91,6 +117,12 @@ class MockedResponse:
     def info(self):
         return self._info
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
 
 def unauthorized(_):
     raise HTTPError(
@@ -134,7 +166,7 @@ def unauthorized(_):
     ],
 )
 def test_get_ticket_version(params):
-    cojira.request.urlopen = params['mocked_response']
+    cojira.jira_client.urlopen = params['mocked_response']
     if params['expected']:
         assert \
             cojira.get_ticket_version('na', 'http://bana', 'bu') == \
@@ -173,7 +205,7 @@ def test_get_ticket_version(params):
 )
 def test_jira_pat_exceptions(params):
     if params['mocked_response']:
-        cojira.request.urlopen = params['mocked_response']
+        cojira.jira_client.urlopen = params['mocked_response']
     try:
         result = cojira.fetch_jira(
             params['ticket'], params['uri'], params['pat'],
@@ -213,7 +245,7 @@ def check_auth_header(request: Request):
     ],
 )
 def test_jira_auth(params):
-    cojira.request.urlopen = check_auth_header
+    cojira.jira_client.urlopen = check_auth_header
     try:
         if type(params['expected']) is not HTTPError:
             assert cojira.fetch_jira('tick', 'http://et', params['token']) == \
@@ -255,7 +287,7 @@ def test_jira_auth(params):
     ],
 )
 def test_get_ticket_status_category(params):
-    cojira.request.urlopen = params['mocked_response']
+    cojira.jira_client.urlopen = params['mocked_response']
     if params['expected']:
         assert \
             cojira.get_ticket_status_category('na', 'http://bana', 'bu') == \
@@ -271,7 +303,7 @@ def mocked_response(_):
 
 
 def test_cojira_non_json_response(tmpdir):
-    cojira.request.urlopen = lambda _: MockedResponse('<this><is not="a"/><json/></this>')  # noqa: E501
+    cojira.jira_client.urlopen = lambda _: MockedResponse('<this><is not="a"/><json/></this>')  # noqa: E501
     with tmpdir.as_cwd():
         exec_cmd('git', 'init')
         f = tmpdir.join('pseudo_commit_msg.txt')
@@ -280,7 +312,7 @@ def test_cojira_non_json_response(tmpdir):
 
 
 def test_cojira_ticket_is_done(tmpdir):
-    cojira.request.urlopen = lambda _: MockedResponse('{"fields": { "status": {"statusCategory": {"key": "done"}} }}')  # noqa: E501
+    cojira.jira_client.urlopen = lambda _: MockedResponse('{"fields": { "status": {"statusCategory": {"key": "done"}} }}')  # noqa: E501
     with tmpdir.as_cwd():
         exec_cmd('git', 'init')
         f = tmpdir.join('pseudo_commit_msg.txt')
@@ -289,7 +321,7 @@ def test_cojira_ticket_is_done(tmpdir):
 
 
 def test_cojira_ticket_without_version(tmpdir):
-    cojira.request.urlopen = lambda _: MockedResponse('')
+    cojira.jira_client.urlopen = lambda _: MockedResponse('')
     with tmpdir.as_cwd():
         exec_cmd('git', 'init')
         f = tmpdir.join('pseudo_commit_msg.txt')
@@ -317,7 +349,7 @@ def test_cojira_without_uri(tmpdir):
 
 
 def test_cojira_with_non_utf8():
-    cojira.request.urlopen = lambda _: MockedResponse(b'\xff\xfe{\x00"\x00j\x00"\x00:\x00"\x00s\x00\xf8\x00n\x00"\x00}\x00', 'utf_16')  # noqa: E501
+    cojira.jira_client.urlopen = lambda _: MockedResponse(b'\xff\xfe{\x00"\x00j\x00"\x00:\x00"\x00s\x00\xf8\x00n\x00"\x00}\x00', 'utf_16')  # noqa: E501
     assert cojira.fetch_jira('tick', 'http://et', '') == \
         json.loads(b'\xff\xfe{\x00"\x00j\x00"\x00:\x00"\x00s\x00\xf8\x00n\x00"\x00}\x00'.decode('utf_16'))  # noqa: E501
 
@@ -333,7 +365,7 @@ def test_cojira_with_non_utf8():
     ],
 )
 def test_multiple_allowed_fix_versions(tmpdir, params):
-    cojira.request.urlopen = mocked_response
+    cojira.jira_client.urlopen = mocked_response
     with tmpdir.as_cwd():
         exec_cmd('git', 'init')
         f = tmpdir.join('pseudo_commit_msg.txt')
@@ -432,7 +464,7 @@ def test_multiple_allowed_fix_versions(tmpdir, params):
     ],
 )
 def test_env_var_resolution(tmpdir, params):
-    cojira.request.urlopen = mocked_response
+    cojira.jira_client.urlopen = mocked_response
     environ['YYYJIRA_URI'] = 'http://banana'
     environ['YYYJIRA_PAT'] = 'pat_on_the_back'
     environ['VERSION'] = 'version'
@@ -451,7 +483,7 @@ def test_env_var_resolution(tmpdir, params):
 
 
 def test_jira_pat_as_env_var(tmpdir):
-    cojira.request.urlopen = check_auth_header
+    cojira.jira_client.urlopen = check_auth_header
     environ['YYYJIRA_PAT'] = 'pat_on_the_back'
     with tmpdir.as_cwd():
         exec_cmd('git', 'init')
@@ -466,7 +498,7 @@ def test_jira_pat_as_env_var(tmpdir):
 
 
 def test_version_empty_via_env_var(tmpdir):
-    cojira.request.urlopen = mocked_response
+    cojira.jira_client.urlopen = mocked_response
     environ['EMPTY_VERSION'] = ''
     with (
         tmpdir.as_cwd(),
@@ -489,7 +521,7 @@ def test_version_empty_via_env_var(tmpdir):
 
 
 def test_version_multiple_via_env_var(tmpdir):
-    cojira.request.urlopen = mocked_response
+    cojira.jira_client.urlopen = mocked_response
     environ['EMPTY_VERSION'] = 'a,b,version'
     with (
         tmpdir.as_cwd(),
@@ -614,7 +646,7 @@ def test_cojira_outputs(tmpdir, params):
         patch('builtins.print') as mocked_print,
     ):
         if params['u'] is not None:
-            cojira.request.urlopen = params['u']
+            cojira.jira_client.urlopen = params['u']
         exec_cmd('git', 'init')
         f = tmpdir.join('pseudo_commit_msg.txt')
         f.write_text(params['msg'], encoding='utf-8')
@@ -624,3 +656,1482 @@ def test_cojira_outputs(tmpdir, params):
             assert re.match(t, mocked_print.call_args_list[index].args[0]) \
                 is not None
             index -= 1
+
+
+def test_cojira_fetches_ticket_once(tmpdir):
+    calls = []
+
+    def counting_response(req):
+        calls.append(req.full_url)
+        return mocked_response(req)
+
+    cojira.jira_client.urlopen = counting_response
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        assert cojira.main(
+            ('pseudo_commit_msg.txt', '-v=version', '-u=http://banana'),
+        ) == 0
+    assert calls == [
+        'http://banana/rest/api/latest/issue/ABC-123'
+        '?fields=status%2CfixVersions',
+    ]
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(
+            mocked_response=lambda _: MockedResponse('<no json/>'),
+            expected=cojira.IssueSnapshot(None, None),
+        ),
+        dict(
+            mocked_response=mocked_response,
+            expected=cojira.IssueSnapshot('version', 'indeterminate'),
+        ),
+    ],
+)
+def test_get_issue(params):
+    cojira.jira_client.urlopen = params['mocked_response']
+    assert cojira.get_issue('na', 'http://bana', 'bu') == params['expected']
+
+
+def test_cojira_reuses_cached_ticket(tmpdir):
+    calls = []
+
+    def counting_response(req):
+        calls.append(req.full_url)
+        return mocked_response(req)
+
+    cojira.jira_client.urlopen = counting_response
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        for _ in range(3):
+            assert cojira.main(
+                (
+                    'pseudo_commit_msg.txt', '-v=version', '-u=http://banana',
+                    '-c=60',
+                ),
+            ) == 0
+    assert calls == [
+        'http://banana/rest/api/latest/issue/ABC-123'
+        '?fields=status%2CfixVersions',
+    ]
+
+
+def test_cojira_skips_recently_verified_ticket(tmpdir):
+    calls = []
+
+    def counting_response(req):
+        calls.append(req.full_url)
+        return mocked_response(req)
+
+    cojira.jira_client.urlopen = counting_response
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana\n\nRefs: ABC-124', encoding='utf-8')
+        for _ in range(3):
+            assert cojira.main(
+                ('pseudo_commit_msg.txt', '-u=http://banana', '-g=60'),
+            ) == 0
+        assert len(calls) == 2
+        # other rules, other fingerprint
+        assert cojira.main(
+            (
+                'pseudo_commit_msg.txt', '-u=http://banana', '-g=60',
+                '-v=version',
+            ),
+        ) == 0
+        assert len(calls) == 4
+        # failures are not remembered
+        assert cojira.main(
+            (
+                'pseudo_commit_msg.txt', '-u=http://banana', '-g=60',
+                '-e=indeterminate',
+            ),
+        ) == 1
+        assert cojira.main(
+            (
+                'pseudo_commit_msg.txt', '-u=http://banana', '-g=60',
+                '-e=indeterminate',
+            ),
+        ) == 1
+        assert len(calls) == 8
+    printed = [c.args[0] for c in mocked_print.call_args_list]
+    assert printed.count('Ticket "ABC-123" was verified recently') == 2
+    assert printed.count('Ticket "ABC-124" was verified recently') == 2
+
+
+def test_cojira_checks_verified_ticket_after_grace(tmpdir):
+    calls = []
+
+    def counting_response(req):
+        calls.append(req.full_url)
+        return mocked_response(req)
+
+    cojira.jira_client.urlopen = counting_response
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        for now in (1000, 1030, 1070):
+            with patch('hooks.jira_cache.time', return_value=now):
+                assert cojira.main(
+                    ('pseudo_commit_msg.txt', '-u=http://banana', '-g=60'),
+                ) == 0
+    assert len(calls) == 2
+
+
+def projects_and_issues(calls, keys=('ABC', 'DEF')):
+    def respond(req):
+        calls.append(urlsplit(req.full_url).path)
+        if req.full_url.endswith('/rest/api/2/project'):
+            return MockedResponse(
+                json.dumps([{'key': key, 'name': key} for key in keys]),
+            )
+        return mocked_response(req)
+    return respond
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(
+            message='ABD-123: Typo',
+            expected_code=5,
+            expected_print='Project of ticket does not exist'
+                           ' (did you mean "ABC-123"?)',
+            expected_calls=['/rest/api/2/project'],
+        ),
+        dict(
+            message='XYZ-123: Unknown',
+            expected_code=5,
+            expected_print='Project of ticket does not exist',
+            expected_calls=['/rest/api/2/project'],
+        ),
+        dict(
+            message='ABC-123: Known\n\nRefs: ABX-1, DEF-2',
+            expected_code=5,
+            expected_print='Project of ticket does not exist'
+                           ' (did you mean "ABC-1"?)',
+            expected_calls=[
+                '/rest/api/2/project',
+                '/rest/api/latest/issue/ABC-123',
+                '/rest/api/latest/issue/DEF-2',
+            ],
+        ),
+    ],
+)
+def test_cojira_rejects_unknown_project(tmpdir, params):
+    calls = []
+    cojira.jira_client.urlopen = projects_and_issues(calls)
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text(params['message'], encoding='utf-8')
+        assert cojira.main(
+            (
+                'pseudo_commit_msg.txt', '-u=http://banana',
+                '--project-keys-ttl=3600', '-w=1',
+            ),
+        ) == params['expected_code']
+    assert sorted(calls) == params['expected_calls']
+    mocked_print.assert_any_call(params['expected_print'])
+
+
+def test_cojira_caches_project_keys(tmpdir):
+    calls = []
+    cojira.jira_client.urlopen = projects_and_issues(calls)
+    args = (
+        'pseudo_commit_msg.txt', '-u=http://banana', '--project-keys-ttl=60',
+    )
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABD-123: Typo', encoding='utf-8')
+        with patch('hooks.jira_cache.time', return_value=1000):
+            assert cojira.main(args) == 5
+        with patch('hooks.jira_cache.time', return_value=1030):
+            assert cojira.main(args) == 5
+        assert calls == ['/rest/api/2/project']
+        with patch('hooks.jira_cache.time', return_value=1060):
+            assert cojira.main(args) == 5
+        assert calls == ['/rest/api/2/project'] * 2
+        # offline, the project keys are not needed, the index is asked only
+        assert cojira.main((*args, '-o')) == 6
+        assert calls == ['/rest/api/2/project'] * 2
+
+
+def test_cojira_project_keys_jira_not_reachable(tmpdir):
+    cojira.jira_client.urlopen = refused
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        assert cojira.main(
+            (
+                'pseudo_commit_msg.txt', '-u=http://banana',
+                '--project-keys-ttl=60', '--retries=0',
+            ),
+        ) == 6
+
+
+def test_cojira_does_not_cache_unexpected_response(tmpdir):
+    calls = []
+
+    def counting_response(req):
+        calls.append(req.full_url)
+        return MockedResponse('<no json/>')
+
+    cojira.jira_client.urlopen = counting_response
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        for _ in range(2):
+            assert cojira.main(
+                ('pseudo_commit_msg.txt', '-u=http://banana', '-c=60'),
+            ) == 1
+    assert len(calls) == 2
+
+
+def test_cojira_serves_stale_ticket_and_refreshes_in_background(tmpdir):
+    calls = []
+
+    def counting_response(req):
+        calls.append(req.full_url)
+        return mocked_response(req)
+
+    cojira.jira_client.urlopen = counting_response
+    args = (
+        'pseudo_commit_msg.txt', '-u=http://banana', '-p=pat',
+        '-c=60', '--cache-size=7', '-s=300',
+    )
+    with (
+        tmpdir.as_cwd(),
+        patch('hooks.cojira.subprocess.Popen') as mocked_popen,
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        with patch('hooks.jira_cache.time', return_value=1000):
+            assert cojira.main(args) == 0
+        with patch('hooks.jira_cache.time', return_value=1200):
+            assert cojira.main(args) == 0
+        with patch('hooks.jira_cache.time', return_value=1400):
+            assert cojira.main(args) == 0
+    assert len(calls) == 2
+    mocked_popen.assert_called_once()
+    assert mocked_popen.call_args.args[0][1:] == (
+        '-m', 'hooks.cojira', 'refresh', 'ABC-123',
+        '--jira-uri=http://banana', '--jira-pat=$COJIRA_REFRESH_PAT',
+        '--cache-ttl=60.0', '--cache-size=7', '--timeout=10',
+        '--rate-limit=0', '--rate-burst=1',
+    )
+    assert mocked_popen.call_args.kwargs['env']['COJIRA_REFRESH_PAT'] == 'pat'
+    assert mocked_popen.call_args.kwargs['stdout'] == subprocess.DEVNULL
+
+
+def test_cojira_refresh(tmpdir):
+    cojira.jira_client.urlopen = check_auth_header
+    environ['YYYJIRA_PAT'] = 'pat_on_the_back'
+    assert cojira.main(
+        (
+            'refresh', 'ABC-123', '-u=http://banana', '-p=$YYYJIRA_PAT',
+            '-c=60',
+        ),
+    ) == 0
+    cojira.jira_client.urlopen = unauthorized
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        assert cojira.main(
+            ('pseudo_commit_msg.txt', '-u=http://banana', '-c=60', '-e=x'),
+        ) == 0
+
+
+def test_cojira_refresh_unexpected_response():
+    cojira.jira_client.urlopen = lambda _: MockedResponse('<no json/>')
+    assert cojira.main(('refresh', 'ABC-123', '-u=http://banana')) == 1
+
+
+def test_cojira_argv_from_command_line(tmpdir):
+    with (
+        tmpdir.as_cwd(),
+        patch('sys.argv', ['cojira', 'pseudo_commit_msg.txt', '-l']),
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        assert cojira.main() == 0
+
+
+def not_found(req):
+    raise HTTPError(
+        code=404, url=req.full_url, msg='test HTTP 404', hdrs=[], fp=None,
+    )
+
+
+@pytest.mark.parametrize('code', (403, 404))
+def test_get_issue_unavailable(code):
+    def refusing(req):
+        raise HTTPError(
+            code=code, url=req.full_url, msg='refused', hdrs=[], fp=None,
+        )
+
+    cojira.jira_client.urlopen = refusing
+    assert cojira.get_issue('na', 'http://bana', 'bu') == \
+        cojira.IssueSnapshot(None, None, code)
+
+
+def test_get_issue_unauthorized_is_not_cached():
+    calls = []
+
+    def counting_unauthorized(req):
+        calls.append(req.full_url)
+        unauthorized(req)
+
+    cojira.jira_client.urlopen = counting_unauthorized
+    policy = cojira.jira_cache.CachePolicy(60, 10, 0, 60)
+    for _ in range(2):
+        with pytest.raises(HTTPError):
+            cojira.get_issue('na', 'http://bana', 'bu', policy)
+    assert len(calls) == 2
+
+
+def test_cojira_remembers_unavailable_ticket(tmpdir):
+    calls = []
+
+    def counting_not_found(req):
+        calls.append(req.full_url)
+        not_found(req)
+
+    cojira.jira_client.urlopen = counting_not_found
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABD-123: Banana', encoding='utf-8')
+        for _ in range(3):
+            assert cojira.main(
+                ('pseudo_commit_msg.txt', '-u=http://banana', '-n=60'),
+            ) == 5
+            assert mocked_print.call_args_list[-1].args[0] == \
+                'Ticket does not exist or is not accessible (HTTP 404)'
+    assert calls == [
+        'http://banana/rest/api/latest/issue/ABD-123'
+        '?fields=status%2CfixVersions',
+    ]
+
+
+def test_cojira_unavailable_ticket_without_negative_cache(tmpdir):
+    calls = []
+
+    def counting_not_found(req):
+        calls.append(req.full_url)
+        not_found(req)
+
+    cojira.jira_client.urlopen = counting_not_found
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABD-123: Banana', encoding='utf-8')
+        for _ in range(2):
+            assert cojira.main(
+                ('pseudo_commit_msg.txt', '-u=http://banana', '-c=60'),
+            ) == 5
+    assert len(calls) == 2
+
+
+def test_cojira_revalidates_expired_ticket(tmpdir):
+    requests = []
+
+    def conditional_response(req):
+        requests.append(dict(req.header_items()))
+        if req.get_header('If-none-match') == '"v1"':
+            return MockedResponse('', status=304, headers={'ETag': '"v1"'})
+        return MockedResponse(
+            '{"fields": { "status": {"statusCategory": {"key": "new"}} }}',
+            headers={
+                'ETag': '"v1"',
+                'Last-Modified': 'Mon, 05 Aug 2024 10:00:00 GMT',
+            },
+        )
+
+    cojira.jira_client.urlopen = conditional_response
+    args = ('pseudo_commit_msg.txt', '-u=http://banana', '-c=60')
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        with patch('hooks.jira_cache.time', return_value=1000):
+            assert cojira.main(args) == 0
+        with patch('hooks.jira_cache.time', return_value=1100):
+            assert cojira.main(args) == 0
+        with patch('hooks.jira_cache.time', return_value=1150):
+            assert cojira.main(args) == 0
+    assert len(requests) == 2
+    assert 'If-none-match' not in requests[0]
+    assert requests[1]['If-none-match'] == '"v1"'
+    assert requests[1]['If-modified-since'] == \
+        'Mon, 05 Aug 2024 10:00:00 GMT'
+
+
+def test_cojira_refresh_revalidates(tmpdir):
+    responses = [
+        MockedResponse(
+            '{"fields": { "status": {"statusCategory": {"key": "new"}} }}',
+            headers={'Last-Modified': 'Mon, 05 Aug 2024 10:00:00 GMT'},
+        ),
+        MockedResponse(
+            '{"fields": { "status": {"statusCategory": {"key": "done"}} }}',
+        ),
+        MockedResponse(
+            '{"fields": { "status": {"statusCategory": {"key": "done"}} }}',
+        ),
+    ]
+    requests = []
+
+    def conditional_response(req):
+        requests.append(dict(req.header_items()))
+        return responses.pop(0)
+
+    cojira.jira_client.urlopen = conditional_response
+    for _ in range(3):
+        assert cojira.main(('refresh', 'ABC-123', '-u=http://banana')) == 0
+    assert 'If-modified-since' not in requests[0]
+    assert requests[1]['If-modified-since'] == \
+        'Mon, 05 Aug 2024 10:00:00 GMT'
+    assert 'If-modified-since' not in requests[2]
+
+
+def search_response(issues, page_size=2, filter_keys=True):
+    requests = []
+
+    def respond(req):
+        query = parse_qs(urlsplit(req.full_url).query)
+        requests.append(query)
+        keys = issues
+        if filter_keys:
+            jql = query['jql'][0].removeprefix('key in (').removesuffix(')')
+            keys = jql.split(',')
+        found = [
+            {'key': key, 'fields': issues[key]}
+            for key in keys if key in issues
+        ]
+        start_at = int(query['startAt'][0])
+        return MockedResponse(
+            json.dumps({
+                'startAt': start_at,
+                'total': len(found),
+                'issues': found[start_at:start_at + page_size],
+            }),
+        )
+
+    return respond, requests
+
+
+def init_repo_with_commits(*subjects):
+    exec_cmd('git', 'init')
+    exec_cmd('git', 'config', 'user.email', 'joe@banana.br')
+    exec_cmd('git', 'config', 'user.name', 'Banana Joe')
+    exec_cmd('git', 'commit', '--allow-empty', '-m', 'ABC-1: Base commit')
+    exec_cmd('git', 'tag', 'base')
+    for subject in subjects:
+        exec_cmd('git', 'commit', '--allow-empty', '-m', subject)
+
+
+def test_search_jira_paginates():
+    respond, requests = search_response(
+        {f'ABC-{i}': {} for i in range(1, 6)},
+    )
+    cojira.jira_client.urlopen = respond
+    with patch('hooks.cojira.SEARCH_BATCH', 3):
+        found = cojira.search_jira(
+            [f'ABC-{i}' for i in range(1, 8)], 'http://banana', 'pat',
+        )
+    assert sorted(found) == [f'ABC-{i}' for i in range(1, 6)]
+    assert [(q['jql'][0], q['startAt'][0]) for q in requests] == [
+        ('key in (ABC-1,ABC-2,ABC-3)', '0'),
+        ('key in (ABC-1,ABC-2,ABC-3)', '2'),
+        ('key in (ABC-4,ABC-5,ABC-6)', '0'),
+        ('key in (ABC-7)', '0'),
+    ]
+    assert requests[0]['validateQuery'] == ['warn']
+    assert requests[0]['fields'] == ['status,fixVersions']
+
+
+def test_cojira_range_resolves_tickets_in_one_search(tmpdir):
+    respond, requests = search_response({
+        'ABC-2': {'status': {'statusCategory': {'key': 'indeterminate'}}},
+        'ABC-3': {'status': {'statusCategory': {'key': 'new'}}},
+    })
+    cojira.jira_client.urlopen = respond
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        init_repo_with_commits(
+            'ABC-2: One', 'ABC-3: Two', 'ABC-2: Three\n\nBody',
+        )
+        assert cojira.main(('-r', 'base..HEAD', '-u=http://banana')) == 0
+    assert len(requests) == 1
+    printed = [c.args[0] for c in mocked_print.call_args_list]
+    assert 'Checking ticket "ABC-2" (referenced by 2 commit(s))' in printed
+    assert 'Checking ticket "ABC-3" (referenced by 1 commit(s))' in printed
+
+
+def test_cojira_range_reports_first_failure(tmpdir):
+    respond, _ = search_response({
+        'ABC-2': {'status': {'statusCategory': {'key': 'done'}}},
+    })
+    cojira.jira_client.urlopen = respond
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        init_repo_with_commits('ABC-2: One', 'No ticket', 'ABD-3: Typo')
+        assert cojira.main(('-r', 'base..HEAD', '-u=http://banana')) == 4
+    printed = [c.args[0] for c in mocked_print.call_args_list]
+    assert any(p.startswith('Could not reify ticket from commit ')
+               for p in printed)
+    assert 'Ticket does not exist or is not accessible (HTTP 404)' in printed
+    assert 'Ticket status category ("done") is not allowed' in printed
+
+
+def test_cojira_range_uses_cache(tmpdir):
+    respond, requests = search_response({
+        'ABC-2': {'status': {'statusCategory': {'key': 'new'}}},
+    })
+    cojira.jira_client.urlopen = respond
+    with tmpdir.as_cwd():
+        init_repo_with_commits('ABC-2: One')
+        for _ in range(2):
+            assert cojira.main(
+                ('-r', 'base..HEAD', '-u=http://banana', '-c=60'),
+            ) == 0
+    assert len(requests) == 1
+
+
+def test_cojira_range_refreshes_stale_tickets(tmpdir):
+    respond, requests = search_response({
+        'ABC-2': {'status': {'statusCategory': {'key': 'new'}}},
+    })
+    cojira.jira_client.urlopen = respond
+    args = ('-r', 'base..HEAD', '-u=http://banana', '-c=60', '-s=600')
+    with tmpdir.as_cwd():
+        init_repo_with_commits('ABC-2: One')
+        with patch('hooks.jira_cache.time', return_value=1000):
+            assert cojira.main(args) == 0
+        with (
+            patch('hooks.jira_cache.time', return_value=1200),
+            patch('hooks.cojira.spawn_detached') as mocked_spawn,
+        ):
+            assert cojira.main(args) == 0
+    assert len(requests) == 1
+    mocked_spawn.assert_called_once()
+    assert mocked_spawn.call_args.args[:2] == ('refresh', 'ABC-2')
+
+
+def test_cojira_range_caches_unavailable_tickets(tmpdir):
+    respond, requests = search_response({
+        'ABC-2': {'status': {'statusCategory': {'key': 'new'}}},
+    })
+    cojira.jira_client.urlopen = respond
+    args = ('-r', 'base..HEAD', '-u=http://banana', '-n=60')
+    with tmpdir.as_cwd():
+        init_repo_with_commits('ABC-2: One', 'ABD-3: Typo')
+        for now in (1000, 1030, 1070):
+            with patch('hooks.jira_cache.time', return_value=now):
+                assert cojira.main(args) == 5
+    assert [q['jql'][0] for q in requests] == [
+        'key in (ABC-2,ABD-3)', 'key in (ABC-2)', 'key in (ABC-2,ABD-3)',
+    ]
+
+
+def test_cojira_range_skips_recently_verified_tickets(tmpdir):
+    respond, requests = search_response({
+        'ABC-2': {'status': {'statusCategory': {'key': 'new'}}},
+        'ABC-3': {'status': {'statusCategory': {'key': 'done'}}},
+    })
+    cojira.jira_client.urlopen = respond
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        init_repo_with_commits('ABC-2: One', 'ABC-3: Two')
+        for _ in range(2):
+            assert cojira.main(
+                ('-r', 'base..HEAD', '-u=http://banana', '-g=60'),
+            ) == 1
+    assert [q['jql'][0] for q in requests] == [
+        'key in (ABC-2,ABC-3)', 'key in (ABC-3)',
+    ]
+    printed = [c.args[0] for c in mocked_print.call_args_list]
+    assert printed.count(
+        'Ticket "ABC-2" was verified recently (referenced by 1 commit(s))',
+    ) == 1
+
+
+def test_cojira_range_rejects_unknown_project(tmpdir):
+    respond, requests = search_response({
+        'ABC-2': {'status': {'statusCategory': {'key': 'new'}}},
+    })
+
+    def respond_with_projects(req):
+        if req.full_url.endswith('/rest/api/2/project'):
+            return MockedResponse('[{"key": "ABC"}]')
+        return respond(req)
+
+    cojira.jira_client.urlopen = respond_with_projects
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        init_repo_with_commits('ABC-2: One', 'ABD-2: Two', 'ABD-2: Three')
+        assert cojira.main(
+            (
+                '-r', 'base..HEAD', '-u=http://banana',
+                '--project-keys-ttl=60',
+            ),
+        ) == 5
+        assert [q['jql'][0] for q in requests] == ['key in (ABC-2)']
+        # nothing left to look up
+        exec_cmd('git', 'commit', '--allow-empty', '-m', 'ABD-3: Four')
+        assert cojira.main(
+            (
+                '-r', 'HEAD~1..HEAD', '-u=http://banana',
+                '--project-keys-ttl=60',
+            ),
+        ) == 5
+        assert len(requests) == 1
+    printed = [c.args[0] for c in mocked_print.call_args_list]
+    assert 'Checking ticket "ABD-2" (referenced by 2 commit(s))' in printed
+    assert 'Project of ticket does not exist (did you mean "ABC-2"?)' \
+        in printed
+
+
+def test_cojira_pre_push(tmpdir, monkeypatch):
+    respond, requests = search_response({
+        'ABC-1': {'status': {'statusCategory': {'key': 'new'}}},
+        'ABC-2': {'status': {'statusCategory': {'key': 'new'}}},
+    })
+    cojira.jira_client.urlopen = respond
+    monkeypatch.delenv('PRE_COMMIT_FROM_REF', raising=False)
+    monkeypatch.delenv('PRE_COMMIT_TO_REF', raising=False)
+    with tmpdir.as_cwd():
+        init_repo_with_commits('ABC-2: One')
+        assert cojira.main(('--pre-push', '-u=http://banana')) == 0
+        assert requests[-1]['jql'] == ['key in (ABC-1,ABC-2)']
+        monkeypatch.setenv('PRE_COMMIT_FROM_REF', 'base')
+        monkeypatch.setenv('PRE_COMMIT_TO_REF', 'HEAD')
+        assert cojira.main(('--pre-push', '-u=http://banana')) == 0
+        assert requests[-1]['jql'] == ['key in (ABC-2)']
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(env={}, expected=['HEAD', '--not', '--remotes']),
+        dict(
+            env={'PRE_COMMIT_FROM_REF': '0' * 40, 'PRE_COMMIT_TO_REF': 'abc'},
+            expected=['abc', '--not', '--remotes'],
+        ),
+        dict(
+            env={'PRE_COMMIT_FROM_REF': 'abc', 'PRE_COMMIT_TO_REF': 'def'},
+            expected=['abc..def'],
+        ),
+    ],
+)
+def test_get_push_revisions(monkeypatch, params):
+    monkeypatch.delenv('PRE_COMMIT_FROM_REF', raising=False)
+    monkeypatch.delenv('PRE_COMMIT_TO_REF', raising=False)
+    for name, value in params['env'].items():
+        monkeypatch.setenv(name, value)
+    assert cojira.get_push_revisions() == params['expected']
+
+
+def test_cojira_requires_commit_msg():
+    with pytest.raises(SystemExit) as e:
+        cojira.main(('-u=http://banana',))
+    assert e.value.code == 2
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(msg='', expected=[]),
+        dict(msg='Banana\n\nRefs: ABC-1', expected=[]),
+        dict(msg='ABC-1: Banana', expected=['ABC-1']),
+        dict(
+            msg='ABC-1: Banana\n\nBody mentions ABC-9\n\nRefs: ABC-2, DE-3',
+            expected=['ABC-1', 'ABC-2', 'DE-3'],
+        ),
+        dict(
+            msg='ABC-1: Banana\n\nrefs: ABC-2 ABC-1\nRefs: ABC-2,abc-4',
+            expected=['ABC-1', 'ABC-2'],
+        ),
+        dict(
+            msg='ABC-1: Banana\n\n# Refs: ABC-2\nRefs ABC-3\nFixes: ABC-4',
+            expected=['ABC-1'],
+        ),
+        dict(
+            msg='ABC-1: Banana\n\nRefs: ABC-2\n'
+                '# ------------------------ >8 ------------------------\n'
+                '+Refs: ABC-3\nRefs: ABC-4',
+            expected=['ABC-1', 'ABC-2'],
+        ),
+    ],
+)
+def test_get_message_tickets(params):
+    assert cojira.get_message_tickets(params['msg']) == params['expected']
+
+
+def test_get_message_tickets_custom_trailers():
+    assert cojira.get_message_tickets(
+        'ABC-1: Banana\n\nRefs: ABC-2\nFixes: ABC-3\nSee-also: ABC-4',
+        ('Fixes', 'see-also'),
+    ) == ['ABC-1', 'ABC-3', 'ABC-4']
+
+
+def test_cojira_checks_referenced_tickets_concurrently(tmpdir):
+    barrier = threading.Barrier(3, timeout=5)
+    categories = {'ABC-1': 'new', 'ABC-2': 'indeterminate', 'ABC-3': 'new'}
+
+    def concurrent_response(req):
+        barrier.wait()  # only passes if all three are in flight at once
+        ticket = urlsplit(req.full_url).path.rpartition('/')[2]
+        return MockedResponse(
+            json.dumps({
+                'fields': {
+                    'status': {'statusCategory': {'key': categories[ticket]}},
+                },
+            }),
+        )
+
+    cojira.jira_client.urlopen = concurrent_response
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-1: Banana\n\nRefs: ABC-2, ABC-3', encoding='utf-8')
+        assert cojira.main(
+            ('pseudo_commit_msg.txt', '-u=http://banana', '-w=8'),
+        ) == 0
+    printed = [c.args[0] for c in mocked_print.call_args_list]
+    assert [p for p in printed if p.startswith('Checking')] == [
+        'Checking ticket "ABC-1"',
+        'Checking ticket "ABC-2"',
+        'Checking ticket "ABC-3"',
+    ]
+
+
+def test_cojira_referenced_tickets_report_first_failure(tmpdir):
+    def response(req):
+        if urlsplit(req.full_url).path.endswith('ABC-2'):
+            not_found(req)
+        return mocked_response(req)
+
+    cojira.jira_client.urlopen = response
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text(
+            'ABC-1: Banana\n\nFixes: ABC-2\nRefs: ABC-3', encoding='utf-8',
+        )
+        assert cojira.main(
+            (
+                'pseudo_commit_msg.txt', '-u=http://banana', '-w=1',
+                '-t=Fixes', '-t=Refs', '-v=other',
+            ),
+        ) == 2
+    printed = [c.args[0] for c in mocked_print.call_args_list]
+    assert 'Ticket does not exist or is not accessible (HTTP 404)' in printed
+    assert printed.count(
+        'Fix version of ticket ("version") is not allowed',
+    ) == 2
+
+
+def test_cojira_range_checks_trailers(tmpdir):
+    respond, requests = search_response({
+        'ABC-1': {'status': {'statusCategory': {'key': 'new'}}},
+        'ABC-2': {'status': {'statusCategory': {'key': 'new'}}},
+        'ABC-3': {'status': {'statusCategory': {'key': 'new'}}},
+    })
+    cojira.jira_client.urlopen = respond
+    with tmpdir.as_cwd():
+        init_repo_with_commits('ABC-2: One\n\nRefs: ABC-3, ABC-1')
+        assert cojira.main(('-r', 'base..HEAD', '-u=http://banana')) == 0
+    assert requests[0]['jql'] == ['key in (ABC-1,ABC-2,ABC-3)']
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(args=(), expected=10),
+        dict(args=('--timeout=2.5',), expected=2.5),
+        dict(args=('--timeout=0', '--deadline=0'), expected=None),
+    ],
+)
+def test_cojira_request_timeout(tmpdir, params):
+    timeouts = []
+
+    def response(req):
+        timeouts.append(req.timeout)
+        return mocked_response(req)
+
+    cojira.jira_client.urlopen = response
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        assert cojira.main(
+            ('pseudo_commit_msg.txt', '-u=http://banana', *params['args']),
+        ) == 0
+    assert timeouts == [params['expected']]
+
+
+def refused(_):
+    raise URLError('Connection refused')
+
+
+def service_unavailable(req):
+    raise HTTPError(req.full_url, 503, 'Unavailable', {}, None)
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(u=refused, args=(), expected=6),
+        dict(u=refused, args=('--fail-open',), expected=0),
+        dict(u=service_unavailable, args=(), expected=6),
+    ],
+)
+def test_cojira_jira_not_reachable(tmpdir, params):
+    cojira.jira_client.urlopen = params['u']
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+        patch('hooks.cojira.sleep'),
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-1: Banana\n\nRefs: ABC-2', encoding='utf-8')
+        assert cojira.main(
+            ('pseudo_commit_msg.txt', '-u=http://banana', *params['args']),
+        ) == params['expected']
+    assert mocked_print.call_args_list[0].args[0].startswith(
+        'JIRA is not reachable (',
+    )
+
+
+def test_cojira_deadline_exceeded(tmpdir):
+    cojira.jira_client.urlopen = mocked_response
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+        patch('hooks.jira_client.monotonic', return_value=float('inf')),
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        assert cojira.main(('pseudo_commit_msg.txt', '-u=http://banana')) == 6
+    mocked_print.assert_called_with(
+        'JIRA is not reachable (Deadline for JIRA lookups exceeded)',
+    )
+
+
+def test_cojira_range_jira_not_reachable(tmpdir):
+    cojira.jira_client.urlopen = refused
+    with tmpdir.as_cwd():
+        init_repo_with_commits('ABC-2: One')
+        assert cojira.main(('-r', 'base..HEAD', '-u=http://banana')) == 6
+
+
+def test_cojira_unauthorized_is_not_an_outage(tmpdir):
+    cojira.jira_client.urlopen = unauthorized
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        with pytest.raises(HTTPError):
+            cojira.main(
+                ('pseudo_commit_msg.txt', '-u=http://banana', '--fail-open'),
+            )
+
+
+def test_cojira_circuit_breaker(tmpdir):
+    calls = []
+    responses = [refused, refused, not_found, mocked_response]
+
+    def response(req):
+        calls.append(req.full_url)
+        return responses[len(calls) - 1](req)
+
+    cojira.jira_client.urlopen = response
+    args = (
+        'pseudo_commit_msg.txt', '-u=http://banana',
+        '--breaker-threshold=2', '--breaker-cooldown=60',
+    )
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        with patch('hooks.jira_cache.time', return_value=1000):
+            assert cojira.main(args) == 6
+            assert cojira.main(args) == 6
+            assert len(calls) == 2
+            assert cojira.main(args) == 6
+            assert len(calls) == 2
+            mocked_print.assert_called_with(
+                'JIRA is not reachable (<urlopen error'
+                ' Circuit breaker for JIRA is open>)',
+            )
+        with patch('hooks.jira_cache.time', return_value=1060):
+            # a refusal by JIRA is an answer, hence not counted as failure
+            assert cojira.main(args) == 5
+            assert cojira.main(args) == 0
+    assert len(calls) == 4
+    with closing(cojira.jira_cache.connect()) as db:
+        assert db.execute('SELECT * FROM breaker').fetchall() == []
+
+
+def throttled(retry_after=None):
+    headers = Message()
+    if retry_after:
+        headers['Retry-After'] = retry_after
+
+    def respond(req):
+        raise HTTPError(req.full_url, 429, 'Too Many Requests', headers, None)
+
+    return respond
+
+
+def test_cojira_retries_throttled_request(tmpdir):
+    responses = [throttled('7'), throttled(), mocked_response]
+    calls = []
+
+    def response(req):
+        calls.append(req.full_url)
+        return responses[len(calls) - 1](req)
+
+    cojira.jira_client.urlopen = response
+    with (
+        tmpdir.as_cwd(),
+        patch('hooks.cojira.sleep') as mocked_sleep,
+        patch('hooks.jira_client.random.uniform', return_value=1),
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        assert cojira.main(
+            ('pseudo_commit_msg.txt', '-u=http://banana', '--backoff=0.25'),
+        ) == 0
+    assert len(calls) == 3
+    assert [c.args[0] for c in mocked_sleep.call_args_list] == [7, 0.5]
+
+
+def test_cojira_gives_up_on_throttled_request(tmpdir):
+    calls = []
+
+    def response(req):
+        calls.append(req.full_url)
+        throttled('1')(req)
+
+    cojira.jira_client.urlopen = response
+    with (
+        tmpdir.as_cwd(),
+        patch('hooks.cojira.sleep') as mocked_sleep,
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        assert cojira.main(
+            ('pseudo_commit_msg.txt', '-u=http://banana', '--retries=2'),
+        ) == 6
+    assert len(calls) == 3
+    assert mocked_sleep.call_count == 2
+
+
+def test_cojira_rate_limit(tmpdir):
+    cojira.jira_client.urlopen = mocked_response
+    with (
+        tmpdir.as_cwd(),
+        patch('hooks.cojira.sleep') as mocked_sleep,
+        patch('hooks.jira_cache.time', return_value=1000),
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-1: Banana\n\nRefs: ABC-2, ABC-3', encoding='utf-8')
+        assert cojira.main(
+            (
+                'pseudo_commit_msg.txt', '-u=http://banana', '-w=1',
+                '--rate-limit=2', '--rate-burst=2',
+            ),
+        ) == 0
+    # the third request has to wait for the bucket to be refilled
+    assert [c.args[0] for c in mocked_sleep.call_args_list] == [0.5]
+
+
+def test_cojira_rate_limit_beyond_deadline(tmpdir):
+    calls = []
+
+    def response(req):
+        calls.append(req.full_url)
+        return mocked_response(req)
+
+    cojira.jira_client.urlopen = response
+    with (
+        tmpdir.as_cwd(),
+        patch('hooks.cojira.sleep') as mocked_sleep,
+        patch('hooks.jira_cache.time', return_value=1000),
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-1: Banana\n\nRefs: ABC-2', encoding='utf-8')
+        assert cojira.main(
+            (
+                'pseudo_commit_msg.txt', '-u=http://banana', '-w=1',
+                '--rate-limit=0.1', '--deadline=5',
+            ),
+        ) == 6
+    # the second request would have to wait 10 seconds, it fails instead
+    assert len(calls) == 1
+    mocked_sleep.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(branch='feature/ABC-123-banana', args=(), ticket='ABC-123'),
+        dict(branch='user/joe/ABC-42-banana', args=(), ticket='ABC-42'),
+        dict(
+            branch='team/joe/ABC-42-banana', args=('--two-level=team',),
+            ticket='ABC-42',
+        ),
+        dict(
+            branch='team/ABC-7/banana', args=('--schema=team/{ticket}/*',),
+            ticket='ABC-7',
+        ),
+        dict(
+            branch='story/ABC-8-banana', args=('--branch=story',),
+            ticket='ABC-8',
+        ),
+        dict(branch='story/ABC-8-banana', args=(), ticket=None),
+        dict(branch='main', args=(), ticket=None),
+        dict(branch='feature/banana', args=(), ticket=None),
+    ],
+)
+def test_cojira_post_checkout_prefetches_ticket(tmpdir, params):
+    with tmpdir.as_cwd():
+        exec_cmd('git', 'init')
+        exec_cmd('git', 'checkout', '-b', params['branch'])
+        with patch('hooks.cojira.subprocess.Popen') as mocked_popen:
+            assert cojira.main(
+                (
+                    '--post-checkout', '-u=http://banana', '-c=60',
+                    *params['args'],
+                ),
+            ) == 0
+    if params['ticket']:
+        mocked_popen.assert_called_once()
+        assert mocked_popen.call_args.args[0][3:5] == (
+            'refresh', params['ticket'],
+        )
+    else:
+        mocked_popen.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(env={}, args=()),
+        dict(env={'PRE_COMMIT_CHECKOUT_TYPE': '0'}, args=('-c=60',)),
+    ],
+)
+def test_cojira_post_checkout_without_prefetch(tmpdir, monkeypatch, params):
+    for name, value in params['env'].items():
+        monkeypatch.setenv(name, value)
+    with tmpdir.as_cwd():
+        exec_cmd('git', 'init')
+        exec_cmd('git', 'checkout', '-b', 'feature/ABC-123-banana')
+        with patch('hooks.cojira.subprocess.Popen') as mocked_popen:
+            assert cojira.main(
+                ('--post-checkout', '-u=http://banana', *params['args']),
+            ) == 0
+    mocked_popen.assert_not_called()
+
+
+def test_cojira_post_checkout_invalid_schema(tmpdir, capsys):
+    with tmpdir.as_cwd(), pytest.raises(SystemExit):
+        cojira.main(
+            ('--post-checkout', '-u=http://banana', '-c=60', '--schema=team'),
+        )
+    assert 'must contain {ticket} exactly once' in capsys.readouterr().err
+
+
+def test_cojira_post_checkout_skips_fresh_ticket(tmpdir):
+    cojira.jira_client.urlopen = mocked_response
+    with tmpdir.as_cwd():
+        exec_cmd('git', 'init')
+        exec_cmd('git', 'checkout', '-b', 'feature/ABC-123-banana')
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        assert cojira.main(
+            ('pseudo_commit_msg.txt', '-u=http://banana', '-c=60'),
+        ) == 0
+        with patch('hooks.cojira.subprocess.Popen') as mocked_popen:
+            assert cojira.main(
+                ('--post-checkout', '-u=http://banana', '-c=60'),
+            ) == 0
+    mocked_popen.assert_not_called()
+
+
+@pytest.fixture
+def running_daemon(monkeypatch):
+    # the path of a Unix domain socket is limited to ~100 characters
+    with tempfile.TemporaryDirectory(prefix='cojira') as directory:
+        monkeypatch.setenv('XDG_RUNTIME_DIR', directory)
+        thread = threading.Thread(
+            target=cojira.main, args=(('daemon', '--idle-timeout=0.2'),),
+            daemon=True,
+        )
+        thread.start()
+        while not cojira.jira_daemon.is_running():
+            thread.join(0.01)
+        yield
+        thread.join(5)
+
+
+def test_answer_lookup():
+    cojira.jira_client.urlopen = mocked_response
+    policy = cojira.jira_cache.CachePolicy(60, 10)
+    network = cojira.jira_client.RequestPolicy(5, 30)
+    request = {
+        'ticket': 'ABC-1', 'jira_uri': 'http://banana', 'jira_pat': 'pat',
+        'policy': policy._asdict(), 'network': network._asdict(),
+    }
+    assert cojira.answer_lookup(request) == {'body': json.loads(
+        mocked_response(None).payload,
+    )}
+    cojira.jira_client.urlopen = not_found
+    assert cojira.answer_lookup(
+        {**request, 'ticket': 'ABC-2', 'policy': None, 'network': None},
+    ) == {'code': 404, 'reason': 'test HTTP 404'}
+    cojira.jira_client.urlopen = refused
+    assert cojira.answer_lookup({**request, 'ticket': 'ABC-3'}) == \
+        {'error': '<urlopen error Connection refused>'}
+
+
+def test_cojira_daemon_not_running(tmpdir):
+    cojira.jira_client.urlopen = mocked_response
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        with patch('hooks.cojira.subprocess.Popen') as mocked_popen:
+            assert cojira.main(
+                ('pseudo_commit_msg.txt', '-u=http://banana', '--daemon'),
+            ) == 0
+    assert mocked_popen.call_args.args[0][1:] == (
+        '-m', 'hooks.cojira', 'daemon',
+    )
+
+
+def test_cojira_daemon_spawned_once(tmpdir):
+    cojira.jira_client.urlopen = mocked_response
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text(
+            'ABC-1: Banana\n\nRefs: ABC-2, ABC-3, ABC-4\n', encoding='utf-8',
+        )
+        with patch('hooks.cojira.subprocess.Popen') as mocked_popen:
+            assert cojira.main(
+                ('pseudo_commit_msg.txt', '-u=http://banana', '--daemon'),
+            ) == 0
+    mocked_popen.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    'error', [
+        ConnectionError('The daemon did not answer'),
+        TimeoutError('timed out'),
+    ],
+)
+def test_cojira_daemon_dropped_connection(tmpdir, error):
+    cojira.jira_client.urlopen = mocked_response
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        with (
+            patch('hooks.cojira.jira_daemon.call', side_effect=error),
+            patch('hooks.cojira.subprocess.Popen') as mocked_popen,
+        ):
+            assert cojira.main(
+                ('pseudo_commit_msg.txt', '-u=http://banana', '--daemon'),
+            ) == 0
+    mocked_popen.assert_called_once()
+
+
+def test_cojira_daemon_awaited_until_deadline(tmpdir):
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        with (
+            patch('hooks.cojira.jira_daemon.call') as mocked_call,
+            patch('hooks.cojira.monotonic', return_value=1000),
+            patch('hooks.jira_client.monotonic', return_value=1000),
+        ):
+            mocked_call.return_value = {
+                'body': json.loads(mocked_response(None).payload),
+            }
+            assert cojira.main(
+                (
+                    'pseudo_commit_msg.txt', '-u=http://banana', '--daemon',
+                    '--timeout=2', '--deadline=20',
+                ),
+            ) == 0
+    lookup, timeout = mocked_call.call_args.args
+    assert timeout == 20
+    assert lookup['network']['deadline'] == 20
+    assert lookup['network']['timeout'] == 2
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(u=mocked_response, args=(), expected=0),
+        dict(u=mocked_response, args=('--deadline=0', '-c=60'), expected=0),
+        dict(u=not_found, args=(), expected=5),
+        dict(u=refused, args=(), expected=6),
+    ],
+)
+def test_cojira_daemon(tmpdir, running_daemon, params):
+    calls = []
+
+    def response(req):
+        calls.append(req.timeout)
+        return params['u'](req)
+
+    cojira.jira_client.urlopen = response
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-123: Banana', encoding='utf-8')
+        with patch('hooks.cojira.subprocess.Popen') as mocked_popen:
+            assert cojira.main(
+                (
+                    'pseudo_commit_msg.txt', '-u=http://banana', '--daemon',
+                    *params['args'],
+                ),
+            ) == params['expected']
+    mocked_popen.assert_not_called()
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(issue={}, expected=(None, [])),
+        dict(
+            issue={'fields': {'fixVersions': [{'name': '1.0'}]}},
+            expected=(None, ['1.0']),
+        ),
+        dict(
+            issue={
+                'fields': {
+                    'status': {'statusCategory': {'key': 'done'}},
+                    'fixVersions': [{'name': '1.0'}, {'name': '1.1'}],
+                },
+            },
+            expected=('done', ['1.0', '1.1']),
+        ),
+    ],
+)
+def test_index_entry(params):
+    assert cojira.index_entry(params['issue']) == params['expected']
+
+
+def test_cojira_sync(monkeypatch):
+    monkeypatch.setenv('YYYJIRA_URI', 'http://banana')
+    respond, requests = search_response(
+        {
+            'ABC-1': {'status': {'statusCategory': {'key': 'new'}}},
+            'ABC-2': {
+                'status': {'statusCategory': {'key': 'done'}},
+                'fixVersions': [{'name': '1.0'}],
+            },
+            'ABC-3': {'status': {'statusCategory': {'key': 'done'}}},
+        },
+        filter_keys=False,
+    )
+    cojira.jira_client.urlopen = respond
+    args = ('sync', '-u=$YYYJIRA_URI', '-p=$YYYJIRA_PAT', '-k=ABC')
+    with patch('builtins.print') as mocked_print:
+        with patch('hooks.cojira.time', return_value=1000):
+            assert cojira.main(args) == 0
+        with patch('hooks.cojira.time', return_value=1200):
+            assert cojira.main(args) == 0
+        with patch('hooks.cojira.time', return_value=1300):
+            assert cojira.main((*args, '--full', '--timeout=0')) == 0
+    assert [q['jql'][0] for q in requests] == [
+        'project = "ABC"',
+        'project = "ABC"',
+        'project = "ABC" AND updated >= -5m',
+        'project = "ABC" AND updated >= -5m',
+        'project = "ABC"',
+        'project = "ABC"',
+    ]
+    assert [c.args[0] for c in mocked_print.call_args_list] == [
+        'Synced 3 ticket(s) of project "ABC" (full)',
+        'Synced 3 ticket(s) of project "ABC" (incremental)',
+        'Synced 3 ticket(s) of project "ABC" (full)',
+    ]
+    with closing(cojira.jira_cache.connect()) as db:
+        assert cojira.jira_cache.load_synced_at(db, 'http://banana', 'ABC') \
+            == 1300
+
+
+def sync_index():
+    respond, _ = search_response(
+        {
+            'ABC-1': {'status': {'statusCategory': {'key': 'new'}}},
+            'ABC-2': {
+                'status': {'statusCategory': {'key': 'indeterminate'}},
+                'fixVersions': [{'name': '1.0'}],
+            },
+        },
+        filter_keys=False,
+    )
+    cojira.jira_client.urlopen = respond
+    with patch('builtins.print'):
+        assert cojira.main(('sync', '-u=http://banana', '-k=ABC')) == 0
+    cojira.jira_client.urlopen = refused
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(message='ABC-1: Banana', args=(), expected=0),
+        dict(message='ABC-2: Banana', args=('-v=1.0',), expected=0),
+        dict(message='ABC-1: Banana', args=('-v=1.0',), expected=3),
+        dict(message='ABC-1: Banana\n\nRefs: ABC-9', args=(), expected=5),
+        dict(message='ABC-1: Banana\n\nRefs: DEF-1', args=(), expected=6),
+    ],
+)
+def test_cojira_offline(tmpdir, params):
+    sync_index()
+    with tmpdir.as_cwd():
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text(params['message'], encoding='utf-8')
+        assert cojira.main(
+            (
+                'pseudo_commit_msg.txt', '-u=http://banana', '--offline',
+                *params['args'],
+            ),
+        ) == params['expected']
+
+
+def test_cojira_offline_without_index(tmpdir):
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-1: Banana', encoding='utf-8')
+        assert cojira.main(
+            ('pseudo_commit_msg.txt', '-u=http://banana', '--offline'),
+        ) == 6
+    mocked_print.assert_any_call(
+        'Project of ticket is not in the offline index (cf. cojira sync)',
+    )
+
+
+def test_cojira_range_offline(tmpdir):
+    sync_index()
+    with tmpdir.as_cwd():
+        init_repo_with_commits('ABC-2: One', 'ABC-1: Two')
+        assert cojira.main(
+            ('-r', 'base..HEAD', '-u=http://banana', '-o', '-v=1.0'),
+        ) == 3
+
+
+def test_cojira_timings(tmpdir, monkeypatch):
+    timings = tmpdir.join('timings.jsonl')
+    monkeypatch.setenv('COJIRA_TIMINGS', str(timings))
+    respond, _ = search_response({
+        'ABC-1': {'status': {'statusCategory': {'key': 'new'}}},
+    })
+    cojira.jira_client.urlopen = respond
+    assert sorted(cojira.search_jira(['ABC-1'], 'http://banana', 'pat')) == \
+        ['ABC-1']
+    cojira.jira_client.urlopen = lambda _: MockedResponse('<no json/>')
+    assert cojira.fetch_jira('ABC-1', 'http://banana', 'pat') is None
+    cojira.jira_client.urlopen = lambda _: MockedResponse('', status=304)
+    assert cojira.request_jira('ABC-1', 'http://banana', 'pat').status == 304
+    lines = [json.loads(line) for line in timings.readlines()]
+    assert [t['status'] for t in lines] == [200, 200, 304]
+    assert [t['bytes'] for t in lines[1:]] == [len('<no json/>'), 0]
+    assert all(t['url'] == 'http://mocked' for t in lines)
+    assert all(t['ttfb'] == 0.25 for t in lines)
+    assert all(
+        {'body', 'decode', 'parse'} <= t.keys() for t in lines[:2]
+    )
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(faults=jira_server.Faults(), args=(), expected=0, requests=2),
+        dict(
+            faults=jira_server.Faults(), args=('-v=2.0',), expected=2,
+            requests=2,
+        ),
+        dict(
+            faults=jira_server.Faults(throttle=0.5, retry_after=0, seed=3),
+            args=(), expected=0, requests=3,
+        ),
+        dict(
+            faults=jira_server.Faults(error=1),
+            args=('--retries=1', '--backoff=0'), expected=6, requests=2,
+        ),
+        dict(
+            faults=jira_server.Faults(drop=1), args=(), expected=6,
+            requests=1,
+        ),
+    ],
+)
+def test_cojira_against_stand_in(tmpdir, params):
+    with (
+        jira_server.running(params['faults']) as server,
+        tmpdir.as_cwd(),
+    ):
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('ABC-1: Banana\n\nRefs: ABC-2', encoding='utf-8')
+        assert cojira.main(
+            (
+                'pseudo_commit_msg.txt', f'-u={server.url}', '-p=pat', '-w=1',
+                *params['args'],
+            ),
+        ) == params['expected']
+        jira_client.close_all()
+    assert len(server.requests) >= params['requests']
+    assert all(
+        'fields=status%2CfixVersions' in path for path in server.requests
+    )
+
+
+def test_cojira_range_against_stand_in(tmpdir):
+    with (
+        jira_server.running(issues={'ABC-3': None}) as server,
+        tmpdir.as_cwd(),
+    ):
+        init_repo_with_commits('ABC-2: One', 'ABC-3: Two')
+        assert cojira.main(('-r', 'base..HEAD', f'-u={server.url}')) == 5
+        jira_client.close_all()
+    assert len(server.requests) == 1
+
+
+def test_fetch_jira_cached_single_flight():
+    calls = []
+    barrier = threading.Barrier(4)
+
+    def slow_response(req):
+        calls.append(req.full_url)
+        threading.Event().wait(0.1)
+        return mocked_response(req)
+
+    cojira.jira_client.urlopen = slow_response
+    policy = cojira.jira_cache.CachePolicy(60, 10)
+
+    def lookup(_):
+        barrier.wait()
+        return cojira.fetch_jira_cached('ABC-1', 'http://banana', '', policy)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        bodies = list(executor.map(lookup, range(4)))
+    assert len(calls) == 1
+    assert all(body == bodies[0] for body in bodies)
+    assert cojira.parse_ticket_status_category(bodies[0]) is not None
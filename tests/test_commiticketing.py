@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+import os
 import random
 import subprocess
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Any
 from unittest.mock import patch
 
@@ -137,6 +139,88 @@ def test_get_active_branch_name_during_patch(tmpdir):
         assert commiticketing.get_active_branch_name() == 'to-rebase'
 
 
+def init_repo(branch_name='base'):
+    exec_cmd('git', 'init')
+    exec_cmd('git', 'config', 'user.email', 'joe@banana.br')
+    exec_cmd('git', 'config', 'user.name', 'Banana Joe')
+    exec_cmd('git', 'checkout', '-b', branch_name)
+    exec_cmd('git', 'commit', '--allow-empty', '-m', 'base commit')
+
+
+def test_get_active_branch_name_in_worktree(tmpdir):
+    with tmpdir.as_cwd():
+        init_repo()
+        exec_cmd('git', 'worktree', 'add', '-b', 'feature/ABC-1', 'linked')
+    with tmpdir.join('linked').as_cwd():
+        assert commiticketing.get_active_branch_name() == 'feature/ABC-1'
+        assert commiticketing.get_git_dir().resolve() == \
+            Path(tmpdir, '.git', 'worktrees', 'linked').resolve()
+    with tmpdir.as_cwd():
+        assert commiticketing.get_active_branch_name() == 'base'
+        assert commiticketing.get_git_dir() == Path('.git')
+
+
+def test_get_active_branch_name_in_submodule(tmpdir):
+    # the same layout as `git submodule add` creates
+    with tmpdir.as_cwd():
+        init_repo()
+        Path('.git', 'modules').mkdir()
+        exec_cmd(
+            'git', 'init', '-b', 'feature/ABC-1',
+            '--separate-git-dir', str(Path('.git', 'modules', 'sub')),
+            'sub',
+        )
+        tmpdir.join('sub', '.git').write_text(
+            'gitdir: ../.git/modules/sub\n', encoding='utf-8',
+        )
+    with tmpdir.join('sub').as_cwd():
+        assert commiticketing.get_active_branch_name() == 'feature/ABC-1'
+        assert commiticketing.get_git_dir() == \
+            Path('..', '.git', 'modules', 'sub')
+
+
+def test_get_active_branch_name_with_git_dir(tmpdir, monkeypatch):
+    with tmpdir.as_cwd():
+        exec_cmd('git', 'init', '-b', 'feature/ABC-1', 'elsewhere')
+        monkeypatch.setenv('GIT_DIR', str(Path('elsewhere', '.git')))
+        assert commiticketing.get_active_branch_name() == 'feature/ABC-1'
+        assert commiticketing.get_git_dir() == Path('elsewhere', '.git')
+
+
+@pytest.mark.parametrize('content', ('', 'not a gitdir\n'))
+def test_get_active_branch_name_invalid_git_file(tmpdir, content):
+    with tmpdir.as_cwd():
+        tmpdir.join('.git').write_text(content, encoding='utf-8')
+        assert commiticketing.get_git_dir() is None
+        assert commiticketing.get_active_branch_name() is None
+
+
+def test_get_active_branch_name_detached(tmpdir):
+    with tmpdir.as_cwd():
+        init_repo()
+        exec_cmd('git', 'checkout', '--detach')
+        assert commiticketing.get_active_branch_name() is None
+
+
+def test_get_active_branch_name_during_rebase_apply(tmpdir):
+    with tmpdir.as_cwd():
+        init_repo()
+        exec_cmd('git', 'checkout', '-b', 'to-rebase')
+        f = tmpdir.join('conflicting.txt')
+        f.write_text('Abracadabra', encoding='utf-8')
+        exec_cmd('git', 'add', 'conflicting.txt')
+        exec_cmd('git', 'commit', '-m', '1')
+        exec_cmd('git', 'checkout', 'base')
+        exec_cmd('git', 'checkout', '-b', 'rebase-onto')
+        f.write_text('Bananas', encoding='utf-8')
+        exec_cmd('git', 'add', 'conflicting.txt')
+        exec_cmd('git', 'commit', '-m', '2')
+        exec_cmd('git', 'checkout', 'to-rebase')
+        exec_cmd('git', 'rebase', '--apply', 'rebase-onto', return_code=1)
+        assert Path('.git', 'rebase-apply').is_dir()
+        assert commiticketing.get_active_branch_name() == 'to-rebase'
+
+
 @pytest.mark.parametrize('branch_name', test_set_2)
 def test_get_prefix_no_match(tmpdir, branch_name):
     assert commiticketing.get_prefix(branch_name, []) is None
@@ -415,3 +499,357 @@ def test_prefix_long_with_excluded(tmpdir, params):
             ) == 0
         with open(f) as msg:
             assert msg.readline() == f"{prefix}: {params['infix']}Abracadabra"
+
+
+@pytest.mark.parametrize(
+    'params',
+    [
+        dict(branch='feature/ABC-1', expected=('feature', 'ABC-1')),
+        dict(branch='feature/x/ABC-1', expected=('feature', None)),
+        dict(branch='user/u1/ABC-1-a', expected=('user', 'ABC-1')),
+        dict(branch='user/ABC-1', expected=('user', 'ABC-1')),
+        dict(branch='team/a/ABC-1', expected=('team/a', None)),
+        dict(branch='team/b/ABC-1', expected=None),
+        dict(branch='team/ABC-1/add-gizmo', expected=(None, 'ABC-1')),
+        dict(branch='team/ABC-1/add/gizmo', expected=None),
+        dict(branch='ABC-1_add_gizmo', expected=(None, 'ABC-1')),
+        dict(branch='ABC-1-add-gizmo', expected=None),
+        dict(branch='main', expected=None),
+    ],
+)
+def test_branch_rules(params):
+    rules = commiticketing.compile_rules(
+        frozenset(('feature', 'team/a')), frozenset(('user',)),
+        ('team/{ticket}/*', '{ticket}_*'),
+    )
+    assert rules.match(params['branch']) == params['expected']
+
+
+def test_compile_rules_reuses_compiled_rules():
+    rules = commiticketing.compile_rules(
+        frozenset(f'prefix{i}' for i in range(200)), frozenset(('user',)),
+    )
+    assert commiticketing.compile_rules(
+        frozenset(f'prefix{i}' for i in range(200)), frozenset(('user',)),
+    ) is rules
+    assert rules.match('prefix123/ABC-1-desc') == ('prefix123', 'ABC-1')
+
+
+@pytest.mark.parametrize('schema', ('team/*', '{ticket}/{ticket}'))
+def test_invalid_schema(tmpdir, schema, capsys):
+    f = tmpdir.join('pseudo_commit_msg.txt')
+    f.write_text('Abracadabra', encoding='utf-8')
+    with pytest.raises(SystemExit):
+        commiticketing.main(('-s', schema, str(f)))
+    assert f'Branch schema "{schema}" must contain {{ticket}} exactly once' \
+        in capsys.readouterr().err
+
+
+@pytest.mark.parametrize(
+    'params',
+    [
+        dict(branch='team/ABC-1/add-gizmo', expected='ABC-1: Abracadabra'),
+        dict(branch='ABC-1_add_gizmo', expected='ABC-1: Abracadabra'),
+        dict(branch='hotfix/ABC-1', expected='ABC-1: (hotfix) Abracadabra'),
+    ],
+)
+def test_prefix_custom_schema(tmpdir, params):
+    with tmpdir.as_cwd():
+        exec_cmd('git', 'init')
+        exec_cmd('git', 'checkout', '-b', params['branch'])
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('abracadabra', encoding='utf-8')
+        assert commiticketing.main(
+            (
+                '-s', 'team/{ticket}/*', '-s', '{ticket}_*', '-b', 'hotfix',
+                '-l', str(f),
+            ),
+        ) == 0
+        with open(f) as msg:
+            assert msg.readline() == params['expected']
+
+
+@pytest.mark.parametrize(
+    'params',
+    [
+        dict(
+            message=b'abracadabra\n\nBody\n', branch='feature/ABC-1',
+            expected=b'ABC-1: Abracadabra\n\nBody\n',
+        ),
+        dict(
+            message=b'ABC-1: Abracadabra', branch='feature/ABC-1-desc',
+            expected=b'ABC-1: Abracadabra',
+        ),
+        dict(
+            message=b'abracadabra', branch='main', expected=b'abracadabra',
+        ),
+        dict(
+            message=b'abracadabra', branch='feature/main',
+            expected=b'abracadabra',
+        ),
+        dict(message=b'', branch='feature/ABC-1', expected=b'ABC-1: '),
+        dict(
+            message=b'caf\xe9\n', branch='feature/ABC-1',
+            expected=b'ABC-1: Caf\xe9\n',
+        ),
+    ],
+)
+def test_filter_message(params):
+    assert commiticketing.filter_message(
+        params['message'], params['branch'],
+    ) == params['expected']
+
+
+def test_filter_commit():
+    commit = SimpleNamespace(
+        branch=b'refs/heads/bugfix/ABC-1', message=b'abracadabra\n',
+    )
+    commiticketing.filter_commit(commit, None, long_prefix=True)
+    assert commit.message == b'ABC-1: (bugfix) Abracadabra\n'
+
+
+def get_messages(*revisions):
+    return exec_cmd(
+        'git', 'log', '--format=%s', *revisions, encoding='utf-8',
+    ).splitlines()
+
+
+def test_batch(tmpdir):
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        init_repo('main')
+        exec_cmd('git', 'checkout', '-b', 'feature/ABC-1')
+        f = tmpdir.join('file.txt')
+        f.write_text('Abracadabra', encoding='utf-8')
+        exec_cmd('git', 'add', 'file.txt')
+        exec_cmd('git', 'commit', '-m', 'add file')
+        exec_cmd('git', 'commit', '--allow-empty', '-m', 'ABC-1: Done')
+        exec_cmd('git', 'checkout', '-b', 'bugfix/DEF-2', 'main')
+        exec_cmd('git', 'commit', '--allow-empty', '-m', 'fix\n\nBody')
+        exec_cmd('git', 'checkout', 'main')
+        exec_cmd('git', 'commit', '--allow-empty', '-m', 'on main')
+        assert commiticketing.main(
+            (
+                'batch', '-l', 'main..feature/ABC-1', 'main..bugfix/DEF-2',
+            ),
+        ) == 0
+        assert get_messages('feature/ABC-1') == [
+            'ABC-1: Done', 'ABC-1: Add file', 'base commit',
+        ]
+        assert get_messages('bugfix/DEF-2') == [
+            'DEF-2: (bugfix) Fix', 'base commit',
+        ]
+        assert exec_cmd(
+            'git', 'log', '-1', '--format=%b', 'bugfix/DEF-2',
+            encoding='utf-8',
+        ) == 'Body\n\n'
+        assert get_messages('main') == ['on main', 'base commit']
+        assert exec_cmd(
+            'git', 'show', 'feature/ABC-1~1:file.txt', encoding='utf-8',
+        ) == 'Abracadabra'
+    mocked_print.assert_called_once_with(
+        'Commiticketing prefixed 2 of 3 commit message(s).',
+    )
+
+
+def test_batch_as_branch(tmpdir):
+    with tmpdir.as_cwd():
+        init_repo('main')
+        exec_cmd('git', 'tag', 'imported')
+        exec_cmd('git', 'commit', '--allow-empty', '-m', 'one')
+        exec_cmd('git', 'commit', '--allow-empty', '-m', 'two')
+        assert commiticketing.main(
+            ('batch', '--as-branch', 'feature/ABC-1', 'imported..main'),
+        ) == 0
+        assert get_messages('main') == [
+            'ABC-1: Two', 'ABC-1: One', 'base commit',
+        ]
+
+
+def test_batch_failure(tmpdir):
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        init_repo('feature/ABC-1')
+        assert commiticketing.main(('batch', 'feature/ABC-1', 'nope')) == 1
+        assert get_messages('feature/ABC-1') == ['base commit']
+    mocked_print.assert_called_once_with(
+        'Commiticketing could not rewrite the commit messages.',
+    )
+
+
+def test_batch_from_command_line(tmpdir):
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print'),
+        patch('sys.argv', ['commiticketing', 'batch', 'feature/ABC-1']),
+    ):
+        init_repo('feature/ABC-1')
+        assert commiticketing.main() == 0
+        assert get_messages('feature/ABC-1') == ['ABC-1: Base commit']
+
+
+def test_batch_invalid_schema(tmpdir):
+    with pytest.raises(SystemExit):
+        commiticketing.main(('batch', '-s', 'team/*', 'main'))
+
+
+@pytest.mark.parametrize(
+    'params',
+    [
+        dict(
+            content=b'abracadabra\r\nBody\r\n' + b'diff\n' * 200_000,
+            changed=True,
+            expected=b'ABC-1: Abracadabra\r\nBody\r\n' + b'diff\n' * 200_000,
+        ),
+        dict(
+            content=b'ABC-1: Abracadabra\n' + b'diff\n' * 10,
+            changed=False,
+            expected=b'ABC-1: Abracadabra\n' + b'diff\n' * 10,
+        ),
+        dict(
+            content=b'abracadabra', changed=True,
+            expected=b'ABC-1: Abracadabra',
+        ),
+        dict(content=b'', changed=False, expected=b''),
+    ],
+)
+@pytest.mark.parametrize('copies', ('kernel', 'sendfile', 'chunks'))
+def test_rewrite_subject_line(tmp_path, params, copies):
+    def unsupported(*_):
+        raise OSError('not supported')
+
+    kernel_copies = {
+        'kernel': commiticketing.KERNEL_COPIES,
+        'sendfile': (unsupported, commiticketing._sendfile),
+        'chunks': (unsupported,),
+    }[copies]
+    path = tmp_path / 'COMMIT_EDITMSG'
+    path.write_bytes(params['content'])
+    path.chmod(0o640)
+    before = path.stat()
+    with patch('hooks.commiticketing.KERNEL_COPIES', kernel_copies):
+        assert commiticketing.rewrite_subject_line(
+            str(path), 'ABC-1: ',
+        ) == params['changed']
+    assert path.read_bytes() == params['expected']
+    after = path.stat()
+    assert (after.st_ino == before.st_ino) != params['changed']
+    assert after.st_mode == before.st_mode
+    assert [p.name for p in tmp_path.iterdir()] == ['COMMIT_EDITMSG']
+
+
+def test_rewrite_subject_line_keeps_message_on_failure(tmp_path):
+    path = tmp_path / 'COMMIT_EDITMSG'
+    path.write_bytes(b'abracadabra\nBody\n')
+    with (
+        patch('shutil.copymode', side_effect=PermissionError),
+        pytest.raises(PermissionError),
+    ):
+        commiticketing.rewrite_subject_line(str(path), 'ABC-1: ')
+    assert path.read_bytes() == b'abracadabra\nBody\n'
+    assert [p.name for p in tmp_path.iterdir()] == ['COMMIT_EDITMSG']
+
+
+def test_copy_tail_of_shrunk_file(tmp_path):
+    source = tmp_path / 'source'
+    source.write_bytes(b'subject\nbody\n')
+    with (
+        source.open('rb') as src,
+        (tmp_path / 'target').open('wb') as target,
+        patch('hooks.commiticketing.KERNEL_COPIES', (lambda *_: 0,)),
+    ):
+        commiticketing.copy_tail(src, target, 8)
+    assert (tmp_path / 'target').read_bytes() == b''
+
+
+def test_project_keys():
+    project_keys = commiticketing.ProjectKeys(
+        f'P{i:04d}' for i in range(4000)
+    )
+    assert 'P0000' in project_keys
+    assert 'P3999' in project_keys
+    assert 'P4000' not in project_keys
+    assert 'A' not in project_keys
+    assert 'Z' not in project_keys
+    assert commiticketing.ProjectKeys(('ABC', 'XYZ')).suggest('ABS') == 'ABC'
+    assert commiticketing.ProjectKeys(('ABC', 'XYZ')).suggest('QQQ') is None
+    assert commiticketing.ProjectKeys(()).suggest('ABC') is None
+
+
+def test_load_project_keys(tmp_path):
+    path = tmp_path / 'project-keys.txt'
+    path.write_text('# our projects\nABC\n\n  DEF  \n', encoding='utf-8')
+    project_keys = commiticketing.load_project_keys(str(path))
+    assert project_keys.keys == ('ABC', 'DEF')
+    assert commiticketing.load_project_keys(str(path)) is project_keys
+    path.write_text('XYZ\n', encoding='utf-8')
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert commiticketing.load_project_keys(str(path)).keys == ('XYZ',)
+
+
+@pytest.mark.parametrize(
+    'params',
+    [
+        dict(branch='feature/ABC-12', code=0, printed=None),
+        dict(
+            branch='feature/ABS-12', code=4,
+            printed='[feature/ABS-12] refers to the project [ABS], which is'
+                    ' not on the list of project keys, did you mean [ABC]?',
+        ),
+        dict(
+            branch='user/u1/QQQ-12', code=4,
+            printed='[user/u1/QQQ-12] refers to the project [QQQ], which is'
+                    ' not on the list of project keys.',
+        ),
+    ],
+)
+def test_prefix_with_project_keys(tmpdir, params):
+    tmpdir.join('project-keys.txt').write_text('ABC\nDEF\n', encoding='utf-8')
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print') as mocked_print,
+    ):
+        exec_cmd('git', 'init')
+        exec_cmd('git', 'checkout', '-b', params['branch'])
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('abracadabra', encoding='utf-8')
+        assert commiticketing.main(
+            ('-k', 'project-keys.txt', str(f)),
+        ) == params['code']
+        if params['printed']:
+            mocked_print.assert_called_once_with(params['printed'])
+            assert f.read_text(encoding='utf-8') == 'abracadabra'
+
+
+def test_missing_project_keys(tmpdir, capsys):
+    f = tmpdir.join('pseudo_commit_msg.txt')
+    f.write_text('abracadabra', encoding='utf-8')
+    with tmpdir.as_cwd(), pytest.raises(SystemExit):
+        commiticketing.main(('-k', 'missing.txt', str(f)))
+    assert 'Could not read the project keys' in capsys.readouterr().err
+
+
+def test_batch_with_project_keys(tmpdir):
+    tmpdir.join('project-keys.txt').write_text('ABC\n', encoding='utf-8')
+    with (
+        tmpdir.as_cwd(),
+        patch('builtins.print'),
+    ):
+        init_repo('main')
+        exec_cmd('git', 'checkout', '-b', 'feature/ABS-1')
+        exec_cmd('git', 'commit', '--allow-empty', '-m', 'two')
+        exec_cmd('git', 'checkout', '-b', 'feature/ABC-1', 'main')
+        exec_cmd('git', 'commit', '--allow-empty', '-m', 'one')
+        assert commiticketing.main(
+            (
+                'batch', '-k', 'project-keys.txt', 'main..feature/ABS-1',
+                'main..feature/ABC-1',
+            ),
+        ) == 0
+        assert get_messages('feature/ABS-1') == ['two', 'base commit']
+        assert get_messages('feature/ABC-1') == ['ABC-1: One', 'base commit']
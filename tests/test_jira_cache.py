@@ -0,0 +1,361 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from hooks import jira_cache
+
+
+@pytest.fixture(autouse=True)
+def xdg_cache_home(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    yield tmp_path / 'xdg'
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(xdg='/abs/cache', expected=Path('/abs/cache')),
+        dict(xdg='relative/cache', expected=Path.home() / '.cache'),
+        dict(xdg='', expected=Path.home() / '.cache'),
+    ],
+)
+def test_get_cache_dir(monkeypatch, params):
+    monkeypatch.setenv('XDG_CACHE_HOME', params['xdg'])
+    assert jira_cache.get_cache_dir() == \
+        params['expected'] / 'shellmagick-commit-hooks'
+
+
+def test_connect_creates_cache_dir(xdg_cache_home):
+    with closing(jira_cache.connect()):
+        assert (
+            xdg_cache_home / 'shellmagick-commit-hooks' / 'cojira.sqlite3'
+        ).is_file()
+
+
+def test_connect_resets_outdated_schema(tmp_path):
+    with closing(jira_cache.connect(tmp_path)) as db:
+        db.execute('PRAGMA user_version = 0')
+        db.execute(
+            'INSERT INTO issues (jira_uri, ticket, body, fetched_at,'
+            " accessed_at) VALUES ('u', 't', '{}', 0, 0)",
+        )
+        jira_cache.store_index(
+            db, 'u', 'ABC', {'ABC-1': jira_cache.IndexEntry('new', [])},
+            1000, True,
+        )
+    with closing(jira_cache.connect(tmp_path)) as db:
+        assert db.execute('SELECT * FROM issues').fetchall() == []
+        # the index is not disposable, it survives the reset
+        assert jira_cache.load_synced_at(db, 'u', 'ABC') == 1000
+        assert jira_cache.load_index(db, 'u', ('ABC-1',)) == {
+            'ABC-1': ('new', []),
+        }
+
+
+def test_connect_concurrently(tmp_path):
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def connect():
+        barrier.wait()
+        try:
+            jira_cache.connect(tmp_path).close()
+        except sqlite3.Error as e:  # pragma: no cover
+            errors.append(e)
+
+    threads = [threading.Thread(target=connect) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_load_and_store(tmp_path):
+    policy = jira_cache.CachePolicy(ttl=60, max_entries=10)
+    with closing(jira_cache.connect(tmp_path)) as db:
+        assert jira_cache.load(db, 'http://jira/', 'ABC-1', policy) is None
+        jira_cache.store(db, 'http://jira/', 'ABC-1', {'a': 1}, policy)
+        assert jira_cache.load(db, 'http://jira', 'ABC-1', policy) == \
+            ({'a': 1}, False)
+        assert jira_cache.load(db, 'http://other', 'ABC-1', policy) is None
+        assert jira_cache.load(db, 'http://jira', 'ABC-2', policy) is None
+
+
+def test_load_expired(tmp_path):
+    policy = jira_cache.CachePolicy(ttl=60, max_entries=10)
+    with closing(jira_cache.connect(tmp_path)) as db:
+        with patch('hooks.jira_cache.time', return_value=1000):
+            jira_cache.store(db, 'http://jira', 'ABC-1', {'a': 1}, policy)
+        with patch('hooks.jira_cache.time', return_value=1060):
+            assert jira_cache.load(db, 'http://jira', 'ABC-1', policy) == \
+                ({'a': 1}, False)
+        with patch('hooks.jira_cache.time', return_value=1061):
+            assert jira_cache.load(db, 'http://jira', 'ABC-1', policy) is None
+
+
+def test_store_evicts_least_recently_used(tmp_path):
+    policy = jira_cache.CachePolicy(ttl=60, max_entries=2)
+    with closing(jira_cache.connect(tmp_path)) as db:
+        with patch('hooks.jira_cache.time', return_value=1000):
+            jira_cache.store(db, 'http://jira', 'ABC-1', 1, policy)
+        with patch('hooks.jira_cache.time', return_value=1001):
+            jira_cache.store(db, 'http://jira', 'ABC-2', 2, policy)
+        with patch('hooks.jira_cache.time', return_value=1002):
+            assert jira_cache.load(db, 'http://jira', 'ABC-1', policy) == \
+                (1, False)
+        with patch('hooks.jira_cache.time', return_value=1003):
+            jira_cache.store(db, 'http://jira', 'ABC-3', 3, policy)
+            assert jira_cache.load(db, 'http://jira', 'ABC-1', policy) == \
+                (1, False)
+            assert jira_cache.load(db, 'http://jira', 'ABC-2', policy) is None
+            assert jira_cache.load(db, 'http://jira', 'ABC-3', policy) == \
+                (3, False)
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(now=1060, expected=({'a': 1}, False)),
+        dict(now=1061, expected=({'a': 1}, True)),
+        dict(now=1090, expected=({'a': 1}, True)),
+        dict(now=1091, expected=None),
+    ],
+)
+def test_load_stale(tmp_path, params):
+    policy = jira_cache.CachePolicy(ttl=60, max_entries=10, stale=30)
+    with closing(jira_cache.connect(tmp_path)) as db:
+        with patch('hooks.jira_cache.time', return_value=1000):
+            jira_cache.store(db, 'http://jira', 'ABC-1', {'a': 1}, policy)
+        with patch('hooks.jira_cache.time', return_value=params['now']):
+            assert jira_cache.load(db, 'http://jira', 'ABC-1', policy) == \
+                params['expected']
+
+
+def test_unavailable(tmp_path):
+    policy = jira_cache.CachePolicy(ttl=0, max_entries=10, negative_ttl=30)
+    with closing(jira_cache.connect(tmp_path)) as db:
+        with patch('hooks.jira_cache.time', return_value=1000):
+            assert jira_cache.load_unavailable(
+                db, 'http://jira', 'ABC-1', policy,
+            ) is None
+            jira_cache.store_unavailable(
+                db, 'http://jira/', 'ABC-1', 404, policy,
+            )
+        with patch('hooks.jira_cache.time', return_value=1030):
+            assert jira_cache.load_unavailable(
+                db, 'http://jira', 'ABC-1', policy,
+            ) == 404
+            jira_cache.store_unavailable(
+                db, 'http://jira', 'ABC-2', 403, policy,
+            )
+        with patch('hooks.jira_cache.time', return_value=1031):
+            assert jira_cache.load_unavailable(
+                db, 'http://jira', 'ABC-1', policy,
+            ) is None
+            jira_cache.store_unavailable(
+                db, 'http://jira', 'ABC-3', 403, policy,
+            )
+        assert db.execute(
+            'SELECT ticket FROM unavailable ORDER BY ticket',
+        ).fetchall() == [('ABC-2',), ('ABC-3',)]
+
+
+def test_store_clears_unavailable(tmp_path):
+    policy = jira_cache.CachePolicy(ttl=60, max_entries=10, negative_ttl=30)
+    with closing(jira_cache.connect(tmp_path)) as db:
+        jira_cache.store_unavailable(db, 'http://jira', 'ABC-1', 403, policy)
+        jira_cache.store(db, 'http://jira', 'ABC-1', {'a': 1}, policy)
+        assert jira_cache.load_unavailable(
+            db, 'http://jira', 'ABC-1', policy,
+        ) is None
+
+
+def test_load_validators_and_touch(tmp_path):
+    policy = jira_cache.CachePolicy(ttl=60, max_entries=10)
+    with closing(jira_cache.connect(tmp_path)) as db:
+        with patch('hooks.jira_cache.time', return_value=1000):
+            jira_cache.store(db, 'http://jira', 'ABC-1', {'a': 1}, policy)
+            jira_cache.store(
+                db, 'http://jira', 'ABC-2', {'b': 2}, policy, '"e"', 'lm',
+            )
+        with patch('hooks.jira_cache.time', return_value=2000):
+            assert jira_cache.load_validators(
+                db, 'http://jira', 'ABC-1',
+            ) is None
+            assert jira_cache.load_validators(
+                db, 'http://jira', 'ABC-2',
+            ) == ({'b': 2}, '"e"', 'lm')
+            assert jira_cache.load(db, 'http://jira', 'ABC-2', policy) is None
+            jira_cache.touch(db, 'http://jira', 'ABC-2')
+            assert jira_cache.load(db, 'http://jira', 'ABC-2', policy) == \
+                ({'b': 2}, False)
+
+
+def test_breaker(tmp_path):
+    with closing(jira_cache.connect(tmp_path)) as db:
+        with patch('hooks.jira_cache.time', return_value=1000):
+            assert not jira_cache.is_breaker_open(db, 'http://jira')
+            jira_cache.record_failure(db, 'http://jira/', 2, 60)
+            assert not jira_cache.is_breaker_open(db, 'http://jira')
+            jira_cache.record_failure(db, 'http://jira', 2, 60)
+            assert jira_cache.is_breaker_open(db, 'http://jira/')
+            assert not jira_cache.is_breaker_open(db, 'http://other')
+        with patch('hooks.jira_cache.time', return_value=1060):
+            assert not jira_cache.is_breaker_open(db, 'http://jira')
+            # still failing after the cooldown, re-open immediately
+            jira_cache.record_failure(db, 'http://jira', 2, 60)
+            assert jira_cache.is_breaker_open(db, 'http://jira')
+            jira_cache.record_success(db, 'http://jira')
+            assert not jira_cache.is_breaker_open(db, 'http://jira')
+            jira_cache.record_failure(db, 'http://jira', 2, 60)
+            assert not jira_cache.is_breaker_open(db, 'http://jira')
+
+
+def test_take_token(tmp_path):
+    with closing(jira_cache.connect(tmp_path)) as db:
+        with patch('hooks.jira_cache.time', return_value=1000):
+            assert jira_cache.take_token(db, 'http://jira/', 2, 2) == 0
+            assert jira_cache.take_token(db, 'http://jira', 2, 2) == 0
+            # the bucket is empty, the next slots are reserved in order
+            assert jira_cache.take_token(db, 'http://jira', 2, 2) == 0.5
+            assert jira_cache.take_token(db, 'http://jira', 2, 2) == 1
+            assert jira_cache.take_token(db, 'http://other', 2, 2) == 0
+        with patch('hooks.jira_cache.time', return_value=1010):
+            # refilled, but not beyond the burst
+            assert jira_cache.take_token(db, 'http://jira', 2, 2) == 0
+            assert jira_cache.take_token(db, 'http://jira', 2, 2) == 0
+            assert jira_cache.take_token(db, 'http://jira', 2, 2) == 0.5
+
+
+def test_take_token_refused(tmp_path):
+    with closing(jira_cache.connect(tmp_path)) as db:
+        with patch('hooks.jira_cache.time', return_value=1000):
+            assert jira_cache.take_token(db, 'http://jira', 2, 1, 0.5) == 0
+            # the wait is too long, the bucket does not go into debt for it
+            assert jira_cache.take_token(db, 'http://jira', 2, 1, 0.5) is None
+            assert jira_cache.take_token(db, 'http://jira', 2, 1, 1) == 0.5
+            assert jira_cache.take_token(db, 'http://jira', 2, 1) == 1
+
+
+def test_index(tmp_path):
+    with closing(jira_cache.connect(tmp_path)) as db:
+        assert jira_cache.load_synced_at(db, 'http://jira', 'ABC') is None
+        jira_cache.store_index(
+            db, 'http://jira/', 'ABC', {
+                'ABC-1': jira_cache.IndexEntry('new', []),
+                'ABC-2': jira_cache.IndexEntry('done', ['1.0', '1.1']),
+            }, 1000, True,
+        )
+        assert jira_cache.load_synced_at(db, 'http://jira', 'ABC') == 1000
+        assert jira_cache.load_synced_at(db, 'http://jira', 'DEF') is None
+        # incremental sync keeps the tickets not updated since
+        jira_cache.store_index(
+            db, 'http://jira', 'ABC', {
+                'ABC-2': jira_cache.IndexEntry('done', ['1.1']),
+            }, 2000, False,
+        )
+        assert jira_cache.load_synced_at(db, 'http://jira', 'ABC') == 2000
+        assert jira_cache.load_index(
+            db, 'http://jira', ('ABC-1', 'ABC-2', 'ABC-3'),
+        ) == {
+            'ABC-1': ('new', []),
+            'ABC-2': ('done', ['1.1']),
+        }
+        assert jira_cache.load_index(db, 'http://other', ('ABC-1',)) == {}
+        # full sync drops the tickets not synced anymore
+        jira_cache.store_index(
+            db, 'http://jira', 'ABC', {
+                'ABC-2': jira_cache.IndexEntry('done', ['1.1']),
+            }, 3000, True,
+        )
+        assert jira_cache.load_index(db, 'http://jira', ('ABC-1',)) == {}
+
+
+def test_project_keys(tmp_path):
+    with closing(jira_cache.connect(tmp_path)) as db:
+        assert jira_cache.load_project_keys(db, 'http://jira', 60) is None
+        with patch('hooks.jira_cache.time', return_value=1000):
+            jira_cache.store_project_keys(db, 'http://jira/', {'DEF', 'ABC'})
+        with patch('hooks.jira_cache.time', return_value=1059):
+            assert jira_cache.load_project_keys(db, 'http://jira', 60) == \
+                {'ABC', 'DEF'}
+            assert jira_cache.load_project_keys(db, 'http://other', 60) \
+                is None
+        with patch('hooks.jira_cache.time', return_value=1060):
+            assert jira_cache.load_project_keys(db, 'http://jira', 60) \
+                is None
+
+
+def test_verified(tmp_path):
+    rules = {'allowed': frozenset(), 'disallowed': frozenset(('done',))}
+    with closing(jira_cache.connect(tmp_path)) as db:
+        with patch('hooks.jira_cache.time', return_value=1050):
+            assert not jira_cache.is_verified(
+                db, 'http://jira', 'ABC-1', rules, 60,
+            )
+            jira_cache.store_verified(
+                db, 'http://jira/', ('ABC-1', 'ABC-2'), rules, 60,
+            )
+            assert jira_cache.is_verified(
+                db, 'http://jira', 'ABC-1', rules, 60,
+            )
+            assert not jira_cache.is_verified(
+                db, 'http://other', 'ABC-1', rules, 60,
+            )
+            assert not jira_cache.is_verified(
+                db, 'http://jira', 'ABC-3', rules, 60,
+            )
+            assert not jira_cache.is_verified(
+                db, 'http://jira', 'ABC-1',
+                {**rules, 'version': frozenset(('1.0',))}, 60,
+            )
+        # the next bucket still finds it within the grace window
+        with patch('hooks.jira_cache.time', return_value=1100):
+            assert jira_cache.is_verified(
+                db, 'http://jira', 'ABC-1', rules, 60,
+            )
+        with patch('hooks.jira_cache.time', return_value=1111):
+            assert not jira_cache.is_verified(
+                db, 'http://jira', 'ABC-1', rules, 60,
+            )
+            jira_cache.store_verified(db, 'http://jira', ('ABC-3',), rules, 60)
+        assert db.execute('SELECT COUNT(*) FROM verified').fetchone()[0] == 1
+
+
+def test_single_flight(tmp_path):
+    with jira_cache.single_flight('http://jira', 'ABC-1', 1, tmp_path) as a:
+        assert a
+        with jira_cache.single_flight(
+            'http://jira/', 'ABC-1', 0.05, tmp_path,
+        ) as b:
+            assert not b
+        with jira_cache.single_flight(
+            'http://jira', 'ABC-2', 0.05, tmp_path,
+        ) as c:
+            assert c
+    with jira_cache.single_flight('http://jira', 'ABC-1', 0, tmp_path) as d:
+        assert d
+
+
+def test_single_flight_waits(tmp_path):
+    acquired = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with jira_cache.single_flight('http://jira', 'ABC-1', 1, tmp_path):
+            acquired.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    acquired.wait(5)
+    threading.Timer(0.05, release.set).start()
+    with jira_cache.single_flight('http://jira', 'ABC-1', 5, tmp_path) as a:
+        assert a
+        assert release.is_set()
+    thread.join()
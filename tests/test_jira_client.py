@@ -0,0 +1,400 @@
+from __future__ import annotations
+
+import gzip
+import http.client
+import socket
+import threading
+import time
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.error import URLError
+from urllib.request import Request
+
+import pytest
+
+from hooks import jira_client
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(
+            (self.client_address, self.path, dict(self.headers)),
+        )
+        if self.path == '/redirect':
+            self.reply(302, b'', Location='/plain')
+        elif self.path == '/loop':
+            self.reply(302, b'', Location='/loop')
+        elif self.path == '/missing':
+            self.reply(404, b'{"errorMessages": ["nope"]}')
+        elif self.path == '/hangup':
+            # pretend keep-alive, but close the connection nevertheless
+            self.reply(200, b'{}')
+            self.close_connection = True
+        elif self.path == '/not-modified':
+            self.reply(304, b'', ETag='"v1"')
+        elif self.path == '/slow':
+            time.sleep(0.5)
+            self.reply(200, b'{}')
+        elif self.path == '/large':
+            self.reply(200, b'x' * 100000)
+        elif self.path == '/close':
+            self.reply(200, b'{}', Connection='close')
+        elif 'gzip' in self.headers.get('Accept-Encoding', ''):
+            self.reply(
+                200, gzip.compress(b'{"compressed": true}'),
+                **{'Content-Encoding': 'gzip'},
+            )
+        else:
+            self.reply(200, b'{"compressed": false}')
+
+    def reply(self, status, body, **headers):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.requests = []
+    thread = threading.Thread(
+        target=httpd.serve_forever, args=(0.01,), daemon=True,
+    )
+    thread.start()
+    yield httpd
+    jira_client.close_all()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_proxy(monkeypatch):
+    for name in ('http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY'):
+        monkeypatch.delenv(name, raising=False)
+
+
+def url(server, path):
+    return f'http://127.0.0.1:{server.server_port}{path}'
+
+
+def test_keep_alive_and_gzip(server):
+    for _ in range(3):
+        with jira_client.urlopen(Request(url(server, '/issue'))) as resp:
+            assert resp.status == 200
+            assert resp.getheader('Content-Encoding') == 'gzip'
+            assert resp.info().get_content_type() == 'text/plain'
+            assert resp.read() == b'{"compressed": true}'
+    assert len({address for address, _, _ in server.requests}) == 1
+    assert all(
+        headers['Accept-Encoding'] == 'gzip'
+        for _, _, headers in server.requests
+    )
+
+
+def test_phases(server):
+    with jira_client.urlopen(Request(url(server, '/issue'))) as resp:
+        resp.read()
+    assert set(resp.phases) == {'dns', 'connect', 'ttfb'}
+    assert all(duration >= 0 for duration in resp.phases.values())
+    with jira_client.urlopen(Request(url(server, '/issue'))) as resp:
+        resp.read()
+    # the connection is reused, thus neither resolved nor connected again
+    assert set(resp.phases) == {'ttfb'}
+
+
+def test_connect_tries_every_address(server):
+    port = server.server_port
+    addresses = [
+        (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.2', 1)),
+        (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', port)),
+    ]
+    with patch('socket.getaddrinfo', return_value=addresses):
+        with jira_client.urlopen(Request(url(server, '/issue'))) as resp:
+            assert resp.read() == b'{"compressed": true}'
+    jira_client.close_all()
+    for unreachable in (addresses[:1], []):
+        with (
+            patch('socket.getaddrinfo', return_value=unreachable),
+            pytest.raises(URLError),
+        ):
+            jira_client.urlopen(Request(url(server, '/issue')))
+
+
+def test_headers_and_query_are_sent(server):
+    req = Request(url(server, '/issue?fields=status'))
+    req.add_header('Authorization', 'Bearer pat')
+    with jira_client.urlopen(req) as resp:
+        resp.read()
+    assert server.requests[0][1] == '/issue?fields=status'
+    assert server.requests[0][2]['Authorization'] == 'Bearer pat'
+
+
+def test_partial_read_discards_connection(server):
+    with jira_client.urlopen(Request(url(server, '/large'))) as resp:
+        assert resp.read(1) == b'x'
+    with jira_client.urlopen(Request(url(server, '/issue'))) as resp:
+        resp.read()
+    assert len({address for address, _, _ in server.requests}) == 2
+
+
+def test_not_modified_keeps_connection(server):
+    req = Request(url(server, '/not-modified'))
+    for _ in range(2):
+        with jira_client.urlopen(req) as resp:
+            assert resp.status == 304
+        assert jira_client._idle[jira_client._key(url(server, '/'))]
+    assert len({address for address, _, _ in server.requests}) == 1
+
+
+def test_connection_close_is_honored(server):
+    for _ in range(2):
+        with jira_client.urlopen(Request(url(server, '/close'))) as resp:
+            assert resp.read() == b'{}'
+    assert len({address for address, _, _ in server.requests}) == 2
+
+
+def test_closed_idle_connection_is_replaced(server):
+    with jira_client.urlopen(Request(url(server, '/hangup'))) as resp:
+        assert resp.read() == b'{}'
+    with jira_client.urlopen(Request(url(server, '/issue'))) as resp:
+        assert resp.read() == b'{"compressed": true}'
+    assert len({address for address, _, _ in server.requests}) == 2
+
+
+def test_timeout_of_idle_connection_is_not_retried(server):
+    responses = [
+        jira_client.urlopen(Request(url(server, '/issue'))) for _ in range(2)
+    ]
+    for resp in responses:
+        resp.read()
+        resp.close()
+    assert len(jira_client._idle[jira_client._key(url(server, '/'))]) == 2
+    with pytest.raises(URLError):
+        jira_client.urlopen(Request(url(server, '/slow')), timeout=0.1)
+    assert [path for _, path, _ in server.requests].count('/slow') == 1
+
+
+def test_redirect(server):
+    with jira_client.urlopen(Request(url(server, '/redirect'))) as resp:
+        assert resp.read() == b'{"compressed": true}'
+    assert [path for _, path, _ in server.requests] == ['/redirect', '/plain']
+
+
+def test_too_many_redirects(server):
+    with pytest.raises(HTTPError) as e:
+        jira_client.urlopen(Request(url(server, '/loop')))
+    assert e.value.code == 302
+    assert len(server.requests) == jira_client.MAX_REDIRECTS + 1
+
+
+def test_http_error(server):
+    with pytest.raises(HTTPError) as e:
+        jira_client.urlopen(Request(url(server, '/missing')))
+    assert e.value.code == 404
+    assert e.value.read() == b'{"errorMessages": ["nope"]}'
+    with jira_client.urlopen(Request(url(server, '/issue'))) as resp:
+        resp.read()
+    assert len({address for address, _, _ in server.requests}) == 1
+
+
+def test_timeout_of_request(server):
+    req = Request(url(server, '/issue'))
+    req.timeout = 3
+    with jira_client.urlopen(req) as resp:
+        resp.read()
+    (connection,) = jira_client._idle[
+        ('http', f'127.0.0.1:{server.server_port}')
+    ]
+    assert connection.timeout == 3
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(policy=None, expected=None),
+        dict(policy=jira_client.RequestPolicy(), expected=None),
+        dict(policy=jira_client.RequestPolicy(5), expected=5),
+        dict(policy=jira_client.RequestPolicy(5, 1003), expected=3),
+        dict(policy=jira_client.RequestPolicy(2, 1003), expected=2),
+        dict(policy=jira_client.RequestPolicy(None, 1003), expected=3),
+    ],
+)
+def test_get_timeout(params):
+    with patch('hooks.jira_client.monotonic', return_value=1000):
+        assert jira_client.get_timeout(params['policy']) == params['expected']
+
+
+def test_get_timeout_after_deadline():
+    with (
+        patch('hooks.jira_client.monotonic', return_value=1000),
+        pytest.raises(TimeoutError),
+    ):
+        jira_client.get_timeout(jira_client.RequestPolicy(5, 1000))
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(e=HTTPError('u', 503, 'unavailable', {}, None), expected=True),
+        dict(e=HTTPError('u', 404, 'not found', {}, None), expected=False),
+        dict(e=HTTPError('u', 429, 'throttled', {}, None), expected=True),
+        dict(e=URLError('refused'), expected=True),
+        dict(e=TimeoutError('timed out'), expected=True),
+        dict(e=http.client.RemoteDisconnected('gone'), expected=True),
+        dict(e=ValueError('unknown url type'), expected=False),
+    ],
+)
+def test_is_outage(params):
+    assert jira_client.is_outage(params['e']) == params['expected']
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(value=None, expected=None),
+        dict(value='', expected=None),
+        dict(value='120', expected=120),
+        dict(value='Thu, 01 Jan 1970 00:16:50 GMT', expected=10),
+        dict(value='Thu, 01 Jan 1970 00:16:00 GMT', expected=0),
+        dict(value='soon', expected=None),
+    ],
+)
+def test_get_retry_after(params):
+    with patch('hooks.jira_client.time', return_value=1000):
+        assert jira_client.get_retry_after(params['value']) == \
+            params['expected']
+
+
+def http_error(code, **headers):
+    message = http.client.HTTPMessage()
+    for name, value in headers.items():
+        message[name] = value
+    return HTTPError('u', code, 'error', message, None)
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(e=http_error(429), attempt=0, policy=None, expected=None),
+        dict(
+            e=http_error(404), attempt=0,
+            policy=jira_client.RequestPolicy(retries=3), expected=None,
+        ),
+        dict(
+            e=http_error(429), attempt=3,
+            policy=jira_client.RequestPolicy(retries=3), expected=None,
+        ),
+        dict(
+            e=http_error(429), attempt=2,
+            policy=jira_client.RequestPolicy(retries=3), expected=2,
+        ),
+        dict(
+            e=http_error(503, **{'Retry-After': '5'}), attempt=0,
+            policy=jira_client.RequestPolicy(retries=3), expected=5,
+        ),
+        dict(
+            e=http_error(503, **{'Retry-After': '5'}), attempt=0,
+            policy=jira_client.RequestPolicy(deadline=1004, retries=3),
+            expected=None,
+        ),
+        dict(
+            e=HTTPError('u', 429, 'error', None, None), attempt=0,
+            policy=jira_client.RequestPolicy(deadline=1004, retries=3),
+            expected=0.5,
+        ),
+    ],
+)
+def test_get_backoff(params):
+    with (
+        patch('hooks.jira_client.monotonic', return_value=1000),
+        patch('hooks.jira_client.random.uniform', return_value=1),
+    ):
+        assert jira_client.get_backoff(
+            params['e'], params['attempt'], params['policy'],
+        ) == params['expected']
+
+
+def test_unknown_url_type():
+    with pytest.raises(URLError) as e:
+        jira_client.urlopen(Request('ftp://jira/issue'))
+    assert 'unknown url type: ftp' in str(e.value)
+
+
+def test_connection_refused(server):
+    port = server.server_port
+    server.shutdown()
+    server.server_close()
+    with pytest.raises(URLError):
+        jira_client.urlopen(Request(f'http://127.0.0.1:{port}/issue'))
+
+
+def test_idle_pool_is_bounded(server):
+    responses = [
+        jira_client.urlopen(Request(url(server, '/issue')))
+        for _ in range(jira_client.MAX_IDLE_PER_HOST + 1)
+    ]
+    for resp in responses:
+        resp.read()
+    idle = jira_client._idle[('http', f'127.0.0.1:{server.server_port}')]
+    assert len(idle) == jira_client.MAX_IDLE_PER_HOST
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(env={}, url='https://jira/x', expected=None),
+        dict(
+            env={'https_proxy': 'proxy:3128'}, url='https://jira/x',
+            expected='http://proxy:3128',
+        ),
+        dict(
+            env={'https_proxy': 'http://proxy:3128', 'no_proxy': 'jira'},
+            url='https://jira/x', expected=None,
+        ),
+        dict(
+            env={'http_proxy': 'http://proxy:3128'}, url='https://jira/x',
+            expected=None,
+        ),
+    ],
+)
+def test_get_proxy(monkeypatch, params):
+    monkeypatch.delenv('no_proxy', raising=False)
+    monkeypatch.delenv('NO_PROXY', raising=False)
+    for name, value in params['env'].items():
+        monkeypatch.setenv(name, value)
+    proxy = jira_client.get_proxy(params['url'])
+    assert (proxy.geturl() if proxy else None) == params['expected']
+
+
+def test_get_proxy_headers():
+    assert jira_client.get_proxy_headers(
+        jira_client.urlsplit('http://proxy:3128'),
+    ) == {}
+    assert jira_client.get_proxy_headers(
+        jira_client.urlsplit('http://us%40er:pw@proxy:3128'),
+    ) == {'Proxy-Authorization': 'Basic dXNAZXI6cHc='}
+
+
+def test_https_via_proxy_is_tunneled(monkeypatch):
+    monkeypatch.setenv('https_proxy', 'http://user:pw@proxy:3128')
+    connection, reused = jira_client.checkout('https://jira:8443/x', 1)
+    assert not reused
+    assert isinstance(connection, http.client.HTTPSConnection)
+    assert (connection.host, connection.port) == ('proxy', 3128)
+    assert connection._tunnel_host == 'jira'
+    assert connection._tunnel_port == 8443
+    assert 'Proxy-Authorization' in connection._tunnel_headers
+
+
+def test_http_via_proxy_gets_absolute_url(server, monkeypatch):
+    monkeypatch.setenv('http_proxy', f'127.0.0.1:{server.server_port}')
+    monkeypatch.setenv('no_proxy', '')
+    target = 'http://jira.invalid/issue?x=1'
+    with jira_client.urlopen(Request(target)) as resp:
+        assert resp.read() == b'{"compressed": true}'
+    assert server.requests[0][1] == target
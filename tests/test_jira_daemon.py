@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import fcntl
+import socket
+import tempfile
+import threading
+from pathlib import Path
+
+import pytest
+
+from hooks import jira_daemon
+
+
+@pytest.fixture(autouse=True)
+def runtime_dir(monkeypatch):
+    # the path of a Unix domain socket is limited to ~100 characters
+    with tempfile.TemporaryDirectory(prefix='cojira') as directory:
+        monkeypatch.setenv('XDG_RUNTIME_DIR', directory)
+        yield Path(directory)
+
+
+def start(handler=lambda request: {'echo': request}, idle_timeout=5):
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(
+            jira_daemon.serve(handler, idle_timeout),
+        ),
+        daemon=True,
+    )
+    thread.start()
+    for _ in range(500):
+        if jira_daemon.is_running():
+            break
+        thread.join(0.01)
+    return thread, results
+
+
+@pytest.mark.parametrize(
+    'params', [
+        dict(
+            runtime='/run/user/1000',
+            expected=Path('/run/user/1000/shellmagick-commit-hooks'),
+        ),
+        dict(
+            runtime='relative',
+            expected=Path('/xdg/cache/shellmagick-commit-hooks'),
+        ),
+        dict(
+            runtime='',
+            expected=Path('/xdg/cache/shellmagick-commit-hooks'),
+        ),
+    ],
+)
+def test_get_socket_path(monkeypatch, params):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', params['runtime'])
+    monkeypatch.setenv('XDG_CACHE_HOME', '/xdg/cache')
+    assert jira_daemon.get_socket_path() == params['expected'] / 'cojira.sock'
+
+
+def test_not_running():
+    assert not jira_daemon.is_running()
+    with pytest.raises(jira_daemon.NotRunning):
+        jira_daemon.call({'ticket': 'ABC-1'}, 1)
+
+
+def test_serve_until_idle(runtime_dir):
+    thread, results = start(idle_timeout=0.2)
+    path = jira_daemon.get_socket_path()
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert jira_daemon.call({'ticket': 'ABC-1'}, 1) == \
+        {'echo': {'ticket': 'ABC-1'}}
+    assert jira_daemon.call({'ticket': 'ABC-2'}, 1) == \
+        {'echo': {'ticket': 'ABC-2'}}
+    thread.join(5)
+    assert results == [0]
+    assert not path.exists()
+
+
+def test_serve_only_once(capsys):
+    thread, results = start(idle_timeout=0.2)
+    assert jira_daemon.serve(lambda request: request, 0.2) == 1
+    assert capsys.readouterr().out == 'The daemon is running already\n'
+    thread.join(5)
+    assert results == [0]
+
+
+def test_serve_while_locked(capsys):
+    path = jira_daemon.get_socket_path()
+    path.parent.mkdir(parents=True)
+    path.touch()
+    with open(path.with_suffix('.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert jira_daemon.serve(lambda request: request, 0.2) == 1
+    assert capsys.readouterr().out == 'The daemon is running already\n'
+    assert path.exists()
+
+
+def test_serve_replaces_leftover_socket():
+    path = jira_daemon.get_socket_path()
+    path.parent.mkdir(parents=True)
+    path.touch()
+    thread, results = start(idle_timeout=0.2)
+    assert jira_daemon.call({}, 1) == {'echo': {}}
+    thread.join(5)
+    assert results == [0]
+
+
+def test_call_without_answer():
+    path = jira_daemon.get_socket_path()
+    path.parent.mkdir(parents=True)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(str(path))
+        server.listen()
+
+        def hang_up():
+            connection, _ = server.accept()
+            connection.makefile('rb').readline()
+            connection.close()
+
+        thread = threading.Thread(target=hang_up, daemon=True)
+        thread.start()
+        with pytest.raises(ConnectionError):
+            jira_daemon.call({}, 1)
+        thread.join(5)
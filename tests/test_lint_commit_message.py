@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import json
 from unittest.mock import patch
 
 import pytest
@@ -149,3 +150,60 @@ def test_body_line_relaxed_too_long(tmpdir):
         encoding='utf-8',
     )
     assert lint_commit_message.main(('-bl', '121', str(f))) == 6
+
+
+def test_report_all(tmpdir):
+    with patch('builtins.print') as mocked_print:
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text(
+            'Subject, which is far too long for the configured limit.\n'
+            'Body\n'
+            'Body line, which is too long\n'
+            'Short\n'
+            'Another body line, which is too long\n',
+            encoding='utf-8',
+        )
+        assert lint_commit_message.main(
+            ('-a', '-sl', '50', '-bl', '20', str(f)),
+        ) == 1
+    assert [c.args[0] for c in mocked_print.call_args_list] == [
+        f'{f}:2:1: rule 1: The subject line and body must be separated by'
+        ' an empty line.',
+        f'{f}:1:51: rule 2: The subject line must not be longer than 50,'
+        ' currently it is 57.',
+        f'{f}:1:56: rule 4: The subject line must not end with punctuation.',
+        f'{f}:3:21: rule 6: Wrap lines of the message body after 20'
+        ' characters, currently it is 29 long.'
+        ' The line is: "Body line, which is too long".',
+        f'{f}:5:21: rule 6: Wrap lines of the message body after 20'
+        ' characters, currently it is 37 long.'
+        ' The line is: "Another body line, which is too long".',
+    ]
+
+
+def test_report_all_as_json(tmpdir):
+    with patch('builtins.print') as mocked_print:
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text('Subject.\n\nBody', encoding='utf-8')
+        assert lint_commit_message.main(('-a', '-f', 'json', str(f))) == 4
+    assert [json.loads(c.args[0]) for c in mocked_print.call_args_list] == [
+        {
+            'file': str(f), 'rule': 4, 'line': 1, 'column': 8,
+            'message': 'The subject line must not end with punctuation.',
+        },
+    ]
+
+
+@pytest.mark.parametrize(
+    'params',
+    [
+        dict(content='', code=10),
+        dict(content='Subject\n\nBody', code=0),
+    ],
+)
+def test_report_all_return_code(tmpdir, params):
+    with patch('builtins.print') as mocked_print:
+        f = tmpdir.join('pseudo_commit_msg.txt')
+        f.write_text(params['content'], encoding='utf-8')
+        assert lint_commit_message.main(('-a', str(f))) == params['code']
+    assert mocked_print.call_count == (1 if params['code'] else 0)